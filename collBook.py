@@ -69,7 +69,14 @@ try:
     from reportlab.platypus.doctemplate import LayoutError
     from ui.printlabels import LabelPDF
     from ui.pandastablemodel import PandasTableModel
+    from ui.scopeproxymodel import ScopeProxyModel
+    from ui.refinementworker import guiDispatcher
+    from ui.reviewqueue import reviewQueue, reviewDialog
+    from ui.referencestore import openReference, referenceNameModel
     from ui.locality import locality
+    from ui.requestscheduler import requestScheduler
+    from ui.cachewarmer import cacheWarmer
+    from ui.previewrenderer import previewRenderer
     from PyQt5.QtCore import QFile, Qt
     import qdarkstyle
     from ui.collBookUI import Ui_MainWindow
@@ -180,10 +187,16 @@ class MyWindow(QMainWindow):
         self.statusBar = progressBar(self.status_bar)
         self.statusBar.initProgressBar(self.status_bar)
         self.progress_bar = self.statusBar.progressBar
+        # runs dialogs & other GUI calls on behalf of worker threads
+        self.dispatcher = guiDispatcher(self)
+        # decisions deferred for review, see deferDecision()
+        self.reviewQueue = reviewQueue()
         self.m = PandasTableModel(self)
         self.tree_widget = self.w.tree_widget  # The nav tree widget.
         self.site_tree_widget = self.w.treeWidget_sitesToApply  # site selection tree widget in "all records view"
         self.settings = settingsWindow(self)  # settingsWindow
+        # rate limited web requests, shared by tax and locality
+        self.scheduler = requestScheduler(self.settings)
         self.associatedTaxaWindow = associatedTaxaMainWindow(self)  # associatedTaxaWindow
         self.associatedTaxaWindow.setWindowModality(Qt.ApplicationModal)
         self.lineEdit_sciName = self.w.lineEdit_sciName
@@ -196,9 +209,16 @@ class MyWindow(QMainWindow):
         self.p.initLogoCanvas()  # alter this to happen based on settings changes
         self.pdf_preview = self.w.pdf_preview
         self.pdf_preview.initViewer(self)
+        # renders the previews off of the GUI thread
+        self.previewRenderer = previewRenderer(self)
         self.m.new_Records(True)
-        self.table_view.setModel(self.m)
+        # the proxy presents only the rows within the user's current scope
+        self.proxy = ScopeProxyModel(self)
+        self.proxy.setSourceModel(self.m)
+        self.table_view.setModel(self.proxy)
         self.locality = locality(self, apiKeys.google_API_key)
+        # optionally warms the lookup caches after records are loaded
+        self.cacheWarmer = cacheWarmer(self)
         self.w.action_Open.triggered.connect(self.m.open_CSV)
         self.w.action_Save_As.triggered.connect(self.m.save_CSV)
         self.w.action_New_Records.triggered.connect(self.m.new_Records)
@@ -231,6 +251,7 @@ class MyWindow(QMainWindow):
         self.w.actionTestFunction.triggered.connect(self.userSciNameInput)
         # update the preview window as dataframe changes
         self.m.dataChanged.connect(self.updatePreview)
+        self.m.modelReset.connect(self.updatePreview)
         self.updateAutoComplete()
         self.versionCheck()
         
@@ -315,21 +336,13 @@ class MyWindow(QMainWindow):
         called after tree_widget's selection change """
         # TODO rename this, as it does more than upates tableview. Basically alters scope of user's view
         selType, siteNum, specimenNum = self.getTreeSelectionType()
-        rowsToHide = self.m.getRowsToHide(selType, siteNum, specimenNum)
-        rowNums = range(self.m.rowCount())
-        for row in rowNums:
-            if row not in rowsToHide:
-                self.table_view.showRow(row)
-            else:
-                self.table_view.hideRow(row)
+        self.proxy.setScope(selType, siteNum, specimenNum)
 
         if selType != 'allRec':
-            topVisible = [x for x in rowNums if x not in rowsToHide]
-            try:
-                #TODO make consideration for avoiding this if the last action was an edit.
-                topVisible = min(topVisible)
-                self.table_view.selectRow(topVisible)
-            except ValueError:
+            #TODO make consideration for avoiding this if the last action was an edit.
+            if self.proxy.rowCount() > 0:
+                self.table_view.selectRow(0)  # the top row in scope
+            else:
                 self.table_view.clearSelection()
         self.updatePreview()
         if selType == 'site':
@@ -353,6 +366,8 @@ class MyWindow(QMainWindow):
     def selectTreeWidgetItemByName(self, name):
         """ selects an item on the nav tree_widget. Permits site selection without
         the parenthetical (n) value. ie: 'Site 5' would find 'Site 5 (12)' """
+        if not self.dispatcher.onGuiThread():  # called from a worker thread
+            return self.dispatcher.call(self.selectTreeWidgetItemByName, name)
         iterator = QTreeWidgetItemIterator(self.tree_widget, QTreeWidgetItemIterator.All)
         if name[:5] == 'Site ':  # handle changing record counts at set siteNumbers
             name = name.split('(')[0].strip()
@@ -388,11 +403,11 @@ class MyWindow(QMainWindow):
         a = datetime.now()
         iterCount = 10000
         for i in range(iterCount):
-            listComp = [x for x in range(0, self.m.rowCount()) if not self.table_view.isRowHidden(x)]
+            visibleRows = self.getVisibleRows()
         b = datetime.now()
-        listCompTime = b - a
-        listCompTime = int((listCompTime.total_seconds() / iterCount) * 1000000) # microseconds
-        print(f'listComp = {listCompTime} (µs)')
+        visibleRowsTime = b - a
+        visibleRowsTime = int((visibleRowsTime.total_seconds() / iterCount) * 1000000) # microseconds
+        print(f'visibleRows = {visibleRowsTime} (µs)')
         a = datetime.now()
         for i in range(iterCount):
             treeSel = self.m.getRowsToProcess(*self.getTreeSelectionType())
@@ -403,7 +418,7 @@ class MyWindow(QMainWindow):
 
     def getVisibleRows(self):
         """ returns a list of indicies which are visible """
-        visibleRows = [x for x in range(0, self.m.rowCount()) if not self.table_view.isRowHidden(x)]
+        visibleRows = self.proxy.visibleRows()
         return visibleRows
     
     def getVisibleRowData(self):
@@ -417,15 +432,60 @@ class MyWindow(QMainWindow):
             rowData = None
         return rowData
 
-    def userSciNameInput(self, title = "", message = ""):
-        """ opens a cusotm user dialog and requests a scientificName """
+    def deferDecision(self, kind, message, key=None, changes=None, editable=None):
+        """ if the user opted to defer decisions, and a refinement process is
+        running, queues the decision for review once the process finishes
+        and returns True. Otherwise returns False and the caller should ask
+        as usual."""
+        if not self.settings.get('value_deferDecisions', False):
+            return False
+        if self.m.refinementThread is None:
+            return False
+        self.reviewQueue.add(kind, message, key, changes, editable)
+        return True
+
+    def reviewDecisions(self):
+        """ presents the deferred decisions and returns the accepted ones as
+        a list of (key, changes) tuples."""
+        items = self.reviewQueue.takeAll()
+        if len(items) == 0:
+            return []
+        dlg = reviewDialog(items, self)
+        if dlg.exec_():
+            return dlg.checkedDecisions(verify=self.verifyDecision)
+        return []
+
+    def verifyDecision(self, key, changes):
+        """ verifies a name re-entered while reviewing the deferred decisions,
+        as a name re-entered when asked would be. Returns the changes to
+        apply to the record(s). """
+        i = self.m.keyIndex.recordPosition(*key)
+        if i is None or 'scientificName' not in changes:
+            return changes  # the record was removed or renumbered
+        rowData = self.m.datatable.iloc[i].copy()
+        for col, value in changes.items():
+            rowData[col] = value
+        rowData = self.tax.verifyTaxonomy(rowData)
+        verified = dict(changes)
+        for col in ['scientificName', 'scientificNameAuthorship', 'family']:
+            if col in rowData:
+                verified[col] = rowData[col]
+        return verified
+
+    def userSciNameInput(self, title = "", message = "", suggestion = ""):
+        """ opens a cusotm user dialog and requests a scientificName,
+        optionally prefilled with a suggestion """
+        if not self.dispatcher.onGuiThread():  # called from a worker thread
+            return self.dispatcher.call(self.userSciNameInput, title, message, suggestion)
         dlg = sciNameDialog()
-        res = dlg.textBox(self.wordList, message, title)
+        res = dlg.textBox(self.wordList, message, title, suggestion)
         return res
 
     # TODO for simplicity, move all userASK and userNOTIFY functions into mainWindow and alter calls in other modules to use it.
     def userAsk(self, text, title='', inclHalt=True, retry=False, detailText=None):
         """ a general user dialog with yes / cancel options"""
+        if not self.dispatcher.onGuiThread():  # called from a worker thread
+            return self.dispatcher.call(self.userAsk, text, title, inclHalt, retry, detailText)
         msg = QMessageBox()
         msg.setIcon(QMessageBox.Question)
         msg.setText(text)
@@ -455,6 +515,8 @@ class MyWindow(QMainWindow):
 
 
     def userNotice(self, text, title='', detailText = None, retry=False, inclHalt=True):
+        if not self.dispatcher.onGuiThread():  # called from a worker thread
+            return self.dispatcher.call(self.userNotice, text, title, detailText, retry, inclHalt)
         msg = QMessageBox()
         msg.setIcon(QMessageBox.Warning)
         msg.setText(text)
@@ -530,20 +592,25 @@ class MyWindow(QMainWindow):
                                 saved = True
 
     def testRunLabels(self):
-        """ Tests generating the labels to ensure the contents all fit.
+        """ Tests laying out the labels to ensure the contents all fit.
         Returns True or False depending on test's results."""
-        try:
-            # generate test labels and toss them out. to test for oversize warnings
-            self.p.genLabelPreview(self.getVisibleRowData())
+        rowData = self.getVisibleRowData()
+        if not isinstance(rowData, list):
             return True
-        except LayoutError:
-            msg = QMessageBox()
-            msg.setIcon(QMessageBox.Warning)
-            msg.setText("""The content of one or more of your labels is too large for the label dimentions. Alter your settings, and try again.""")
-            msg.setWindowTitle('Label Generation Error')
-            msg.setStandardButtons(QMessageBox.Ok)
-            msg.exec_()
-            return False
+        # lays out each label without producing a pdf
+        overflowing = self.p.fitCheck(rowData)
+        if len(overflowing) == 0:
+            return True
+        details = '\n'.join(f"{x.get('recordNumber', '')}: {overflow:.1f} mm too tall"
+                            for x, overflow in overflowing)
+        msg = QMessageBox()
+        msg.setIcon(QMessageBox.Warning)
+        msg.setText(f"""The content of {len(overflowing)} of your labels is too large for the label dimentions. Alter your settings, and try again.""")
+        msg.setDetailedText(details)
+        msg.setWindowTitle('Label Generation Error')
+        msg.setStandardButtons(QMessageBox.Ok)
+        msg.exec_()
+        return False
 
     def exportLabels(self, fileName = None):
         """ bundles records up and passes them to printlabels.genPrintLabelPDFs() """
@@ -565,25 +632,10 @@ class MyWindow(QMainWindow):
 
 
     def updatePreview(self):
-        """ updates the pdf preview window """
+        """ updates the pdf preview window. Rapid calls (ie: while typing) are
+        coalesced, and rendered on a worker thread. """
         #TODO modify this to be called from within the pdfviewer class
-        rowData = self.getVisibleRowData()
-        selType, siteNum, specimenNum = self.getTreeSelectionType()
-        errorType = False
-        if (isinstance(rowData, list)) & (selType != 'allRec'):
-            if (selType == 'site') & (len(rowData) > 1):
-                rowData = [rowData[1]]  # only want first row, but other functions expect a list
-            else:
-                rowData = [rowData[0]]
-            try:
-                pdfBytes = self.p.genLabelPreview(rowData)  # retrieves the pdf in Bytes
-            except LayoutError:  # Not enough space on label for the content
-                pdfBytes = None
-                errorType = 'oversize'
-        else:  # there is not appropriate row data to preview
-            pdfBytes = None
-            errorType = 'preview' # display generic "Preview window text"
-        self.pdf_preview.load_preview(pdfBytes, errorType)  # starts the loading display process  
+        self.previewRenderer.request()
         #self.settings.setMaxZoom()
 
     def updatePreviewZoom(self, val):
@@ -592,7 +644,7 @@ class MyWindow(QMainWindow):
         updates the label_zoomLevel's text in MainWindow """
         try:
             self.settings.setMaxZoom()
-            self.updatePreview()  # update the pdfPreview (this could get cpu intensive)
+            self.updatePreview()  # update the pdfPreview (rendered off the GUI thread)
         except AttributeError:
             pass  # It gets called too early on start up, this skips it
 
@@ -600,30 +652,27 @@ class MyWindow(QMainWindow):
         """ updates the Completer's reference text based on the kingdom """
 
         value_Kingdom = self.settings.get('value_Kingdom', 'Plantae')
-        if value_Kingdom == 'Plantae':
-            nameCol = 'complete_name'
-        if value_Kingdom == 'Fungi':
-            nameCol = 'normalized_name'
-        stream = QFile(f':/rc_/{value_Kingdom}_Reference.csv')
-        if stream.open(QFile.ReadOnly):
-            df = StringIO(str(stream.readAll(), 'utf-8'))
-            stream.close()     
+        # the names are read from the same (mmap'd) reference used by taxonomy
+        store = openReference(value_Kingdom)
+        if store is None:
+            return
         # completer.setCompletionMode(QCompleter.InlineCompletion)
 #		completer.maxVisibleItems=10
 #		completer.setCaseSensitivity(Qt.CaseInsensitive)
 		# make the completer selection also erase the text edit
  #       completer.activated.connect(self.cleartext,type=Qt.QueuedConnection)
         
-        wordList = pd.read_csv(df, encoding = 'utf-8', dtype = 'str')
-        wordList = wordList[nameCol].str.capitalize().tolist()
-        self.wordList = sorted(wordList)
+        # a model over the reference's sorted names, rather than a list copy
+        self.wordList = referenceNameModel(store, self)
         
         completer = QCompleter(self.wordList, self.lineEdit_sciName)
         completer.setCaseSensitivity(Qt.CaseInsensitive)
+        completer.setModelSorting(QCompleter.CaseInsensitivelySortedModel)
         self.lineEdit_sciName.setCompleter(completer)
 
         completerAssociated = QCompleter(self.wordList, self.associatedTaxaWindow.lineEdit_newAssociatedTaxa)
         completerAssociated .setCaseSensitivity(Qt.CaseInsensitive)
+        completerAssociated.setModelSorting(QCompleter.CaseInsensitivelySortedModel)
         self.associatedTaxaWindow.associatedMainWin.lineEdit_newAssociatedTaxa.setCompleter(completerAssociated)
        
     def getSelectSitesToApply(self):
@@ -707,14 +756,19 @@ class MyWindow(QMainWindow):
     
 
 # wrap GUI's main loop with the exception logger
-try:
-    app = QtWidgets.QApplication(sys.argv)
-    w = MyWindow()
-    if w.settings.get('value_DarkTheme', False):
-        app.setStyleSheet(qdarkstyle.load_stylesheet_pyqt5())
-    w.show()
-    sys.exit(app.exec_())
-except Exception:
-    # given an exception, log it then handle normally.
-    log_crash()
-    raise
+# guarded, as the label export worker processes import this module
+if __name__ == '__main__':
+    # allows the export workers to start in a frozen (pyinstaller) build
+    from multiprocessing import freeze_support
+    freeze_support()
+    try:
+        app = QtWidgets.QApplication(sys.argv)
+        w = MyWindow()
+        if w.settings.get('value_DarkTheme', False):
+            app.setStyleSheet(qdarkstyle.load_stylesheet_pyqt5())
+        w.show()
+        sys.exit(app.exec_())
+    except Exception:
+        # given an exception, log it then handle normally.
+        log_crash()
+        raise
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compares the per label cost of building label PDFs when the ParagraphStyles
+are rebuilt on every stylesheet() call (as previously) against building them
+once per settings change (see LabelPDF.compileStyles in ui/printlabels.py).
+Also times repeated previews of unchanged records, which reuse the cached
+label tables (see LabelPDF.labelTable).
+
+usage: python benchmarkLabels.py [labels]
+Synthetic records are used, the default settings are those of a new install.
+"""
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from ui.printlabels import LabelPDF
+
+
+class benchmarkSettings():
+    """ the portion of the settingsWindow used by LabelPDF """
+    def __init__(self):
+        self.values = {'value_X': 140, 'value_Y': 90, 'value_RelFont': 12,
+                       'value_fontName': 'Helvetica', 'value_inc_Associated': True,
+                       'value_max_Associated': 10, 'value_inc_VerifiedBy': True,
+                       'value_VerifiedBy': 'A. Botanist', 'value_inc_CollectionName': True,
+                       'value_CollectionName': 'Benchmark Herbarium'}
+        self.dummyCatNumber = False
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def setValue(self, key, value):
+        self.values[key] = value
+
+
+def syntheticLabels(count):
+    """ returns count label dictionaries, formatted as the table model does """
+    labels = []
+    for i in range(count):
+        labels.append({'catalogNumber': f'BENCH{i:06d}',
+                       'specimenNumber': str(i % 10 + 1),
+                       'siteNumber': str(i // 10 + 1),
+                       'recordNumber': f'{i // 10 + 1}-{i % 10 + 1}',
+                       'family': 'Asteraceae',
+                       'scientificName': f'Genus{i % 40} species{i}',
+                       'scientificNameAuthorship': 'L.',
+                       'associatedTaxa': 'Quercus alba, Acer rubrum, Pinus taeda',
+                       'locality': 'Along the trail north of the field station, ' * 2,
+                       'habitat': 'Mixed hardwood forest on a north facing slope.',
+                       'country': 'United States of America',
+                       'stateProvince': 'North Carolina',
+                       'county': 'Watauga',
+                       'municipality': 'Boone',
+                       'decimalLatitude': '36.2168',
+                       'decimalLongitude': '-81.6746',
+                       'coordinateUncertaintyInMeters': '10',
+                       'minimumElevationInMeters': '1000',
+                       'recordedBy': 'C. Powell',
+                       'associatedCollectors': 'J. Smith',
+                       'eventDate': '2026-10-18',
+                       'Label Project': 'Benchmark Trip'})
+    return labels
+
+
+def benchmark(count=100):
+    labels = syntheticLabels(count)
+    uncachedSettings = benchmarkSettings()
+    uncachedSettings.setValue('value_labelCacheSize', 0)
+    compiled = LabelPDF(uncachedSettings)
+    rebuilt = LabelPDF(uncachedSettings)
+    cached = LabelPDF(benchmarkSettings())
+    # the previous behavior, every stylesheet() call built all of the styles
+    rebuilt.stylesheet = lambda key: rebuilt.buildStyles().get(key)
+
+    def perLabel(pdf):
+        # one label at a time, as the previews are generated
+        return [pdf.genPrintLabelPDFs([dict(x)], returnBytes=True) for x in labels]
+
+    perLabel(compiled)  # warm up reportlab's font caches
+    rebuiltTime = timeit.timeit(lambda: perLabel(rebuilt), number=1)
+    compiledTime = timeit.timeit(lambda: perLabel(compiled), number=1)
+    batchTime = timeit.timeit(
+        lambda: compiled.genPrintLabelPDFs([dict(x) for x in labels], returnBytes=True), number=1)
+    perLabel(cached)  # the first previews, filling the cache
+    cachedTime = timeit.timeit(lambda: perLabel(cached), number=1)
+    fitTime = timeit.timeit(lambda: cached.fitCheck(labels), number=1)
+
+    print(f'labels: {count}')
+    print(f'styles rebuilt per call, per label:  {rebuiltTime / count * 1000:.2f} (ms)')
+    print(f'styles compiled once, per label:     {compiledTime / count * 1000:.2f} (ms)')
+    print(f'styles compiled once, one pdf batch: {batchTime / count * 1000:.2f} (ms)')
+    print(f'repeated previews, cached tables:    {cachedTime / count * 1000:.2f} (ms)')
+    print(f'fitCheck, cached tables:             {fitTime / count * 1000:.2f} (ms)')
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    benchmark(count)
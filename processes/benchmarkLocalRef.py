@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compares the per record cost of local ITIS / MycoBank alignments using the
+previous full DataFrame scans against the indexed lookups of the built
+reference (see ui/referencestore.py).
+
+usage: python benchmarkLocalRef.py [path/to/Plantae_Reference.csv] [lookups]
+If no reference csv is given, a synthetic ITIS styled reference is used.
+Run from within the development environment (where Resources_rc is built).
+"""
+import sys
+import random
+import timeit
+from pathlib import Path
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from ui.taxonomy import taxonomicVerification
+from ui.referencestore import buildReference, referenceStore
+
+
+def syntheticReference(rowCount=150000):
+    """ returns an ITIS styled reference with rowCount rows, about 1/4 of
+    which are synonyms of an accepted name. """
+    random.seed(1)
+    tsns = [str(x) for x in range(rowCount)]
+    names = [f'genus{x // 10} species{x}' for x in range(rowCount)]
+    accepted = [x if random.random() > 0.25 else random.choice(tsns) for x in tsns]
+    df = pd.DataFrame({'tsn': tsns,
+                       'complete_name': [x.capitalize() for x in names],
+                       'normalized_name': names,
+                       'tsn_accepted': accepted,
+                       'taxon_author_id': ['Author'] * rowCount,
+                       'family': ['Familyaceae'] * rowCount})
+    return df
+
+
+def scanITISLocal(df, inputStr):
+    """ the previous getITISLocal implementation, two full scans """
+    result = (None, None, None)
+    try:
+        tsn_accepted = df[df['normalized_name'] == inputStr]['tsn_accepted'].values[0]
+    except IndexError:
+        return result
+    acceptedRow = df[df['tsn'] == tsn_accepted]
+    if len(acceptedRow) > 0:
+        result = (acceptedRow['complete_name'].values[0],
+                  acceptedRow['taxon_author_id'].values[0],
+                  acceptedRow['family'].values[0])
+    return result
+
+
+def benchmark(df, lookups=200):
+    tax = taxonomicVerification.__new__(taxonomicVerification)
+    a = timeit.default_timer()
+    data = buildReference(df)
+    buildTime = timeit.default_timer() - a
+    a = timeit.default_timer()
+    tax.local_Reference = referenceStore(data)
+    openTime = timeit.default_timer() - a
+    names = random.sample(list(df['normalized_name'].dropna()), lookups)
+
+    scanTime = timeit.timeit(lambda: [scanITISLocal(df, x) for x in names], number=1)
+    indexTime = timeit.timeit(lambda: [tax.getITISLocal(x) for x in names], number=1)
+    # be sure both methods agree
+    for name in names:
+        assert scanITISLocal(df, name) == tax.getITISLocal(name), name
+
+    print(f'reference rows: {len(df)}, lookups: {lookups}')
+    print(f'reference build (once, by the builders): {buildTime * 1000:.1f} ms')
+    print(f'reference open (each kingdom load): {openTime * 1000:.1f} ms')
+    print(f'scan per record:  {scanTime / lookups * 1000000:.1f} (µs)')
+    print(f'index per record: {indexTime / lookups * 1000000:.1f} (µs)')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        reference = pd.read_csv(sys.argv[1], encoding='utf-8', dtype='str')
+    else:
+        reference = syntheticReference()
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    benchmark(reference, lookups)
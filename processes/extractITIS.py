@@ -9,9 +9,14 @@ Created to extract and simplify data from a SQL db provided by ITIS for use
 as a local taxanomic alignment reference.
 
 """
+import sys
+from pathlib import Path
 import pandas as pd
 import sqlite3
 import re
+# the binary reference format is defined alongside the program which reads it
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from ui.referencestore import writeReference
 # This block only necessary to generate the itis_Taxonomy_Reference.csv
 # dumps itis sql db to csvs
 
@@ -175,4 +180,6 @@ itisAlignmentRef = mergeITISCsvs(csvLoc, 3)
 strCleaningRegex = re.compile('[^a-zA-Z ]')
 itisAlignmentRef['normalized_name'] = itisAlignmentRef['complete_name'].transform(normalizeStrInput)
 # save it all
-itisAlignmentRef.to_csv('Plantae_Reference.csv', index = False, encoding = 'utf-8')
\ No newline at end of file
+itisAlignmentRef.to_csv('Plantae_Reference.csv', index = False, encoding = 'utf-8')
+# and the memory mappable reference, to be placed in ui/resources/
+writeReference(itisAlignmentRef, 'Plantae_Reference.ref', 'Plantae_Reference.csv')
\ No newline at end of file
@@ -12,9 +12,14 @@ Source of material: http://www.mycobank.org/
 import requests
 import zipfile
 import io
+import sys
+from pathlib import Path
 import pandas as pd
 import numpy as np
 import re
+# the binary reference format is defined alongside the program which reads it
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from ui.referencestore import writeReference
 
 retrieve_from_url = False
 test_sample = False
@@ -98,6 +103,7 @@ if test_sample:
     sample_df.sort_values(by=['Year_of_effective_publication'], ascending=False, inplace=True)
     df.fillna('', inplace = True)
     sample_df.to_csv('sample_Fungi_Reference.csv', encoding = 'utf8', index = False)
+    writeReference(sample_df, 'sample_Fungi_Reference.ref', 'sample_Fungi_Reference.csv')
 else:
     df['normalized_name'] = df['Taxon_name'].transform(normalizeStrInput)
     df = df.apply(extractFamily, axis=1)
@@ -106,4 +112,6 @@ else:
     # sort by publication year most recent at the top
     df.sort_values(by=['Year_of_effective_publication'], ascending=False, inplace=True)
     df.fillna('', inplace = True)
-    df.to_csv('Fungi_Reference.csv', encoding = 'utf8', index = False)
\ No newline at end of file
+    df.to_csv('Fungi_Reference.csv', encoding = 'utf8', index = False)
+    # and the memory mappable reference, to be placed in ui/resources/
+    writeReference(df, 'Fungi_Reference.ref', 'Fungi_Reference.csv')
\ No newline at end of file
@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared setup for the unit tests, run with: python -m pytest tests
+The tests cover the logic which needs no running Qt application. Tests for
+modules whose dependencies are not installed are skipped.
+"""
+import sys
+from pathlib import Path
+
+# so the ui package imports as it does for collBook.py
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
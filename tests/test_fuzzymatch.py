@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the offline approximate name matching (ui/fuzzymatch.py)
+"""
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('PyQt5')
+from ui.fuzzymatch import editDistance, trigrams, trigramIndex, fuzzyIndex
+from ui.referencestore import buildReference, referenceStore
+
+
+@pytest.mark.parametrize('a, b, distance', [
+    ('', '', 0),
+    ('', 'abc', 3),
+    ('Acer', 'Acer', 0),
+    ('Acer', 'Aser', 1),  # substitution
+    ('Acer', 'Acr', 1),  # deletion
+    ('Acer', 'Acerr', 1),  # insertion
+    ('kitten', 'sitting', 3)])
+def test_edit_distance(a, b, distance):
+    assert editDistance(a, b) == distance
+    assert editDistance(b, a) == distance
+
+
+def test_edit_distance_stops_past_max():
+    assert editDistance('Quercus alba', 'Zea mays', maxDistance=2) == 3
+    assert editDistance('Acer', 'Acer rubrum', maxDistance=3) == 4
+    assert editDistance('Acer', 'Aser', maxDistance=2) == 1
+
+
+def test_trigrams_are_padded():
+    assert trigrams('ab') == {'  a', ' ab', 'ab '}
+
+
+@pytest.fixture
+def store():
+    df = pd.DataFrame({'normalized_name': ['Quercus alba', 'Quercus rubra', 'Acer rubrum',
+                                           'Acer saccharum', '', 'Zea mays'],
+                       'tsn': ['1', '2', '3', '4', '5', '6']})
+    return referenceStore(buildReference(df))
+
+
+def test_candidates_nearest_first(store):
+    index = trigramIndex(store)
+    assert index.candidates('Quercus albba') == [(1, 'Quercus alba'), (3, 'Quercus rubra')]
+    assert index.candidates('Quercus albba', maxDistance=2) == [(1, 'Quercus alba')]
+    assert index.candidates('Acer rubrm', maxDistance=7) == [(1, 'Acer rubrum'), (6, 'Quercus rubra'),
+                                                             (7, 'Acer saccharum')]
+    assert index.candidates('Acer rubrm', limit=1, maxDistance=7) == [(1, 'Acer rubrum')]
+
+
+def test_candidates_without_match(store):
+    index = trigramIndex(store)
+    assert index.candidates('xyz') == []
+    assert index.candidates('Zea maize', maxDistance=1) == []
+
+
+def test_fuzzy_index_built_once(store):
+    assert fuzzyIndex(None) is None
+    index = fuzzyIndex(store)
+    assert fuzzyIndex(store) is index
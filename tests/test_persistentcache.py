@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the SQLite backed persistentCache (ui/persistentcache.py)
+"""
+import pytest
+
+pytest.importorskip('PyQt5')
+import ui.persistentcache as persistentcache
+from ui.persistentcache import persistentCache
+
+
+class fakeClock():
+    """ stands in for the time module, advancing one second per call """
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = fakeClock()
+    monkeypatch.setattr(persistentcache, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    cache = persistentCache(tmp_path / 'cache.sqlite')
+    yield cache
+    cache.close()
+
+
+def test_round_trip(cache):
+    cache.set(('COL', 'Plantae', 'Acer rubrum'), ['Acer rubrum', 'L.', 'Sapindaceae'])
+    assert cache.get(('COL', 'Plantae', 'Acer rubrum')) == ['Acer rubrum', 'L.', 'Sapindaceae']
+    assert cache.get(('COL', 'Plantae', 'Acer saccharum')) is None
+    assert cache.get(('COL', 'Plantae', 'Acer saccharum'), 'missing') == 'missing'
+
+
+def test_entries_persist(tmp_path, clock):
+    fileName = tmp_path / 'cache.sqlite'
+    cache = persistentCache(fileName)
+    cache.set('key', 'value')
+    cache.close()
+    cache = persistentCache(fileName)
+    assert cache.get('key') == 'value'
+    cache.close()
+
+
+def test_delete_and_clear(cache):
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.delete('a')
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    cache.clear()
+    assert cache.get('b') is None
+
+
+def test_expired_entries_are_missing(cache, clock):
+    cache.set('key', 'value')
+    assert cache.get('key') == 'value'
+    clock.now += cache.ttlDays * 86400
+    assert cache.get('key') is None
+
+
+def test_least_recently_used_are_evicted(cache):
+    cache.evictEvery = 1
+    cache.setLimits(ttlDays=30, maxEntries=3)
+    for key in ['a', 'b', 'c']:
+        cache.set(key, key)
+    cache.get('a')  # now more recently used than b and c
+    cache.set('d', 'd')
+    assert cache.get('b') is None
+    assert [cache.get(x) for x in ['a', 'c', 'd']] == ['a', 'c', 'd']
+
+
+def test_falls_back_to_memory(tmp_path, clock):
+    blocker = tmp_path / 'notAFolder'
+    blocker.write_text('')
+    cache = persistentCache(blocker / 'cache.sqlite')
+    assert cache.db is None
+    cache.set('key', 'value')
+    assert cache.get('key') == 'value'
+    cache.delete('key')
+    assert cache.get('key') is None
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the label table cache keys and settings snapshots (ui/printlabels.py)
+"""
+import pickle
+import pytest
+
+pytest.importorskip('reportlab')
+pytest.importorskip('PIL')
+pytest.importorskip('PyQt5')
+from ui.printlabels import contentHash, labelSettings, labelFields
+
+
+def test_content_hash_is_stable():
+    record = ['Acer rubrum', 'L.', 'Sapindaceae']
+    assert contentHash(record) == contentHash(list(record))
+    assert len(contentHash(record)) == 32
+    int(contentHash(record), 16)  # hexadecimal
+
+
+def test_content_hash_distinguishes_values():
+    assert contentHash(['a', 'b']) != contentHash(['b', 'a'])
+    assert contentHash(['a', 'b']) != contentHash(['ab', ''])
+    assert contentHash(['', '']) != contentHash([''])
+    assert contentHash(['Évodia']) != contentHash(['Evodia'])
+    assert contentHash([12, 140]) != contentHash([1, 2140])
+
+
+def test_label_fields_are_unique():
+    assert len(labelFields) == len(set(labelFields))
+
+
+class windowSettings():
+    """ the portion of the settingsWindow read by labelSettings.fromSettings """
+    def __init__(self, values):
+        self.values = values
+        self.dummyCatNumber = 'UNIQUE0001'
+        self.settings = self
+
+    def allKeys(self):
+        return list(self.values)
+
+    def get(self, key, altValue=''):
+        return self.values.get(key, altValue)
+
+
+def test_settings_snapshot():
+    window = windowSettings({'value_X': 140, 'value_fontName': 'Helvetica',
+                             'value_inc_Logo': False, 'value_geometry': object()})
+    snapshot = labelSettings.fromSettings(window)
+    assert snapshot.values == {'value_X': 140, 'value_fontName': 'Helvetica',
+                               'value_inc_Logo': False}
+    assert snapshot.dummyCatNumber == 'UNIQUE0001'
+    assert snapshot.get('value_Y', 90) == 90
+    # later changes to the window are not seen by the snapshot
+    window.values['value_X'] = 100
+    assert snapshot.get('value_X') == 140
+    assert labelSettings.fromSettings(snapshot) is snapshot
+    copied = pickle.loads(pickle.dumps(snapshot))
+    assert copied.values == snapshot.values
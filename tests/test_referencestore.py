@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the built taxonomic references (ui/referencestore.py)
+"""
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('PyQt5')
+from ui.referencestore import buildReference, writeReference, referenceStore
+
+
+def itisReference():
+    return pd.DataFrame({
+        'normalized_name': ['Quercus alba', 'Acer rubrum', 'Zea mays', 'Acer rubrum', 'Évodia'],
+        'tsn': ['19290', '28728', '42268', '28729', '500'],
+        'complete_name': ['Quercus alba', 'acer Rubrum', 'Zea mays', 'Acer rubrum', 'Évodia'],
+        'taxon_author': ['L.', None, 'L.', 'L.', '']})
+
+
+@pytest.fixture
+def store():
+    return referenceStore(buildReference(itisReference()))
+
+
+def test_values(store):
+    assert len(store) == 5
+    assert store.value(2, 'normalized_name') == 'Zea mays'
+    assert store.value(4, 'normalized_name') == 'Évodia'
+    assert store.value(1, 'taxon_author') == ''  # missing values are empty
+    assert store.value(0, 'notAColumn', 'default') == 'default'
+
+
+def test_find_first(store):
+    assert store.findFirst('name', 'Zea mays') == 2
+    assert store.findFirst('name', 'Évodia') == 4
+    assert store.findFirst('accepted', '28729') == 3
+    assert store.findFirst('name', 'Zea') is None
+    assert store.findFirst('name', '') is None
+    assert store.findFirst('notAnIndex', 'Zea mays') is None
+
+
+def test_find_first_prefers_earlier_duplicates(store):
+    assert store.findFirst('name', 'Acer rubrum') == 1
+
+
+def test_display_index_ignores_case(store):
+    _, permutation = store.indexes['display']
+    names = [store.value(x, 'complete_name') for x in permutation]
+    assert names == ['acer Rubrum', 'Acer rubrum', 'Quercus alba', 'Zea mays', 'Évodia']
+
+
+def test_mycobank_reference_indexes_accepted_name():
+    df = pd.DataFrame({'normalized_name': ['Amanita muscaria'],
+                       'Accepted_name': ['Amanita muscaria']})
+    store = referenceStore(buildReference(df))
+    assert store.findFirst('accepted', 'Amanita muscaria') == 0
+    assert store.indexes['display'][0] == 'normalized_name'
+
+
+def test_written_reference_opens_with_mmap(tmp_path):
+    source = tmp_path / 'itis.csv'
+    itisReference().to_csv(source, index=False)
+    fileName = tmp_path / 'itis.ref'
+    writeReference(itisReference(), fileName, source)
+    store = referenceStore.open(fileName)
+    assert store.sourceSize == source.stat().st_size
+    assert store.findFirst('name', 'Quercus alba') == 0
+
+
+def test_rejects_other_files():
+    with pytest.raises(ValueError):
+        referenceStore(b'not a reference at all')
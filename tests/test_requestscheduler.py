@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the token bucket rate limit (ui/requestscheduler.py)
+"""
+import pytest
+
+pytest.importorskip('requests')
+import ui.requestscheduler as requestscheduler
+from ui.requestscheduler import tokenBucket
+
+
+class fakeClock():
+    """ stands in for the time module, sleeping advances the clock """
+    def __init__(self):
+        self.now = 100.0
+        self.slept = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = fakeClock()
+    monkeypatch.setattr(requestscheduler, 'time', clock)
+    return clock
+
+
+def test_burst_is_immediate(clock):
+    bucket = tokenBucket(rate=2, burst=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.slept == 0
+
+
+def test_waits_for_refill(clock):
+    bucket = tokenBucket(rate=2, burst=1)
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.slept == pytest.approx(0.5)
+    for _ in range(4):
+        bucket.acquire()
+    assert clock.slept == pytest.approx(2.5)
+
+
+def test_refill_is_capped_at_burst(clock):
+    bucket = tokenBucket(rate=1, burst=2)
+    clock.now += 60  # idle, but only burst tokens accumulate
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.slept == pytest.approx(1)
+
+
+def test_zero_rate_is_unlimited(clock):
+    bucket = tokenBucket(rate=0)
+    for _ in range(100):
+        bucket.acquire()
+    assert clock.slept == 0
+
+
+def test_set_rate(clock):
+    bucket = tokenBucket(rate=1, burst=1)
+    bucket.acquire()
+    bucket.setRate(4, 0)  # burst is at least one
+    assert bucket.burst == 1
+    bucket.acquire()
+    assert clock.slept == pytest.approx(0.25)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the delta based undo / redo journal (ui/undojournal.py)
+"""
+import pytest
+
+pd = pytest.importorskip('pandas')
+from ui.undojournal import journalEntry, undoJournal, estimateSize
+
+
+def test_repeated_cell_edits_coalesce():
+    entry = journalEntry(('allRec', None, None), 'edit locality')
+    entry.addDelta(('cells', [0], 'locality', ['a'], ['ab']))
+    entry.addDelta(('cells', [0], 'locality', ['ab'], ['abc']))
+    assert entry.deltas == [('cells', [0], 'locality', ['a'], ['abc'])]
+    assert entry.size == estimateSize(entry.deltas[0])
+
+
+def test_different_cells_are_kept_apart():
+    entry = journalEntry(('allRec', None, None), 'edit')
+    entry.addDelta(('cells', [0], 'locality', ['a'], ['b']))
+    entry.addDelta(('cells', [1], 'locality', ['c'], ['d']))
+    entry.addDelta(('cells', [1], 'habitat', ['e'], ['f']))
+    assert len(entry.deltas) == 3
+    assert entry.size == sum(estimateSize(x) for x in entry.deltas)
+
+
+def test_replace_size_counts_both_frames():
+    oldDF = pd.DataFrame({'a': ['x'] * 100})
+    newDF = pd.DataFrame({'a': ['y'] * 200})
+    both = estimateSize(('replace', oldDF, newDF))
+    assert both == estimateSize(('replace', None, oldDF)) + estimateSize(('replace', None, newDF))
+    assert estimateSize(('replace', None, None)) == 0
+
+
+def test_record_without_checkpoint_is_discarded():
+    journal = undoJournal()
+    journal.record(('addCols', ['habitat']))
+    assert journal.popUndo() is None
+
+
+def test_undo_redo_order():
+    journal = undoJournal()
+    journal.checkpoint(('allRec', None, None), 'first')
+    journal.record(('addCols', ['a']))
+    journal.checkpoint(('allRec', None, None), 'second')
+    journal.record(('addCols', ['b']))
+    assert journal.nextUndoDescription() == 'second'
+    assert journal.popUndo().description == 'second'
+    assert journal.nextRedoDescription() == 'second'
+    assert journal.popUndo().description == 'first'
+    assert journal.popUndo() is None
+    assert journal.popRedo().description == 'first'
+    assert journal.nextUndoDescription() == 'first'
+    assert journal.nextRedoDescription() == 'second'
+
+
+def test_new_edits_clear_redo():
+    journal = undoJournal()
+    journal.checkpoint(('allRec', None, None), 'first')
+    journal.record(('addCols', ['a']))
+    journal.popUndo()
+    assert journal.nextRedoDescription() == 'first'
+    journal.checkpoint(('allRec', None, None), 'second')
+    assert journal.nextRedoDescription() is None
+
+
+def test_trim_by_entries():
+    journal = undoJournal(maxEntries=3)
+    for i in range(5):
+        journal.checkpoint(('allRec', None, None), str(i))
+    assert [x.description for x in journal.undoList] == ['2', '3', '4']
+
+
+def test_trim_by_bytes_keeps_latest_entry():
+    journal = undoJournal(maxBytes=1)
+    for i in range(3):
+        journal.checkpoint(('allRec', None, None), str(i))
+        journal.record(('cells', [0], 'locality', ['old'], ['new']))
+    assert [x.description for x in journal.undoList] == ['2']
@@ -74,10 +74,10 @@ class associatedTaxaMainWindow(QWidget):
         rowsToConsider = self.parent.m.getRowsToKeep(selType, siteNum, None)
         # generate a  list of all taxa from the selections
         taxaList = []
-        for row in rowsToConsider:
-            rowData = self.parent.m.retrieveRowData(row)
-            associatedNames =  rowData['associatedTaxa'].split(',')
-            associatedNames.append(rowData['scientificName'])
+        rowsData = self.parent.m.retrieveRowData(rowsToConsider)
+        for associated, sciName in zip(rowsData['associatedTaxa'], rowsData['scientificName']):
+            associatedNames = associated.split(',')
+            associatedNames.append(sciName)
             associatedNames = [x.strip() for x in associatedNames if x != '']
             taxaList.extend(associatedNames)
         taxaList = list(set(taxaList))
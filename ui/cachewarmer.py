@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Optionally warms the alignment and geocode caches in the background right
+after records are loaded, so the later refinement passes find most of their
+lookups already answered. Enabled with the setting value_prefetchAfterLoad
+(on the Refinement page of the settings window).
+The lookups are paced by the request scheduler, and never raise dialogs.
+The warm up is low priority, it pauses while a refinement process runs so
+it never competes with one for the services' rate limits.
+"""
+import threading
+import pandas as pd
+from ui.referencestore import openReference
+from ui.fuzzymatch import fuzzyIndex
+
+
+class cacheWarmer():
+    def __init__(self, parent):
+        self.parent = parent
+        self.thread = None
+        self.cancelled = threading.Event()
+
+    def start(self, df):
+        """ begins warming the caches for the records in df, stopping any
+        previous warm up. Called on the GUI thread. """
+        self.stop()
+        if not self.parent.settings.get('value_prefetchAfterLoad', False):
+            return
+        self.parent.tax.readTaxonomicSettings()
+        self.parent.locality.readGeocodeSettings()
+        names = pd.unique(df['scientificName'].astype(str))
+        names = [x for x in names if x.strip() != '']
+        sites = df.loc[df['specimenNumber'] == '#', ['decimalLatitude', 'decimalLongitude']]
+        sites = sites[(sites['decimalLatitude'] != '') & (sites['decimalLongitude'] != '')]
+        coords = list(sites.drop_duplicates().itertuples(index=False, name=None))
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(names, coords, self.cancelled),
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """ asks a running warm up to stop, after it's current request """
+        self.cancelled.set()
+
+    def waitForIdle(self, cancelled):
+        """ blocks while a refinement process is running. Returns True if
+        the warm up may continue, False if it was cancelled. """
+        while self.parent.m.refinementThread is not None:
+            if cancelled.wait(0.5):
+                return False
+        return not cancelled.is_set()
+
+    def run(self, names, coords, cancelled):
+        tax = self.parent.tax
+        tax.quiet.active = True  # failures are left for the refinement pass
+        try:
+            self.warmAlignments(names, cancelled)
+            for latitude, longitude in coords:
+                if not self.waitForIdle(cancelled):
+                    return
+                self.parent.locality.reverseGeoCall(latitude, longitude)
+            if self.waitForIdle(cancelled):
+                # used to suggest corrections for misspelled names
+                fuzzyIndex(openReference(tax.value_Kingdom))
+        except Exception:
+            pass  # whatever was not warmed is looked up by the refinement pass
+
+    def warmAlignments(self, names, cancelled):
+        tax = self.parent.tax
+        if '(web API)' not in tax.TaxAlignSource:
+            return  # local references need no warming
+        if tax.TaxAlignSource == 'Taxonomic Name Resolution Service (web API)':
+            # a batch at a time, so the warm up can pause between them
+            batchSize = max(1, tax.value_TNRS_BatchSize)
+            for i in range(0, len(names), batchSize):
+                if not self.waitForIdle(cancelled):
+                    return
+                tax.prefetchAlignments([(None, {'scientificName': x}) for x in names[i: i + batchSize]])
+            return
+        queries = tax.normalizeSeries(pd.Series(names, dtype=object)).unique()
+        for query in queries:
+            if not self.waitForIdle(cancelled):
+                return
+            if query == '' or tax.sessionAlignment(query) is not None:
+                continue
+            tax.retrieveAlignment(query)  # results are kept in alignmentCache
@@ -120,22 +120,23 @@ class formView(QtWidgets.QStackedWidget):
         
         # TODO improve "checking if user has "selected sites" chosen for 
         # all records scope changes.
-        df = self.parent.m.datatable
+        m = self.parent.m
+        df = m.datatable
         if selectSites:  # if the saveFunc requested only selectedSites
             # note self.parent.getSelectSitesToApply, verifies the radio button
             selectedSites = self.parent.getSelectSitesToApply()
             if len(selectedSites) > 0:  # and if there ARE sites selected
-                df.loc[df['siteNumber'].isin(selectedSites), colName] = value
+                rows = df.index[df['siteNumber'].isin(selectedSites)]
             else:  # if requested selected sites ,and none selected. Done.
                 return None
         else:  # if saveFunc did not request selected sites
-            visibleRows = self.parent.getVisibleRows()  # identify what is currently within the user's scope
-            df.loc[visibleRows, colName] = value  # and select it
+            rows = self.parent.getVisibleRows()  # identify what is currently within the user's scope
+        m.setCellValues(rows, colName, value)  # journaled write
         if colName == 'associatedTaxa':
-            df = df.apply(self.parent.associatedTaxaWindow.cleanAssociatedTaxa, axis = 1)
+            df = m.datatable.apply(self.parent.associatedTaxaWindow.cleanAssociatedTaxa, axis = 1)
+            m.updateRecords(df)
             self.parent.associatedTaxaWindow.isWaitingOnUser = False
         #  it may be worth while to do something similar for associatedCollectors & recordedBy
-        self.parent.m.update(df)
 
     def read_QDateEdit(self, obj, value):
         obj.setDate(QDate.fromString(value, "yyyy-MM-dd"))
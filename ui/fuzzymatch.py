@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Offline approximate name matching over a local reference (see
+referencestore.py), used to suggest corrections for misspelled names. Names
+are indexed by their character trigrams. The names sharing the most trigrams
+with a query are then ranked by their edit (Levenshtein) distance.
+"""
+import threading
+import numpy as np
+
+
+def trigrams(name):
+    """ returns the set of character trigrams of a padded name """
+    padded = f'  {name} '
+    return set(padded[i: i + 3] for i in range(len(padded) - 2))
+
+
+def editDistance(a, b, maxDistance=None):
+    """ returns the Levenshtein distance between a and b. If maxDistance is
+    given, returns maxDistance + 1 as soon as it is known to be exceeded."""
+    if len(a) < len(b):
+        a, b = b, a
+    if maxDistance is not None and len(a) - len(b) > maxDistance:
+        return maxDistance + 1
+    previous = list(range(len(b) + 1))
+    for i, charA in enumerate(a, 1):
+        current = [i]
+        for j, charB in enumerate(b, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (charA != charB)))
+        if maxDistance is not None and min(current) > maxDistance:
+            return maxDistance + 1
+        previous = current
+    return previous[-1]
+
+
+class trigramIndex():
+    """ a trigram index over a referenceStore's normalized_name column """
+    def __init__(self, store, colName='normalized_name'):
+        self.store = store
+        self.colName = colName
+        names = [store.value(row, colName) for row in range(len(store))]
+        postings = {}  # {trigram: [row positions]}
+        for row, name in enumerate(names):
+            if name == '':
+                continue
+            for gram in trigrams(name):
+                postings.setdefault(gram, []).append(row)
+        self.names = names
+        self.postings = {gram: np.array(rows, dtype=np.uint32) for gram, rows in postings.items()}
+
+    def candidates(self, query, limit=5, maxDistance=3, pool=50):
+        """ returns up to limit (distance, name) tuples, nearest first, for
+        reference names within maxDistance edits of query. pool is the number
+        of names sharing the most trigrams which are compared by distance."""
+        grams = [self.postings[x] for x in trigrams(query) if x in self.postings]
+        if len(grams) == 0:
+            return []
+        shared = np.bincount(np.concatenate(grams), minlength=len(self.names))
+        pool = min(pool, len(shared))
+        best = np.argpartition(-shared, pool - 1)[:pool]
+        results = {}
+        for row in best:
+            if shared[row] == 0:
+                continue
+            name = self.names[row]
+            if name in results:
+                continue
+            distance = editDistance(query, name, maxDistance)
+            if distance <= maxDistance:
+                results[name] = (distance, -int(shared[row]))
+        ranked = sorted(results.items(), key=lambda x: (x[1], x[0]))
+        return [(distance, name) for name, (distance, _) in ranked[:limit]]
+
+
+fuzzyIndexes = {}  # {id(store): trigramIndex}, built once per reference
+fuzzyLock = threading.Lock()
+
+
+def fuzzyIndex(store):
+    """ returns the trigramIndex of a referenceStore, building it on first
+    use. Returns None if store is None."""
+    if store is None:
+        return None
+    with fuzzyLock:
+        index = fuzzyIndexes.get(id(store))
+        if index is None or index.store is not store:
+            index = trigramIndex(store)
+            fuzzyIndexes[id(store)] = index
+    return index
@@ -11,6 +11,12 @@ import requests
 from requests import ConnectionError
 from PyQt5.QtWidgets import QMessageBox
 import time
+import copy
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from ui.persistentcache import persistentCache, configDirectory
+from ui.offlinegeocoder import offlineGeocoder
 
 # status codes
 # link -> https://developers.google.com/maps/documentation/geocoding/intro#StatusCodes
@@ -23,6 +29,35 @@ class locality():
         self.parent = parent
         # the google key saved in apiKeys.py
         self.gAPIkey = google_API_key
+        # geocoding results are remembered across sessions, keyed by rounded coordinates
+        self.geocodeCache = persistentCache(configDirectory().joinpath('geocodeCache.sqlite'))
+        self.offline = None  # the offlineGeocoder, loaded when first needed
+        self.readGeocodeSettings()
+
+    def readGeocodeSettings(self):
+        """ fetches the geocode cache settings """
+        # decimal places kept in cache keys, 4 is about 11 meters
+        self.geocodePrecision = int(self.parent.settings.get('value_geocodePrecision', 4))
+        # 'Google', 'Offline' or 'Offline, then Google' (see offlinegeocoder.py)
+        self.geocodeBackend = self.parent.settings.get('value_GeocodeBackend', 'Google')
+        # sites within this many meters share one geocode lookup
+        self.clusterMeters = float(self.parent.settings.get('value_geocodeClusterMeters', 30))
+        self.boundaryFolder = self.parent.settings.get('value_boundaryFolder',
+                                                       str(configDirectory().joinpath('boundaries')))
+        self.geocodeCache.setLimits(float(self.parent.settings.get('value_geocodeCacheDays', 365)),
+                                    int(self.parent.settings.get('value_geocodeCacheEntries', 50000)))
+
+    def geocodeKey(self, latitude, longitude):
+        """ returns the geocodeCache key for a pair of coordinates """
+        try:
+            coords = [round(float(x), self.geocodePrecision) for x in (latitude, longitude)]
+        except ValueError:
+            coords = [str(latitude), str(longitude)]
+        return ('Google', *coords)
+
+    def clearGeocodeCache(self):
+        """ forgets every cached result, called from the settings window """
+        self.geocodeCache.clear()
 
     def userNotice(self, text):
         msg = QMessageBox()
@@ -48,11 +83,35 @@ class locality():
         else:
             return "cancel"
 
+    def offlineGeocoder(self):
+        """ returns the offlineGeocoder for the boundaryFolder, loading it if
+        necessary """
+        if self.offline is None or str(self.offline.folder) != str(Path(self.boundaryFolder)):
+            self.offline = offlineGeocoder(self.boundaryFolder)
+        return self.offline
+
     def reverseGeoCall(self, latitude, longitude):
+        """ returns the address components of a location, or a status string
+        if there were none. Uses the geocodeBackend, falling back to Google
+        if the offline boundaries hold nothing for the location and the
+        backend allows it. """
+        if self.geocodeBackend.startswith('Offline'):
+            result = self.offlineGeocoder().reverse(latitude, longitude)
+            if isinstance(result, list) or self.geocodeBackend == 'Offline':
+                return result
+        return self.googleGeoCall(latitude, longitude)
+
+    def googleGeoCall(self, latitude, longitude):
+        """ asks the Google geocoding API for a location's address components.
+        Results are kept in geocodeCache, and each call returns a fresh copy
+        (genLocality alters the list it is given). """
+        key = self.geocodeKey(latitude, longitude)
+        cached = self.geocodeCache.get(key)
+        if cached is not None:
+            return cached
         apiUrl = f'https://maps.googleapis.com/maps/api/geocode/json?latlng={str(latitude)},{str(longitude)}&key={self.gAPIkey}'
-        print(apiUrl)
         try:
-            apiCall = requests.get(apiUrl)
+            apiCall = self.parent.scheduler.get('Google', apiUrl)
         except ConnectionError:
             return False
         status = apiCall.json()['status']
@@ -61,23 +120,120 @@ class locality():
             results = apiCall.json()['results']
             #addressComponents = results[0]['address_components']
             addressComponents = [x['address_components'] for x in results]
+            self.geocodeCache.set(key, addressComponents)
             return addressComponents
         else:  # some error occured
             status = str(status)
+            if status == 'ZERO_RESULTS':  # not an error, remember it
+                self.geocodeCache.set(key, status)
             return status
 
-    def genLocality(self, currentRowArg):
+    def genLocalityBulk(self, records, progress=None, isCancelled=None):
+        """ genLocality for a list of (key, rowData) tuples. Coordinates are
+        snapped to a grid of clusterMeters, and each cluster is looked up
+        once. Records of a cluster which also share their locality text (and
+        whether their uncertainty allows a path) are refined once, and the
+        results are mapped back to each of them. Returns a list of
+        (key, {colName: value}) changes. Used as a bulkFunction by the
+        refinementWorker."""
+        if len(records) == 0:
+            return []
+        df = pd.DataFrame([rowData for _, rowData in records]).reset_index(drop=True)
+        df = df.fillna('').astype(str)
+        original = df.copy()
+        latitude = pd.to_numeric(df['decimalLatitude'], errors='coerce')
+        longitude = pd.to_numeric(df['decimalLongitude'], errors='coerce')
+        # grid cells of clusterMeters, narrowing in longitude away from the equator
+        cellSize = max(self.clusterMeters, 0.01) / 111320
+        latCell = np.floor(latitude / cellSize)
+        lonSize = cellSize / np.cos(np.radians(latCell * cellSize)).clip(lower=0.01)
+        lonCell = np.floor(longitude / lonSize)
+        uncertainty = pd.to_numeric(df['coordinateUncertaintyInMeters'], errors='coerce')
+        cluster = pd.factorize(pd.Series(list(zip(latCell, lonCell))))[0]
+        group = pd.factorize(pd.Series(list(zip(cluster, df['locality'], uncertainty < 100))))[0]
+        missing = (latitude.isna() | longitude.isna()).values
+        # records without GPS are each handled alone, asking as genLocality does
+        cluster[missing] = -1 - np.arange(missing.sum())
+        group[missing] = -1 - np.arange(missing.sum())
+
+        members = pd.Series(range(len(df))).groupby(group).apply(list)
+        clusterMembers = pd.Series(range(len(df))).groupby(cluster).apply(list)
+        changesByGroup = {}  # {group: {colName: value}}
+        looked = {}  # {cluster: addresses}
+        for c, (code, rows) in enumerate(members.items()):
+            if isCancelled is not None and isCancelled():
+                break
+            if progress is not None:
+                progress(c + 1, len(members))
+            clusterCode = cluster[rows[0]]
+            if clusterCode in looked and not isinstance(looked[clusterCode], list):
+                continue  # the cluster's lookup failed, already reported once
+            key, rowData = records[rows[0]]
+            rowData = rowData.copy()
+            if clusterCode < 0:
+                addresses = None
+                keys = [key]
+            elif clusterCode not in looked:
+                addresses = self.reverseGeoCall(rowData['decimalLatitude'], rowData['decimalLongitude'])
+                looked[clusterCode] = addresses
+                if isinstance(addresses, list):
+                    keys = [records[i][0] for i in rows]
+                else:
+                    # report a failure once for the entire cluster, though
+                    # only this group's records take the results
+                    keys = [records[i][0] for i in clusterMembers[clusterCode]]
+            else:
+                addresses = looked[clusterCode]
+                keys = [records[i][0] for i in rows]
+            recordKeys = keys if len(keys) > 1 else None
+            result = self.genLocality(rowData, copy.deepcopy(addresses), recordKeys)
+            if clusterCode >= 0 and not isinstance(looked[clusterCode], list):
+                # if the user retried successfully, the cluster's remaining
+                # groups use the (now cached) addresses
+                retried = self.geocodeCache.get(self.geocodeKey(rowData['decimalLatitude'],
+                                                                rowData['decimalLongitude']))
+                if isinstance(retried, list):
+                    looked[clusterCode] = retried
+            changes = {}
+            for col, value in result.items():
+                if col not in df.columns:
+                    df[col] = ''
+                    original[col] = ''
+                if str(value) != df.at[rows[0], col]:
+                    changes[col] = value
+            changesByGroup[code] = changes
+
+        group = pd.Series(group, index=df.index)
+        for col in set(x for changes in changesByGroup.values() for x in changes):
+            mapped = group.map({code: changes[col] for code, changes in changesByGroup.items()
+                                if col in changes})
+            df[col] = mapped.where(mapped.notna(), df[col])
+        changed = df.ne(original)
+        results = []
+        for i in changed.index[changed.any(axis=1)]:
+            results.append((records[i][0], df.loc[i, changed.loc[i]].to_dict()))
+        return results
+
+    def genLocality(self, currentRowArg, addresses=None, recordKeys=None):
         """ Generate locality fields, uses API call to get
-        country, state, city, etc. from GPS coordinates."""
+        country, state, city, etc. from GPS coordinates. addresses may be
+        given if they were already looked up (see genLocalityBulk).
+        recordKeys may list the keys of every record sharing the result, so
+        a deferred decision applies to each of them."""
         # both locality functions would benefit from some systemic methid of determining when to add italics to binomial (scientific) names.
         # such the italic tags "<i> and </i>" would need to be stripped before exporting for database submission.
         currentRow = f"{currentRowArg['siteNumber']}-{currentRowArg['specimenNumber']}"
         currentSiteName = f"Site {currentRowArg['siteNumber']}"
+        rowKey = (currentRowArg['siteNumber'], currentRowArg['specimenNumber'])
+        if recordKeys is not None:
+            rowKey = recordKeys
         currentLocality = currentRowArg['locality']
         latitude = currentRowArg['decimalLatitude']
         longitude = currentRowArg['decimalLongitude']
         if latitude == '' or longitude == '':
             message = f'MISSING GPS at {currentSiteName}. Would you like to halt the process to add GPS coordinates to {currentSiteName}?'
+            if self.parent.deferDecision('Missing GPS', f'MISSING GPS at {currentSiteName}.', rowKey):
+                return currentRowArg
             answer = self.parent.userAsk(message, title='GeoLocation')
             if answer:
                 self.parent.statusBar.pushButton_Cancel.status = True
@@ -85,7 +241,8 @@ class locality():
                 return currentRowArg
             else:
                 return currentRowArg
-        addresses = self.reverseGeoCall(latitude, longitude)
+        if addresses is None:
+            addresses = self.reverseGeoCall(latitude, longitude)
         if isinstance(addresses, list):
             
             address = addresses[0]  # Prefer the first entry
@@ -157,13 +314,16 @@ class locality():
             apiErrorMessage = addresses
             if apiErrorMessage == "ZERO_RESULTS":
                 message = f'Location lookup error at {currentSiteName}: service responded with: "{apiErrorMessage}". Does this location exist?'
-                self.parent.userNotice(message, title='GeoLocation')
+                if not self.parent.deferDecision('Zero results', message, rowKey):
+                    self.parent.userNotice(message, title='GeoLocation')
             else:
                 message = f'Location lookup error at {currentSiteName}: service responded with: "{apiErrorMessage}". This may be an internet connection issue.'
+                if self.parent.deferDecision('Lookup error', message, rowKey):
+                    return currentRowArg
                 notice = self.parent.userNotice(message, title='GeoLocation', retry = True)
                 if notice == QMessageBox.Retry:  # if clicked retry, do it.
                     time.sleep(1)
-                    currentRowArg = self.genLocality(currentRowArg)
+                    currentRowArg = self.genLocality(currentRowArg, recordKeys=recordKeys)
         return currentRowArg
 
 
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+An offline reverse geocoder, using administrative boundary polygons saved
+locally. Useful at field stations without internet access.
+
+The backend (value_GeocodeBackend) and boundary folder (value_boundaryFolder,
+by default "boundaries" in the config folder) are set on the Refinement page
+of the settings window. The folder may hold one file per level, named for the
+field it fills:
+    country.geojson, stateProvince.geojson, county.geojson, municipality.geojson
+Shapefiles (ie: county.shp) are also read if pyshp is installed. Each
+feature's name is taken from the first property found among nameFields,
+countries also use the first of codeFields (as Google returns "US").
+
+Features are indexed in a Sort-Tile-Recursive (STR) packed R-tree of their
+bounding boxes, candidates are then tested with an even-odd point in polygon
+test. Results are returned as Google styled address components, so
+genLocality treats both backends alike.
+"""
+import json
+from pathlib import Path
+import numpy as np
+
+nameFields = ['name', 'NAME', 'Name', 'NAME_EN', 'ADMIN', 'NAME_2', 'NAME_1']
+codeFields = ['ISO_A2', 'iso_a2', 'ISO2', 'ISO', 'iso']
+# {level (and file name): Google's address component type}
+levels = {'country': 'country',
+          'stateProvince': 'administrative_area_level_1',
+          'county': 'administrative_area_level_2',
+          'municipality': 'locality'}
+
+
+class strTree():
+    """ a static R-tree of bounding boxes, packed by Sort-Tile-Recursive.
+    boxes is an array of (minX, minY, maxX, maxY) rows."""
+    def __init__(self, boxes, nodeCapacity=16):
+        self.nodeCapacity = nodeCapacity
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        # each level is (boxes, children), children[i] lists the entries of
+        # the level below (or the items, at the leaves) held by node i
+        self.levels = []
+        entries = np.arange(len(boxes))
+        while True:
+            nodeBoxes, children = self.pack(boxes, entries)
+            self.levels.append((nodeBoxes, children))
+            if len(nodeBoxes) <= 1:
+                break
+            boxes, entries = nodeBoxes, np.arange(len(nodeBoxes))
+
+    def pack(self, boxes, entries):
+        """ groups entries into nodes of nodeCapacity, tiled by x then y """
+        count = len(entries)
+        if count == 0:
+            return np.zeros((0, 4)), []
+        nodeCount = int(np.ceil(count / self.nodeCapacity))
+        sliceCount = int(np.ceil(np.sqrt(nodeCount)))
+        sliceSize = sliceCount * self.nodeCapacity
+        centers = (boxes[entries, :2] + boxes[entries, 2:]) / 2
+        byX = entries[np.argsort(centers[:, 0], kind='stable')]
+        children = []
+        for start in range(0, count, sliceSize):
+            tile = byX[start: start + sliceSize]
+            tileCenters = (boxes[tile, 1] + boxes[tile, 3]) / 2
+            tile = tile[np.argsort(tileCenters, kind='stable')]
+            for nodeStart in range(0, len(tile), self.nodeCapacity):
+                children.append(tile[nodeStart: nodeStart + self.nodeCapacity])
+        nodeBoxes = np.array([[boxes[x, 0].min(), boxes[x, 1].min(),
+                               boxes[x, 2].max(), boxes[x, 3].max()] for x in children])
+        return nodeBoxes, children
+
+    def query(self, x, y):
+        """ returns the items whose boxes contain the point (x, y) """
+        candidates = np.arange(len(self.levels[-1][0]))
+        for nodeBoxes, children in reversed(self.levels):
+            boxes = nodeBoxes[candidates]
+            inside = ((boxes[:, 0] <= x) & (x <= boxes[:, 2]) &
+                      (boxes[:, 1] <= y) & (y <= boxes[:, 3]))
+            hits = candidates[inside]
+            if len(hits) == 0:
+                return []
+            candidates = np.concatenate([children[i] for i in hits])
+        return candidates.tolist()
+
+
+def ringEdges(rings):
+    """ returns the edges of every ring of a feature as arrays of
+    (x0, y0, y1, slope), where slope is the change in x per change in y """
+    edges = []
+    for ring in rings:
+        nextRing = np.roll(ring, -1, axis=0)
+        edges.append(np.column_stack([ring[:, 0], ring[:, 1], nextRing[:, 1],
+                                      nextRing[:, 0] - ring[:, 0], nextRing[:, 1] - ring[:, 1]]))
+    edges = np.concatenate(edges)
+    dy = edges[:, 4]
+    # horizontal edges never straddle a point, their slope is unused
+    slope = np.divide(edges[:, 3], dy, out=np.zeros(len(edges)), where=dy != 0)
+    return edges[:, 0], edges[:, 1], edges[:, 2], slope
+
+
+def pointInEdges(x, y, edges):
+    """ even-odd test of the point (x, y) against the edges of every ring of
+    a feature, which handles holes and multiple polygons alike. """
+    x0, y0, y1, slope = edges
+    straddles = (y0 > y) != (y1 > y)
+    crossX = x0 + (y - y0) * slope
+    return np.count_nonzero(straddles & (x < crossX)) % 2 == 1
+
+
+def geometryRings(geometry):
+    """ returns a list of (n, 2) arrays, for each ring of a GeoJSON styled
+    Polygon or MultiPolygon geometry """
+    if geometry is None:
+        return []
+    if geometry['type'] == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    else:
+        return []
+    return [np.asarray(ring, dtype=float)[:, :2] for polygon in polygons
+            for ring in polygon if len(ring) > 2]
+
+
+def readFeatures(path):
+    """ returns a list of (properties, geometry) from a GeoJSON file or, if
+    pyshp is installed, a shapefile """
+    path = Path(path)
+    if path.suffix.lower() == '.shp':
+        try:
+            import shapefile
+        except ImportError:
+            print(f'pyshp is required to read {path.name}, skipping it')
+            return []
+        with shapefile.Reader(str(path)) as reader:
+            return [(record.record.as_dict(), record.shape.__geo_interface__)
+                    for record in reader.shapeRecords()]
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    features = data.get('features', [data]) if isinstance(data, dict) else []
+    return [(x.get('properties') or {}, x.get('geometry')) for x in features]
+
+
+def firstProperty(properties, fields):
+    for field in fields:
+        value = properties.get(field)
+        if value not in [None, '']:
+            return str(value)
+    return None
+
+
+class boundaryLayer():
+    """ the features of one administrative level, with a spatial index """
+    def __init__(self, features):
+        self.names = []
+        self.codes = []
+        self.edges = []
+        boxes = []
+        for properties, geometry in features:
+            rings = geometryRings(geometry)
+            name = firstProperty(properties, nameFields)
+            if len(rings) == 0 or name is None:
+                continue
+            points = np.concatenate(rings)
+            boxes.append([points[:, 0].min(), points[:, 1].min(),
+                          points[:, 0].max(), points[:, 1].max()])
+            self.names.append(name)
+            self.codes.append(firstProperty(properties, codeFields) or name)
+            self.edges.append(ringEdges(rings))
+        self.tree = strTree(boxes)
+
+    def __len__(self):
+        return len(self.names)
+
+    def locate(self, x, y):
+        """ returns the position of the feature holding (x, y), or None """
+        for i in self.tree.query(x, y):
+            if pointInEdges(x, y, self.edges[i]):
+                return i
+        return None
+
+
+class offlineGeocoder():
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        self.layers = {}  # {level: boundaryLayer}
+        if not self.folder.is_dir():
+            print(f'no boundary folder found at {self.folder}')
+            return
+        for level in levels:
+            for suffix in ['.geojson', '.json', '.shp']:
+                path = self.folder.joinpath(f'{level}{suffix}')
+                if path.is_file():
+                    layer = boundaryLayer(readFeatures(path))
+                    if len(layer) > 0:
+                        self.layers[level] = layer
+                    break
+
+    def __len__(self):
+        return len(self.layers)
+
+    def reverse(self, latitude, longitude):
+        """ returns address components as the Google geocoder would, or
+        'ZERO_RESULTS' if the point is within no boundary. """
+        try:
+            x, y = float(longitude), float(latitude)
+        except ValueError:
+            return 'INVALID_REQUEST'
+        components = []
+        for level, googleType in levels.items():
+            layer = self.layers.get(level)
+            if layer is None:
+                continue
+            i = layer.locate(x, y)
+            if i is None:
+                continue
+            shortName = layer.codes[i] if level == 'country' else layer.names[i]
+            components.append({'long_name': layer.names[i], 'short_name': shortName,
+                               'types': [googleType, 'political']})
+        if len(components) == 0:
+            return 'ZERO_RESULTS'
+        return [components]
@@ -15,9 +15,13 @@ from PyQt5.QtWidgets import QMessageBox
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtWidgets import QDialog
 from pathlib import Path
+from functools import partial
 from shortuuid import uuid
 from reportlab.platypus.doctemplate import LayoutError
 from ui.importindexdialog import importDialog
+from ui.undojournal import undoJournal
+from ui.recordindex import recordIndex
+from ui.refinementworker import refinementWorker, bulkFunction
 import pandas as pd
 import numpy as np
 
@@ -27,84 +31,330 @@ class PandasTableModel(QtCore.QAbstractTableModel):
         super(PandasTableModel, self).__init__(parent)
         self.parent = parent
         self.datatable = None  # what the user is seeing & interacting with
-        # custom undo method
-        self.undoList = []  # holds the checkpoints
-        self.redoList = []  # the current position in the checkpoint list
+        # custom undo method, journals the deltas of each action.
+        self.journal = undoJournal()
+        # cell changes are collected while changesDepth > 0 and emitted
+        # together, see beginChanges() & endChanges()
+        self.changesDepth = 0
+        self.pendingChanges = {}  # {colPosition: set(rowPositions)}
+        # site & specimen number lookups, kept in step with the datatable
+        self.keyIndex = recordIndex()
+        # background refinement (see runRefinement)
+        self.refinementWorker = None
+        self.refinementThread = None
+        self.refinementBuffer = []
         self.updateUndoRedoButtons()  # set up initial undo / redo state
 
     def addToUndoList(self, description='undo the last major action'):
-        """ to be called just before a change is made to the underlaying df """
+        """ to be called just before a change is made to the underlaying df.
+        Opens a new journal entry, which collects the following changes."""
         selection = self.parent.getTreeSelectionType()
-        df = self.datatable  # save the details into a checkpoint
-        checkPoint = (df.copy(deep=True), selection, description)
-        self.undoList.append(checkPoint)
-        self.redoList = []  # if we're adding to undoList, clear redoList
+        # refresh the journal's budget in case the settings have changed
+        budget = int(self.parent.settings.get('value_undoMemoryBudget', 256))
+        self.journal.maxBytes = budget * 1024 * 1024
+        self.journal.maxEntries = int(self.parent.settings.get('value_undoLevels', 40))
+        self.journal.checkpoint(selection, description)
         self.updateUndoRedoButtons()
-        if len(self.undoList) > 40:  # be sure not to grow too big
-            self.undoList = self.undoList[40:]
 
     def redo(self):
-        """ restores the underlaying df the most recent redoList point """
-        origDF = self.datatable
-        try:
-            checkpoint = self.redoList.pop()
-        except IndexError:
-            checkpoint = (None, (None, None, None), 'the last major action')
-        df, sel, msg = checkpoint
-        if isinstance(df, pd.DataFrame):
-            self.datatable = df
-            self.update(self.datatable)
-            self.parent.updateTableView()
-        self.undoList.append((origDF, sel, msg))
+        """ reapplies the most recently undone journal entry """
+        if self.refinementThread is not None:
+            return  # the running refinement is recording into the journal
+        entry = self.journal.popRedo()
+        if entry is None:
+            self.updateUndoRedoButtons()
+            return
+        self.beginChanges()
+        for delta in entry.deltas:
+            self.applyDelta(delta)
+        self.endChanges()
+        self.parent.updateTableView()
         self.updateUndoRedoButtons()
         self.parent.populateTreeWidget()
-        self.parent.setTreeSelectionByType(*sel)  # return the selection
+        self.parent.setTreeSelectionByType(*entry.selection)  # return the selection
 
     def undo(self):
-        """ restores the underlaying df to the most recent undoList point"""
-        origDF = self.datatable
-        try:
-            checkpoint = self.undoList.pop()
-        except IndexError:
-            checkpoint = (None, (None, None, None), 'the last major action')
-        df, sel, msg = checkpoint
-        if isinstance(df, pd.DataFrame):
-            self.datatable = df
-            self.update(self.datatable)
-            self.parent.updateTableView()
-        self.redoList.append((origDF, sel, msg))
+        """ reverts the most recent journal entry """
+        if self.refinementThread is not None:
+            return  # the running refinement is recording into the journal
+        entry = self.journal.popUndo()
+        if entry is None:
+            self.updateUndoRedoButtons()
+            return
+        self.beginChanges()
+        for delta in reversed(entry.deltas):
+            self.applyDelta(delta, revert=True)
+        self.endChanges()
+        self.parent.updateTableView()
         self.updateUndoRedoButtons()
         self.parent.populateTreeWidget()
-        self.parent.setTreeSelectionByType(*sel)  # return the selection
+        self.parent.setTreeSelectionByType(*entry.selection)  # return the selection
+
+    def applyDelta(self, delta, revert=False):
+        """ replays (or reverts) a single journal delta against the datatable
+        without journaling it again. """
+        kind = delta[0]
+        if kind == 'cells':
+            _, rows, colName, oldValues, newValues = delta
+            if revert:
+                self.writeCells(rows, colName, oldValues)
+            else:
+                self.writeCells(rows, colName, newValues)
+        elif kind == 'insert':
+            _, positions, rowsDF = delta
+            if revert:
+                self.removeRowsAt(positions)
+            else:
+                self.insertRowsAt(positions, rowsDF)
+        elif kind == 'remove':
+            _, positions, rowsDF = delta
+            if revert:
+                self.insertRowsAt(positions, rowsDF)
+            else:
+                self.removeRowsAt(positions)
+        elif kind == 'addCols':
+            colNames = delta[1]
+            if revert:
+                self.removeColumnsNamed(colNames)
+            else:
+                self.insertColumnsNamed(colNames)
+        elif kind == 'replace':
+            # the journal keeps its frames exclusively, later edits change
+            # the live datatable in place.
+            _, oldDF, newDF = delta
+            df = oldDF if revert else newDF
+            self.update(df.copy() if df is not None else None)
 
     def updateUndoRedoButtons(self):
-        """ called if the self.undoIndex changes. Updates the hint text of the
-            undo, & redo buttons to reflect the description appended in 
-            addToUndoList"""
-        if len(self.undoList) > 0:
-            self.parent.w.action_undo.setEnabled(True)
-            msg = self.undoList[-1][-1]  # .replace('redo: ', 'undo: ')
+        """ called if the journal changes. Updates the hint text of the
+            undo, & redo buttons to reflect the description appended in
+            addToUndoList. Both are disabled while a refinement runs."""
+        running = self.refinementThread is not None
+        msg = self.journal.nextUndoDescription()
+        if msg is not None:
+            self.parent.w.action_undo.setEnabled(not running)
             msg = f'undo: {msg}'
         else:
             self.parent.w.action_undo.setEnabled(False)
             msg = 'undo the last major action'
         self.parent.w.action_undo.setToolTip(msg)
 
-        if len(self.redoList) > 0:
-            self.parent.w.action_redo.setEnabled(True)
-            msg = self.redoList[-1][-1]  # .replace('undo', 'redo')
+        msg = self.journal.nextRedoDescription()
+        if msg is not None:
+            self.parent.w.action_redo.setEnabled(not running)
             msg = f'redo: {msg}'
         else:
             self.parent.w.action_redo.setEnabled(False)
             msg = 'redo the last major action'
         self.parent.w.action_redo.setToolTip(msg)
 
+    def updateTableActions(self):
+        """ disables the actions which replace or rewind the datatable while
+        a refinement runs, since it's results are written by record number
+        into whichever table is loaded. """
+        running = self.refinementThread is not None
+        self.parent.w.action_Open.setEnabled(not running)
+        self.parent.w.action_New_Records.setEnabled(not running)
+        self.updateUndoRedoButtons()
+
     def update(self, dataIn):
+        """ replaces the entire datatable and resets the model. Only
+        appropriate when loading records, otherwise use the journaled
+        functions below which emit finer grained change signals."""
+        self.pendingChanges = {}
         self.beginResetModel()
         self.datatable = dataIn
+        self.keyIndex.invalidate(dataIn)
         self.endResetModel()
-        # let display elements know about the change (ie: qTreeWidget)
-        self.dataChanged.emit(QtCore.QModelIndex(), QtCore.QModelIndex(), (QtCore.Qt.DisplayRole,))
+
+    # The following functions are the only ones which should alter the
+    # datatable. Each journals what it changed so it can be undone. They
+    # expect the datatable's index to be equal to row position (0 to n-1), as
+    # is ensured by sortDF.
+
+    def beginChanges(self):
+        """ begins collecting cell changes, so that a series of edits emits
+        dataChanged once per changed block rather than once per edit."""
+        self.changesDepth += 1
+
+    def endChanges(self):
+        """ ends collecting cell changes, emitting dataChanged once the
+        outermost beginChanges() is closed."""
+        self.changesDepth = max(self.changesDepth - 1, 0)
+        if self.changesDepth == 0:
+            self.emitPendingChanges()
+
+    def emitPendingChanges(self):
+        """ emits dataChanged for each contiguous block of changed rows,
+        spanning the columns which changed in that block."""
+        pending = self.pendingChanges
+        self.pendingChanges = {}
+        if len(pending) == 0:
+            return
+        rowCols = {}  # {rowPosition: [colPositions]}
+        for col, rows in pending.items():
+            for row in rows:
+                rowCols.setdefault(row, []).append(col)
+        rowCount = self.rowCount()
+        for first, last in contiguousRanges(rowCols.keys()):
+            if first >= rowCount:
+                continue
+            last = min(last, rowCount - 1)
+            cols = [c for r in range(first, last + 1) for c in rowCols.get(r, [])]
+            topLeft = self.index(first, min(cols))
+            bottomRight = self.index(last, max(cols))
+            self.dataChanged.emit(topLeft, bottomRight, (QtCore.Qt.DisplayRole,))
+
+    def setCellValues(self, rows, colName, values):
+        """ sets the colName at each of the row positions to values. Values
+        can either be a single value or a list of values, one per row."""
+        if colName not in self.datatable.columns:
+            self.addColumns([colName])
+        rows = list(rows)
+        if len(rows) == 0:
+            return
+        if not isinstance(values, (list, tuple, np.ndarray, pd.Series)):
+            values = [values] * len(rows)
+        values = list(values)
+        oldValues = self.datatable.loc[rows, colName].tolist()
+        self.journal.record(('cells', rows, colName, oldValues, values))
+        self.writeCells(rows, colName, values)
+
+    def updateRecords(self, dfIn):
+        """ a journaled replacement for self.datatable.update(dfIn). Writes
+        the non-null values of dfIn into the datatable aligned on index and
+        column names. Only those cells which actually differ are journaled."""
+        df = self.datatable
+        self.beginChanges()
+        for colName in dfIn.columns:
+            if colName not in df.columns:
+                continue  # as with DataFrame.update, ignore unknown columns
+            newValues = dfIn[colName]
+            newValues = newValues[newValues.notnull()]
+            if len(newValues) == 0:
+                continue
+            oldValues = df.loc[newValues.index, colName]
+            changed = oldValues.values != newValues.values
+            if changed.any():
+                rows = newValues.index[changed].tolist()
+                self.setCellValues(rows, colName, newValues.values[changed].tolist())
+        self.endChanges()
+
+    def addColumns(self, colNames):
+        """ adds empty columns to the datatable """
+        colNames = [x for x in colNames if x not in self.datatable.columns]
+        if len(colNames) > 0:
+            self.journal.record(('addCols', colNames))
+            self.insertColumnsNamed(colNames)
+
+    def insertRecords(self, newRows, sort=True):
+        """ appends a dataframe of new rows to the datatable and returns the
+        row positions they ended up at."""
+        newCols = [x for x in newRows.columns if x not in self.datatable.columns]
+        self.addColumns(newCols)
+        df = self.datatable
+        firstNew = len(df)
+        df = df.append(newRows, ignore_index=True, sort=False)
+        df.fillna('', inplace=True)
+        if sort:
+            sortedDF = self.sortDF(df, resetIndex=False)
+            if sortedDF is not False:
+                df = sortedDF
+        labels = df.index.tolist()
+        positions = [i for i, x in enumerate(labels) if x >= firstNew]
+        df.reset_index(drop=True, inplace=True)
+        rowsDF = df.loc[positions].copy()
+        self.journal.record(('insert', positions, rowsDF))
+        existingOrder = [x for x in labels if x < firstNew]
+        if existingOrder == sorted(existingOrder):
+            # existing rows kept their order, only rows were inserted.
+            self.insertRowsAt(positions, rowsDF)
+        else:
+            # sorting moved the existing rows around, treat it as a reload.
+            self.update(df)
+        return positions
+
+    def removeRecords(self, positions):
+        """ removes the rows at the given positions from the datatable """
+        positions = sorted(positions)
+        if len(positions) == 0:
+            return
+        self.journal.record(('remove', positions, self.datatable.loc[positions].copy()))
+        self.removeRowsAt(positions)
+
+    def replaceTable(self, df):
+        """ replaces the entire datatable (ie: loading a new set of records)."""
+        oldDF = self.datatable.copy() if self.datatable is not None else None
+        self.journal.record(('replace', oldDF, df.copy()))
+        self.update(df)
+
+    def writeCells(self, rows, colName, values):
+        """ writes values without journaling. Called by setCellValues, or
+        when replaying the journal."""
+        df = self.datatable
+        if colName in recordIndex.keyCols and all(x in df.columns for x in recordIndex.keyCols):
+            oldKeys = list(zip(df.loc[rows, 'siteNumber'], df.loc[rows, 'specimenNumber']))
+            df.loc[rows, colName] = values
+            newKeys = list(zip(df.loc[rows, 'siteNumber'], df.loc[rows, 'specimenNumber']))
+            self.keyIndex.updateKeys(rows, oldKeys, newKeys)
+        else:
+            df.loc[rows, colName] = values
+        colPosition = self.datatable.columns.get_loc(colName)
+        self.pendingChanges.setdefault(colPosition, set()).update(rows)
+        if self.changesDepth == 0:
+            self.emitPendingChanges()
+
+    def insertRowsAt(self, positions, rowsDF):
+        """ inserts rowsDF so that it's rows end up at positions, without
+        journaling. Emits rowsInserted for each contiguous block."""
+        self.emitPendingChanges()  # row positions are about to change
+        rowsDF = rowsDF.copy()
+        rowsDF.index = positions
+        # since positions are final positions, insert from the top down
+        for first, last in contiguousRanges(positions):
+            df = self.datatable
+            block = rowsDF.loc[first:last]
+            self.beginInsertRows(QtCore.QModelIndex(), first, last)
+            df = pd.concat([df.iloc[:first], block, df.iloc[first:]], sort=False)
+            df.fillna('', inplace=True)
+            df.reset_index(drop=True, inplace=True)
+            self.datatable = df
+            self.keyIndex.invalidate(df)
+            self.endInsertRows()
+
+    def removeRowsAt(self, positions):
+        """ removes rows at positions, without journaling. Emits rowsRemoved
+        for each contiguous block."""
+        self.emitPendingChanges()  # row positions are about to change
+        # remove from the bottom up, so the remaining positions stay valid
+        for first, last in reversed(contiguousRanges(positions)):
+            df = self.datatable
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            df = pd.concat([df.iloc[:first], df.iloc[last + 1:]], sort=False)
+            df.reset_index(drop=True, inplace=True)
+            self.datatable = df
+            self.keyIndex.invalidate(df)
+            self.endRemoveRows()
+
+    def insertColumnsNamed(self, colNames):
+        """ appends empty columns, without journaling. """
+        first = self.columnCount()
+        self.beginInsertColumns(QtCore.QModelIndex(), first, first + len(colNames) - 1)
+        for colName in colNames:
+            self.datatable[colName] = ''
+        self.keyIndex.invalidate(self.datatable)
+        self.endInsertColumns()
+
+    def removeColumnsNamed(self, colNames):
+        """ removes columns by name, without journaling. """
+        self.emitPendingChanges()  # column positions are about to change
+        colPositions = [self.datatable.columns.get_loc(x) for x in colNames]
+        for first, last in reversed(contiguousRanges(colPositions)):
+            self.beginRemoveColumns(QtCore.QModelIndex(), first, last)
+            toDrop = self.datatable.columns[first:last + 1]
+            self.datatable.drop(columns=toDrop, inplace=True)
+            self.keyIndex.invalidate(self.datatable)
+            self.endRemoveColumns()
 
     def addNewSite(self):
         """ adds a new, nearly blank site record to the dataTable """
@@ -122,9 +372,7 @@ class PandasTableModel(QtCore.QAbstractTableModel):
         rowData.update(defVals)
         # be sure to clear associatedTaxa
         # TODO determine why it otherwise copies associatedTaxa from other site 
-        df = df.append(rowData, ignore_index=True, sort=False)
-        df.fillna('', inplace=True)
-        self.update(df)
+        self.insertRecords(pd.DataFrame([rowData]), sort=False)
         self.parent.populateTreeWidget()
         # change tree_widget's selection to the to new site.
         self.parent.selectTreeWidgetItemByName(f'Site {newSiteNum}(0)')
@@ -139,16 +387,12 @@ class PandasTableModel(QtCore.QAbstractTableModel):
                 newSpNum = max(pd.to_numeric(spNums, errors='coerce')) + 1
             except ValueError:
                 newSpNum = 1
-            newRowData = df[(df['siteNumber'] == siteNum) &
-                            (df['specimenNumber'] == '#')].copy()
+            newRowData = df.loc[self.getRowsToKeep('specimen', siteNum, '#')].copy()
             newRowData['specimenNumber'] = f'{newSpNum}'
             catNum = f'{siteNum}-{newSpNum}'
             self.addToUndoList(f'added specimen {catNum}')  # set checkpoint in undostack
             newRowData['recordNumber'] = catNum
-            df = df.append(newRowData, ignore_index=True, sort=False)
-            df = self.sortDF(df)
-            df.fillna('', inplace=True)
-            self.update(df)
+            self.insertRecords(newRowData)
             self.parent.populateTreeWidget()
             # change tree_widget's selection to the to new specimen.
             self.parent.selectTreeWidgetItemByName(catNum)
@@ -165,29 +409,21 @@ class PandasTableModel(QtCore.QAbstractTableModel):
                 newSpNum = max(pd.to_numeric(spNums, errors='coerce')) + 1
             except ValueError:
                 newSpNum = 2
-            newRowData = df[(df['siteNumber'] == siteNum) &
-                            (df['specimenNumber'] == specimenNum)].copy()
+            newRowData = df.loc[self.getRowsToKeep('specimen', siteNum, specimenNum)].copy()
             newRowData['specimenNumber'] = f'{newSpNum}'
             catNum = f'{siteNum}-{newSpNum}'
             newRowData['recordNumber'] = catNum
-            df = df.append(newRowData, ignore_index=True, sort=False)
-            df = self.sortDF(df)
-            df.fillna('', inplace=True)
-            self.update(df)
+            self.insertRecords(newRowData)
             self.parent.populateTreeWidget()
             # change tree_widget's selection to the to new specimen.
             self.parent.selectTreeWidgetItemByName(catNum)
 
     def deleteSite(self):
         """ called from the delete site button """
-        df = self.datatable
         selType, siteNum, specimenNum = self.parent.getTreeSelectionType()
         if selType == 'site':
             self.addToUndoList(f'removed site {siteNum}')  # set checkpoint in undostack
-            newDF = df[df['siteNumber'] != siteNum].copy()
-            newDF = self.sortDF(newDF)
-            self.datatable = newDF
-            self.update(self.datatable)
+            self.removeRecords(self.getRowsToKeep('site', siteNum))
             self.parent.populateTreeWidget()
             # change tree_widget's selection to All Records.
             self.parent.w.checkBox_delSite.setCheckState(Qt.Unchecked)
@@ -195,14 +431,10 @@ class PandasTableModel(QtCore.QAbstractTableModel):
 
     def deleteSpecimen(self):
         """ called from the delete specimen button """
-        df = self.datatable
         selType, siteNum, specimenNum = self.parent.getTreeSelectionType()
         if selType == 'specimen':
             self.addToUndoList(f'removed specimen {siteNum}-{specimenNum}')  # set checkpoint in undostack
-            newDF = df[~((df['siteNumber'] == siteNum) & (df['specimenNumber'] == specimenNum))].copy()
-            newDF = self.sortDF(newDF)
-            self.datatable = newDF
-            self.update(self.datatable)
+            self.removeRecords(self.getRowsToKeep('specimen', siteNum, specimenNum))
             self.parent.populateTreeWidget()
             # change tree_widget's selection to All Records.
             self.parent.w.checkBox_deleteRecord.setCheckState(Qt.Unchecked)
@@ -222,8 +454,11 @@ class PandasTableModel(QtCore.QAbstractTableModel):
         return result
 
     def retrieveRowData(self, i):
-        """ given a row index number returns the data as a series """
+        """ given a row index number returns the data as a series. If given a
+        list of row index numbers, returns a dataframe of those rows."""
         df = self.datatable
+        if isinstance(i, (list, tuple, range)):
+            return df.iloc[list(i)]
         return df.loc[i]
 
     def getSelectedLabelDict(self, df):
@@ -245,49 +480,61 @@ class PandasTableModel(QtCore.QAbstractTableModel):
 
     def geoRef(self, selType):
         """ applies genLocality over each row among those selected.
-        Combines api calls for records from the same site."""
+        Combines api calls for records from the same site, and for sites
+        sharing coordinates (see locality.genLocalityBulk)."""
         # Needs modified If editing site data at specimen level records is re-enabled.
-
-        self.addToUndoList('geolocate process')  # set checkpoint in undostack
+        self.parent.locality.readGeocodeSettings()
         _, siteNum, specimenNum = self.parent.getTreeSelectionType()
+        steps = self.geoRefSteps(selType, siteNum, specimenNum)
+        self.runRefinement(steps, 'geolocate process')
+
+    def geoRefSteps(self, selType, siteNum=None, specimenNum=None):
+        """ returns the refinement steps for geoRef. Site level records are
+        geolocated, then their results are inherited by their specimens."""
+        genLocality = bulkFunction(self.parent.locality.genLocalityBulk)
         if selType == 'site':
             # hacky method to get only site level record (catalogNumber: "n-#")
-            rowsToProcess = self.getRowsToProcess('specimen', siteNum, '#')
-            sitesToUpdate = [siteNum]
+            fetch = partial(self.refinementRecords, 'specimen', siteNum, '#')
+            after = partial(self.inheritGeoRefFields, [siteNum])
         elif selType == 'allRec':
-            records = self.getSiteSpecimens()
-            # less hacky method to get every site level record
-            rowsToProcess = [idx for idx, record in enumerate(records) if record[1] != '#']
-            sitesToUpdate = rowsToProcess
+            # every site level record
+            fetch = partial(self.refinementRecords, 'siteRecords')
+            after = self.inheritAllGeoRefFields
         else:
-            rowsToProcess = self.getRowsToProcess(selType, siteNum, specimenNum)
-            sitesToUpdate = []
+            fetch = partial(self.refinementRecords, selType, siteNum, specimenNum)
+            after = None
+        return [(genLocality, fetch, None, after)]
 
-        print(rowsToProcess)
-        self.processViewableRecords(rowsToProcess, self.parent.locality.genLocality)
-        self.inheritGeoRefFields(sitesToUpdate)  # send site data down stream.
+    def inheritAllGeoRefFields(self):
+        """ passess all geoReference fields from every site to their children """
+        self.inheritGeoRefFields(None)
 
     def inheritGeoRefFields(self, sitesToUpdate):
-        """ passess all geoReference fields from sites to children records """
-        df = self.datatable
+        """ passess all geoReference fields from sites to children records.
+        sitesToUpdate is a list of siteNumbers, or None for every site."""
+        self.flushRefinement()  # be sure the site records are up to date
         geoRefCols = ['country', 'stateProvince', 'county',
                       'municipality', 'path', 'locality',
                       'decimalLatitude', 'decimalLongitude',
                       'coordinateUncertaintyInMeters',
                       'minimumElevationInMeters']
 
-        for col in geoRefCols:  # verify the column exists before adding to it.
-            if col not in df:
-                df[col] = ""
-
-        for site in sitesToUpdate:
-            # df.loc[df['Col1'].isnull(),['Col1','Col2', 'Col3']] = replace_with_this.values
-            newVals = df.loc[(df['siteNumber'] == site) & (df['specimenNumber'] != '#')][geoRefCols]
-            df.loc[(df['siteNumber'] == site) & (df['specimenNumber'] != '#'), geoRefCols] = newVals.values.tolist()
-            QApplication.processEvents()
-            self.datatable.update(df)
-            self.update(self.datatable)
-            self.parent.updateTableView()
+        # verify the columns exist before adding to them.
+        self.addColumns(geoRefCols)
+        df = self.datatable
+        isSite = df['specimenNumber'] == '#'
+        if sitesToUpdate is not None:
+            inScope = df['siteNumber'].isin([str(x) for x in sitesToUpdate])
+        else:
+            inScope = pd.Series(True, index=df.index)
+        # each site record's values, joined onto it's specimen records
+        siteVals = df.loc[isSite & inScope, ['siteNumber'] + geoRefCols]
+        siteVals = siteVals.drop_duplicates('siteNumber').set_index('siteNumber')
+        children = df.loc[~isSite & inScope, 'siteNumber']
+        children = children[children.isin(siteVals.index)]
+        newVals = siteVals.reindex(children.values)
+        newVals.index = children.index
+        self.updateRecords(newVals)
 
     def assignCatalogNumbers(self):
         """If appropriate assigns catalogNumbers over each visible row."""
@@ -319,8 +566,7 @@ class PandasTableModel(QtCore.QAbstractTableModel):
                         trunicated_uuid = uuid()[:13]
                         newCatNums.append(trunicated_uuid)
                     df['catalogNumber'] = newCatNums
-                    self.datatable.update(df)
-                    self.update(self.datatable)
+                    self.updateRecords(df)
                     self.parent.updateTableView()
                 elif patCat:  # otherwise use pattern
                     catStartingNum = int(self.parent.settings.get('value_catalogNumberStartingNum'))
@@ -335,8 +581,7 @@ class PandasTableModel(QtCore.QAbstractTableModel):
                                                  'Assigning Catalog Numbers')
                     if answer is True:  # if the user agreed to assign the catalog numbers
                         df['catalogNumber'] = newCatNums
-                        self.datatable.update(df)
-                        self.update(self.datatable)
+                        self.updateRecords(df)
                         self.parent.updateTableView()
                         self.parent.settings.updateStartingCatalogNumber(catStartingNum)
                         # after adding catnums pull in results and check for uniqueness
@@ -358,65 +603,66 @@ class PandasTableModel(QtCore.QAbstractTableModel):
                                 'Assigning Catalog Numbers')
                             if answer is True:  # if the user agreed to assign the catalog numbers
                                 dfNonUnique['catalogNumber'] = newCatNums
-                                self.datatable.update(dfNonUnique)
-                                self.datatable.update(dfNonUnique)
-                                self.update(self.datatable)
+                                self.updateRecords(dfNonUnique)
                                 self.parent.updateTableView()
                                 self.parent.settings.updateStartingCatalogNumber(catStartingNum)
 
     def verifyTaxButton(self):
-        """ applies verifyTaxonomy over each visible row."""
+        """ applies verifyTaxonomy over each visible row, once per distinct name."""
         # refresh tax settings
-        self.addToUndoList('verify taxonomy process')  # set checkpoint in undostack
         self.parent.tax.readTaxonomicSettings()
-        rowsToProcess = self.getRowsToProcess(*self.parent.getTreeSelectionType())
-        self.processViewableRecords(rowsToProcess, self.parent.tax.verifyTaxonomy)
+        selection = self.parent.getTreeSelectionType()
+        fetch = partial(self.refinementRecords, *selection)
+        tax = self.parent.tax
+        verify = bulkFunction(tax.verifyTaxonomyBulk)
+        steps = [(verify, fetch, tax.prefetchAlignments, None)]
+        self.runRefinement(steps, 'verify taxonomy process')
 
     def verifyAllButton(self):
         """ applies verifyTaxonomy and geoRef over each visible row"""
         # TODO find logical point in workflow to clean associatedTaxa.
+        self.parent.tax.readTaxonomicSettings()
+        self.parent.locality.readGeocodeSettings()
         selType, siteNum, specimenNum = self.parent.getTreeSelectionType()
-        xButton = self.parent.statusBar.pushButton_Cancel
-        xButton.setEnabled(True)
         if selType in ['site', 'specimen']:
             sites = [siteNum]
         else:  # it is probably 'allRec'.
-            sites = set([x for x, y in self.getSiteSpecimens() if y != '#'])
-
+            sites = sorted(set([x for x, y in self.getSiteSpecimens() if y != '#']))
+
+        tax = self.parent.tax
+        verify = bulkFunction(tax.verifyTaxonomyBulk)
+        genLocality = bulkFunction(self.parent.locality.genLocalityBulk)
+        # resolve the whole selection's names up front, then site-by-site
+        fetch = partial(self.refinementRecords, selType, siteNum, specimenNum)
+        steps = [(None, fetch, tax.prefetchAlignments, None)]
         for site in sites:  # enforce a site-by-site workflow
-            QApplication.processEvents()
-            if xButton.status:  # check for cancel button
-                break
+            fetch = partial(self.refinementRecords, 'site', site)
+            steps.append((verify, fetch, None, None))
+            fetch = partial(self.refinementRecords, 'specimen', site, '#')
+            after = partial(self.verifySiteFinished, site)
+            steps.append((genLocality, fetch, None, after))
+        self.runRefinement(steps, 'verify all process', self.parent.testRunLabels)
+
+    def verifySiteFinished(self, site):
+        """ called on the GUI thread as verifyAllButton finishes each site.
+        Passes the site's geoReference fields down and offers the
+        associatedTaxa dialog according to user policy."""
+        self.inheritGeoRefFields([site])
+        # check user policy for associatedTaxa dialog
+        if self.parent.settings.get('value_associatedAlways', True):
+            showDialog = True
+        elif self.parent.settings.get('value_associatedOnly', False):
+            records = self.getRowsToKeep('site', siteNum=site)
+            showDialog = len(records) > 2
+        elif self.parent.settings.get('value_associatedNever', False):
+            showDialog = False
+        else:
+            showDialog = True
+        if showDialog:
+            # the dialog works from the user's view, so bring the site into it
             self.parent.selectTreeWidgetItemByName(f'Site {site}')
-            self.parent.updateTableView()
             self.parent.expandCurrentTreeWidgetItem()
-            QApplication.processEvents()
-            self.verifyTaxButton()
-            if xButton.status:  # check for cancel button
-                break
-            self.geoRef(selType)
-            if xButton.status:  # check for cancel button
-                break
-            # check user policy for associatedTaxa dialog
-            if self.parent.settings.get('value_associatedAlways', True):
-                self.associatedTaxDialog()
-            elif self.parent.settings.get('value_associatedOnly', False):
-                records = self.getRowsToKeep('site', siteNum=site)
-                if len(records) > 2:
-                    self.associatedTaxDialog()
-            elif self.parent.settings.get('value_associatedNever', False):
-                # do nothing
-                pass
-            else:
-                self.associatedTaxDialog()
-
-            if xButton.status:  # check for cancel button
-                break
-            QApplication.processEvents()
-        self.parent.testRunLabels()
-        xButton.setEnabled(False)
-        xButton.status = False
-        self.parent.setTreeSelectionByType(selType, siteNum, specimenNum)  # return the selection
+            self.associatedTaxDialog()
 
     def associatedTaxDialog(self):
         """ displays the associatedTaxa dialog and waits for user input """
@@ -428,29 +674,108 @@ class PandasTableModel(QtCore.QAbstractTableModel):
         self.parent.toggleAssociated()  # call user input window and wait
         waitingForUser.exec_()
 
-    def processViewableRecords(self, rowsToProcess, func):
-        """ applies a function over each row among rowsToProcess (by index)"""
-        # self.parent.statusBar.label_status
+    def runRefinement(self, steps, description, onFinished=None):
+        """ runs refinement steps (see refinementWorker) on a worker thread.
+        Results are buffered and committed to the datatable in chunks, every
+        flushRows records or flushMs milliseconds, whichever is first."""
+        if self.refinementThread is not None:
+            self.parent.userNotice('A refinement process is already running.', 'Refinement process', inclHalt=False)
+            return
+        self.addToUndoList(description)  # set checkpoint in undostack
         xButton = self.parent.statusBar.pushButton_Cancel
-        df = self.datatable.loc[rowsToProcess]
-        totRows = len(df)
+        xButton.status = False
+        xButton.setEnabled(True)
+        self.refinementBuffer = []  # holds (key, changes) tuples until flushed
+        self.flushRows = max(int(self.parent.settings.get('value_flushRows', 50)), 1)
+        flushMs = int(self.parent.settings.get('value_flushMs', 1000))
+        self.refinementOnFinished = onFinished
+
+        worker = refinementWorker(steps, self.parent.dispatcher, lambda: xButton.status,
+                                  self.parent.userNotice)
+        thread = QtCore.QThread()
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.recordProcessed.connect(self.bufferRefinement)
+        worker.progress.connect(self.refinementProgress)
+        worker.finished.connect(self.refinementFinished)
+        # quit from the worker thread, so refinementFinished can wait() on it
+        worker.finished.connect(thread.quit, QtCore.Qt.DirectConnection)
+        self.flushTimer = QtCore.QTimer()
+        self.flushTimer.timeout.connect(self.flushRefinement)
+        self.flushTimer.start(flushMs)
+        # keep references, otherwise they may be garbage collected mid run
+        self.refinementWorker = worker
+        self.refinementThread = thread
+        self.updateTableActions()
+        thread.start()
+
+    def bufferRefinement(self, key, changes):
+        """ receives a record's changes from the refinementWorker """
+        self.refinementBuffer.append((key, changes))
+        if len(self.refinementBuffer) >= self.flushRows:
+            self.flushRefinement()
+
+    def flushRefinement(self):
+        """ commits the buffered refinement results to the datatable in one
+        update. Records are found by their site & specimen numbers, since
+        rows may have moved if the user edited while the worker ran."""
+        buffer = self.refinementBuffer
+        if len(buffer) == 0:
+            return
+        self.refinementBuffer = []
+        indices = []
+        results = []
+        for (siteNum, specimenNum), changes in buffer:
+            i = self.keyIndex.recordPosition(siteNum, specimenNum)
+            if i is None:
+                continue  # the record was removed or renumbered
+            indices.append(i)
+            results.append(changes)
+        if len(indices) > 0:
+            self.updateRecords(pd.DataFrame(results, index=indices))
+            # refresh the user's view once per flush, rather than once per row
+            self.parent.form_view.fillFormFields()
+
+    def refinementProgress(self, done, total):
         pb = self.parent.statusBar.progressBar
         pb.setMinimum(0)
-        pb.setMaximum(totRows)
-        for c, i in enumerate(rowsToProcess):
-            QApplication.processEvents()
-            if xButton.status:  # check for cancel button
-                break
-            rowData = df.loc[i]
-            df.loc[i] = func(rowData)
-            pb.setValue(c + 1)
-            # msg = (f'{c + 1} of {totRows}')
-            df.update(rowData)
-            self.datatable.update(df)
-            self.update(self.datatable)
-            self.parent.updateTableView()
-        self.parent.form_view.fillFormFields()
-        pb.setValue(0)
+        pb.setMaximum(total)
+        pb.setValue(done)
+
+    def refinementFinished(self, cancelled):
+        """ called as the refinementWorker finishes, fails or is cancelled """
+        self.flushTimer.stop()
+        # commit what remains, including any results finished before a cancel
+        self.flushRefinement()
+        self.refinementThread.wait()
+        self.refinementWorker = None
+        self.refinementThread = None
+        xButton = self.parent.statusBar.pushButton_Cancel
+        xButton.setEnabled(False)
+        xButton.status = False
+        self.parent.statusBar.progressBar.setValue(0)
+        # apply any accepted decisions which were deferred during the run
+        for key, changes in self.parent.reviewDecisions():
+            self.refinementBuffer.append((key, changes))
+        self.flushRefinement()
+        self.updateTableActions()
+        if self.refinementOnFinished is not None and not cancelled:
+            self.refinementOnFinished()
+
+    def refinementRecords(self, selType, siteNum=None, specimenNum=None):
+        """ returns a list of (key, rowData) tuples for the refinementWorker,
+        where key is (siteNumber, specimenNumber). A selType of 'siteRecords'
+        returns each site level record."""
+        df = self.datatable
+        if selType == 'siteRecords':
+            rows = df.index[df['specimenNumber'] == '#'].tolist()
+        else:
+            rows = self.getRowsToKeep(selType, siteNum, specimenNum)
+        records = []
+        for i in rows:
+            rowData = df.iloc[i].copy()
+            records.append(((rowData['siteNumber'], rowData['specimenNumber']), rowData))
+        return records
 
     def getRowsToProcess(self, selType, siteNum=None, specimenNum=None):
         """ defined for clarity, calls getRowsToKeep with the same args."""
@@ -458,26 +783,16 @@ class PandasTableModel(QtCore.QAbstractTableModel):
 
     def getRowsToKeep(self, selType, siteNum=None, specimenNum=None):
         """ Returns list of row indices associated with inputs """
-        df = self.datatable
-        # df = df[~df['specimenNumber'].str.contains('#')]
+        # lookups are done against self.keyIndex, rather than scanning the df
         if selType == 'site':
-            rowsToKeep = df[df['siteNumber'] == siteNum].index.values.tolist()
+            rowsToKeep = self.keyIndex.sitePositions(siteNum)
         elif selType == 'specimen':
-            rowsToKeep = df[(df['siteNumber'] == siteNum) & (df['specimenNumber'] == specimenNum)].index.values.tolist()
+            row = self.keyIndex.recordPosition(siteNum, specimenNum)
+            rowsToKeep = [] if row is None else [row]
         else:  # otherwise, keep everything (usually "allRec")
-            rowsToKeep = df.index.values.tolist()
+            rowsToKeep = list(range(self.rowCount()))
         return rowsToKeep
 
-    def getRowsToHide(self, selType, siteNum=None, specimenNum=None):
-        """ Returns list of row indicies NOT associated with input options
-        called from mainWindow's updateTableView() following 
-        tree_widget selection changes."""
-        df = self.datatable
-        allRows = df.index.values.tolist()
-        rowsToKeep = self.getRowsToKeep(selType, siteNum, specimenNum)
-        rowsToHide = [x for x in allRows if x not in rowsToKeep]
-        return rowsToHide
-
     def getSiteSpecimens(self):
         """ Returns a list of tuples for each siteNumber specimenNumber combination
         called from mainWindow's populateTreeWidget"""
@@ -507,9 +822,9 @@ class PandasTableModel(QtCore.QAbstractTableModel):
         if index.isValid() and role == QtCore.Qt.EditRole:
             i = index.row()
             j = index.column()
-            self.datatable.iloc[i, j] = value
-            # this emission causes real time edits to appear on previewPDF window
-            self.dataChanged.emit(index, index, (QtCore.Qt.DisplayRole,))
+            # setCellValues' dataChanged emission causes real time edits to
+            # appear on previewPDF window
+            self.setCellValues([i], self.datatable.columns[j], value)
             return True
         return False
 
@@ -523,6 +838,8 @@ class PandasTableModel(QtCore.QAbstractTableModel):
 
     def open_CSV(self, fileName=None):
         # is triggered by the action_Open.
+        if self.refinementThread is not None:
+            return  # the running refinement would write into the new records
         fileName, _ = QtWidgets.QFileDialog.getOpenFileName(None, "Open CSV",
                                                             QtCore.QDir.homePath(), "CSV (*.csv)")
         _translate = QtCore.QCoreApplication.translate
@@ -624,9 +941,12 @@ class PandasTableModel(QtCore.QAbstractTableModel):
                     # complicated lambda deals with rounding values of unknown data types
                     df['minimumElevationInMeters'] = df['minimumElevationInMeters'].apply(
                         lambda x: round(x, 1) if isinstance(x, (int, float)) else x).astype(str)
-                self.update(df)  # this function updates the visible dataframe
+                self.addToUndoList(f'loaded {Path(fileName).name}')  # set checkpoint in undostack
+                self.replaceTable(df)  # this function updates the visible dataframe
                 self.parent.populateTreeWidget()
                 self.parent.form_view.fillFormFields()
+                # optionally, resolve lookups in the background
+                self.parent.cacheWarmer.start(self.datatable)
                 return True
             # generalized exception, may be risky but is broad.
             except Exception as e:
@@ -817,9 +1137,10 @@ class PandasTableModel(QtCore.QAbstractTableModel):
         # return the assignedDF and boolean if the dialog status was accepted.
         return (resultDF, result == QDialog.Accepted)
 
-    def sortDF(self, df):
+    def sortDF(self, df, resetIndex=True):
         """ accepts a dataframe and returns it sorted in an ideal manner. 
-        Expects the dataframe to have siteNumber and specimenNumber columns """
+        Expects the dataframe to have siteNumber and specimenNumber columns.
+        if resetIndex is False, the original index labels are kept."""
         # first try and organize 2 temporary "sort on" columns
         try:
             df['sortSpecimen'] = df['specimenNumber'].str.replace('#', '0').astype('int64')
@@ -829,9 +1150,12 @@ class PandasTableModel(QtCore.QAbstractTableModel):
             df = df.fillna(value=fillValues)
         except:
             return False
-        df.sort_values(by=['sortSite', 'sortSpecimen'], inplace=True, ascending=True)
+        # a stable sort keeps the existing order of equally ranked rows
+        df.sort_values(by=['sortSite', 'sortSpecimen'], inplace=True,
+                       ascending=True, kind='mergesort')
         df.drop(columns=['sortSite', 'sortSpecimen'], inplace=True)
-        df.reset_index(drop=True, inplace=True)
+        if resetIndex:
+            df.reset_index(drop=True, inplace=True)
         return df
 
     def inferrecordNumber(self, rowData):
@@ -963,6 +1287,8 @@ class PandasTableModel(QtCore.QAbstractTableModel):
         # is triggered by the action_new_Records.
         """Clears all the data and makes a new table
         if skipDialog is True, it won't ask."""
+        if self.refinementThread is not None:
+            return  # the running refinement would write into the new records
         qm = QMessageBox
         if skipDialog:
             ret = QMessageBox.Yes
@@ -1024,7 +1350,19 @@ class PandasTableModel(QtCore.QAbstractTableModel):
 
             df = pd.DataFrame.from_dict(newDFDict)
             df.fillna('')  # make any nans into empty strings.
-            self.update(df)  # this function actually updates the visible dataframe
+            self.replaceTable(df)  # this function actually updates the visible dataframe
             self.parent.populateTreeWidget()
             self.parent.form_view.fillFormFields()
         return
+
+
+def contiguousRanges(positions):
+    """ given an iterable of integer positions, returns a sorted list of
+    (first, last) tuples for each contiguous run. ie: [1,2,3,7] -> [(1,3),(7,7)]"""
+    ranges = []
+    for pos in sorted(set(positions)):
+        if ranges and pos == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], pos)
+        else:
+            ranges.append((pos, pos))
+    return ranges
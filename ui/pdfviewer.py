@@ -17,6 +17,32 @@ import Resources_rc
 import fitz
 from fitz.utils import getColor
 
+previewErrors = {'oversize': ["Label contents do not fit!", "Adjust label settings, or content."],
+                 'preview': ["Label Preview Window"]}
+
+
+def previewImage(labelPDF, pdfBytes, errorType=False, zoom=1.0):
+    """ returns a QImage of the first page of pdfBytes, or of an error label
+    for errorType, scaled by zoom. labelPDF is the LabelPDF which builds the
+    error labels. Unlike a QPixmap, this is safe off of the GUI thread."""
+    # fitz & labelPDF are shared with the GUI thread
+    with labelPDF.lock:
+        if errorType:
+            pdfBytes = labelPDF.genErrorLabel(previewErrors.get(errorType, previewErrors['preview']))
+        try:
+            document = fitz.open(stream=pdfBytes, filetype='pdf')  # Try loading from bytes
+            pdfPage = document[0]
+        except IndexError:
+            pdfBytes = labelPDF.genErrorLabel(previewErrors['preview'])
+            document = fitz.open(stream=pdfBytes, filetype='pdf')
+            pdfPage = document[0]
+        mat = fitz.Matrix(zoom, zoom)  # the scaling / transformations
+        pix = pdfPage.getPixmap(alpha=False, matrix=mat)
+        fmt = QImage.Format_RGB888
+        img = QImage(pix.samples, pix.width, pix.height, pix.stride, fmt)
+        return img.copy()  # detach it from pix's buffer
+
+
 class PDFViewer(QLabel):
 
     '''
@@ -57,27 +83,12 @@ class PDFViewer(QLabel):
         # appears to be a 10% resize error somewhere between these values, the 1.1 corrects this
 
     def load_preview(self, pdfBytes, errorType=False):
-
-        if errorType:
-            if errorType == 'oversize':
-                errorText = ["Label contents do not fit!", "Adjust label settings, or content."]
-            elif errorType == 'preview':
-                errorText = ["Label Preview Window"]
-            pdfBytes = self.parent.p.genErrorLabel(errorText)
-            self.document = fitz.open(stream=pdfBytes, filetype='pdf')
-            pdfPage = self.document[0]
-        try:
-            self.document = fitz.open(stream=pdfBytes, filetype='pdf')  # Try loading from bytes
-            pdfPage = self.document[0]
-        except IndexError:
-            errorText = ["Label Preview Window"]
-            pdfBytes = self.parent.p.genErrorLabel(errorText)
-            self.document = fitz.open(stream=pdfBytes, filetype='pdf')
-            pdfPage = self.document[0]
+        """ displays pdfBytes (or an error label) immediately, on the GUI
+        thread. The previews are normally rendered by previewRenderer. """
         zoom = int(self.settings.get('value_zoomLevel', 100)) / 100
-        mat = fitz.Matrix(zoom, zoom)  # the scaling / transformations
-        pix = pdfPage.getPixmap(alpha=False, matrix=mat)
-        fmt = QImage.Format_RGB888
-        img = QImage(pix.samples, pix.width, pix.height, pix.stride, fmt)
+        self.showPreview(previewImage(self.parent.p, pdfBytes, errorType, zoom))
+
+    def showPreview(self, img):
+        """ displays a QImage rendered by previewImage """
         #x,y = self.getZoom(labXY=True)
         self.setPixmap(QPixmap.fromImage(img))
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A small persistent key / value cache, stored as an SQLite database in the
+user's config folder. Used to remember web service results across sessions.
+Entries expire after a time to live, and the least recently used entries are
+evicted once the cache holds more than maxEntries. Access times are kept in
+memory and written with the next set(), or on exit, so reads never write.
+"""
+import atexit
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from PyQt5.QtCore import QSettings
+
+
+def configDirectory():
+    """ returns the folder holding collBook's settings file """
+    return Path(QSettings('collBook', 'collBook').fileName()).parent
+
+
+class persistentCache():
+    """ keys may be any json serializable value (ie: a tuple), as may values.
+    Safe to use from worker threads. If the database is unavailable, entries
+    are kept in memory for the session instead. """
+    evictEvery = 100  # number of writes between eviction checks
+
+    def __init__(self, fileName, ttlDays=30, maxEntries=50000):
+        self.ttlDays = ttlDays
+        self.maxEntries = maxEntries
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.memory = {}  # used only when the database is unavailable
+        self.accessed = {}  # {key: access time}, not yet written
+        try:
+            Path(fileName).parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(str(fileName), check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS cache '
+                            '(key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)')
+            self.db.commit()
+        except (sqlite3.Error, OSError) as e:
+            # without a usable database, remember things for this session only
+            print(f'persistent cache unavailable ({fileName}): {e}')
+            self.db = None
+        atexit.register(self.close)
+
+    def setLimits(self, ttlDays, maxEntries):
+        self.ttlDays = ttlDays
+        self.maxEntries = maxEntries
+
+    def get(self, key, default=None):
+        """ returns the cached value for key, or default if it is missing or
+        has expired. """
+        key = json.dumps(key)
+        if self.db is None:
+            with self.lock:
+                value = self.memory.get(key)
+            return default if value is None else json.loads(value)
+        now = time.time()
+        with self.lock:
+            try:
+                row = self.db.execute('SELECT value, created FROM cache WHERE key = ?',
+                                      (key,)).fetchone()
+                if row is None:
+                    return default
+                value, created = row
+                if now - created > self.ttlDays * 86400:
+                    self.db.execute('DELETE FROM cache WHERE key = ?', (key,))
+                    self.db.commit()
+                    return default
+                self.accessed[key] = now  # written later, with flushAccessed
+            except sqlite3.Error as e:
+                print(f'persistent cache read failed: {e}')
+                return default
+        return json.loads(value)
+
+    def set(self, key, value):
+        if self.db is None:
+            with self.lock:
+                self.memory[json.dumps(key)] = json.dumps(value)
+            return
+        now = time.time()
+        with self.lock:
+            try:
+                self.db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                                (json.dumps(key), json.dumps(value), now, now))
+                self.accessed.pop(json.dumps(key), None)
+                self.flushAccessed()
+                self.writes += 1
+                if self.writes % self.evictEvery == 0:
+                    self.evict()
+                self.db.commit()
+            except sqlite3.Error as e:
+                print(f'persistent cache write failed: {e}')
+
+    def delete(self, key):
+        """ forgets the entry for key, if there is one """
+        if self.db is None:
+            with self.lock:
+                self.memory.pop(json.dumps(key), None)
+            return
+        with self.lock:
+            try:
+                self.db.execute('DELETE FROM cache WHERE key = ?', (json.dumps(key),))
+                self.db.commit()
+            except sqlite3.Error as e:
+                print(f'persistent cache write failed: {e}')
+
+    def flushAccessed(self):
+        """ writes the pending access times in one statement, to be
+        committed by the caller. Expects self.lock to be held. """
+        if len(self.accessed) == 0:
+            return
+        self.db.executemany('UPDATE cache SET accessed = ? WHERE key = ?',
+                            [(accessed, key) for key, accessed in self.accessed.items()])
+        self.accessed = {}
+
+    def close(self):
+        """ writes the pending access times and closes the database """
+        if self.db is None:
+            return
+        with self.lock:
+            try:
+                self.flushAccessed()
+                self.db.commit()
+                self.db.close()
+            except sqlite3.Error as e:
+                print(f'persistent cache write failed: {e}')
+            self.db = None
+
+    def evict(self):
+        """ removes expired entries, then the least recently used entries
+        beyond maxEntries. Expects self.lock to be held. """
+        self.db.execute('DELETE FROM cache WHERE created < ?',
+                        (time.time() - self.ttlDays * 86400,))
+        self.db.execute('DELETE FROM cache WHERE key IN '
+                        '(SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                        (self.maxEntries,))
+
+    def clear(self):
+        if self.db is None:
+            self.memory.clear()
+            return
+        with self.lock:
+            self.accessed = {}
+            self.db.execute('DELETE FROM cache')
+            self.db.commit()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Renders the label preview on a worker thread, keeping typing and the zoom
+slider responsive. Each request (ie: every edit, or tick of the zoom slider)
+restarts a short timer, so a burst of requests is rendered once, after it
+ends. The delay is set by value_previewDelayMs.
+
+Requests are numbered. The worker skips any render which is no longer the
+latest request, before building the label and again before rasterizing it,
+and the GUI discards any stale render which still arrives.
+
+The worker builds the previews with it's own LabelPDF, which reads a
+labelSettings snapshot taken on the GUI thread with each request, so the
+settings window is never read off of the GUI thread.
+"""
+from PyQt5 import QtCore
+from PyQt5.QtWidgets import QApplication
+from reportlab.platypus.doctemplate import LayoutError
+from ui.pdfviewer import previewImage
+from ui.printlabels import LabelPDF, labelSettings
+
+# the settings read by LabelPDF.initLogoCanvas
+logoSettings = ['value_inc_Logo', 'value_LogoPath', 'value_LogoOpacity', 'value_LogoScaling',
+                'value_LogoMargin', 'value_LogoAlignment', 'value_X', 'value_Y']
+
+
+class previewWorker(QtCore.QObject):
+    rendered = QtCore.pyqtSignal(int, object)  # request number, QImage
+
+    def __init__(self, lock, latestRequest):
+        super(previewWorker, self).__init__()
+        self.lock = lock  # the GUI's LabelPDF.lock, also held while fitz is in use
+        self.latestRequest = latestRequest  # callable, returns the newest request number
+        self.labelPDF = None
+        self.logoValues = None
+
+    def labelPDFFor(self, settings):
+        """ returns the worker's LabelPDF, reading the settings snapshot.
+        The logo is only rebuilt when it's settings have changed. """
+        logoValues = [settings.get(x) for x in logoSettings]
+        if self.labelPDF is None:
+            self.labelPDF = LabelPDF(settings)
+            self.labelPDF.lock = self.lock
+        else:
+            self.labelPDF.settings = settings
+            if logoValues != self.logoValues:
+                self.labelPDF.initLogoCanvas()
+        self.logoValues = logoValues
+        return self.labelPDF
+
+    def render(self, request, rowData, errorType, zoom, settings):
+        """ builds and rasterizes a preview, on the worker thread """
+        if request != self.latestRequest():
+            return  # a newer request has been made
+        labelPDF = self.labelPDFFor(settings)
+        pdfBytes = None
+        if not errorType:
+            try:
+                pdfBytes = labelPDF.genLabelPreview(rowData)  # retrieves the pdf in Bytes
+            except LayoutError:  # Not enough space on label for the content
+                errorType = 'oversize'
+        if request != self.latestRequest():
+            return
+        img = previewImage(labelPDF, pdfBytes, errorType, zoom)
+        self.rendered.emit(request, img)
+
+
+class previewRenderer(QtCore.QObject):
+    renderRequested = QtCore.pyqtSignal(int, object, object, float, object)
+
+    def __init__(self, parent):
+        super(previewRenderer, self).__init__(parent)
+        self.parent = parent
+        self.requestNumber = 0
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.dispatch)
+        self.worker = previewWorker(parent.p.lock, lambda: self.requestNumber)
+        self.thread = QtCore.QThread()
+        self.worker.moveToThread(self.thread)
+        # queued, since the worker lives on the other thread
+        self.renderRequested.connect(self.worker.render)
+        self.worker.rendered.connect(self.showRender)
+        self.thread.start()
+        app = QApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.stop)
+
+    def request(self):
+        """ asks for the preview to be updated, once requests stop arriving """
+        self.requestNumber += 1
+        self.timer.start(int(self.parent.settings.get('value_previewDelayMs', 100)))
+
+    def dispatch(self):
+        """ gathers the records to preview and the label settings, on the
+        GUI thread, then hands them to the worker. """
+        rowData = self.parent.getVisibleRowData()
+        selType, siteNum, specimenNum = self.parent.getTreeSelectionType()
+        errorType = False
+        if (isinstance(rowData, list)) & (selType != 'allRec'):
+            if (selType == 'site') & (len(rowData) > 1):
+                rowData = [rowData[1]]  # only want first row, but other functions expect a list
+            else:
+                rowData = [rowData[0]]
+        else:  # there is not appropriate row data to preview
+            rowData = None
+            errorType = 'preview' # display generic "Preview window text"
+        zoom = int(self.parent.settings.get('value_zoomLevel', 100)) / 100
+        settings = labelSettings.fromSettings(self.parent.settings)
+        self.renderRequested.emit(self.requestNumber, rowData, errorType, zoom, settings)
+
+    def showRender(self, request, img):
+        if request == self.requestNumber:  # otherwise a newer render is coming
+            self.parent.pdf_preview.showPreview(img)
+
+    def stop(self):
+        """ stops the worker thread, dropping any queued renders """
+        self.requestNumber += 1
+        self.timer.stop()
+        self.thread.quit()
+        self.thread.wait()
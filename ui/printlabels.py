@@ -8,6 +8,7 @@ from reportlab.lib.styles import ParagraphStyle
 from reportlab.lib.enums import TA_LEFT, TA_RIGHT, TA_CENTER
 from reportlab.graphics.barcode import code128
 from reportlab.lib.units import mm
+from reportlab import rl_config
 from reportlab.lib.utils import ImageReader
 from reportlab.pdfbase.pdfmetrics import stringWidth
 from PIL import Image, ImageFilter
@@ -15,6 +16,12 @@ import math
 import os
 import sys
 import io
+import multiprocessing
+import threading
+import json
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 # TODO with the conversion to pyqt5, pymupdf should allow us to display & open 
 # print dialogs for the pdfs without relying on system installed pdf viewer
@@ -30,6 +37,55 @@ from PyQt5.QtWidgets import QFileDialog
 # dynamic spacing needs redesigned and simplified
 # before size options are added.
 
+# the record fields read by LabelPDF.buildLabelTable, a label's table rows are
+# reused while these (and the label settings) are unchanged.
+labelFields = ['collectionName', 'catalogNumber', 'family', 'Label Project', 'verifiedBy',
+               'eventDate', 'scientificName', 'scientificNameAuthorship', 'locality',
+               'associatedTaxa', 'habitat', 'individualCount', 'substrate',
+               'establishmentMeans', 'locationRemarks', 'occurrenceRemarks', 'recordedBy',
+               'associatedCollectors', 'identifiedBy', 'recordNumber', 'decimalLatitude',
+               'decimalLongitude', 'coordinateUncertaintyInMeters', 'minimumElevationInMeters']
+
+
+def contentHash(values):
+    """ returns a short hex digest of a json serializable list of values """
+    data = json.dumps(values, ensure_ascii=False).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class labelSettings():
+    """ a picklable snapshot of the settings read by LabelPDF, handed to the
+    export worker processes in place of the settingsWindow. """
+    def __init__(self, values, dummyCatNumber=False):
+        self.values = values
+        self.dummyCatNumber = dummyCatNumber
+
+    @classmethod
+    def fromSettings(cls, settings):
+        if isinstance(settings, cls):
+            return settings
+        values = {}
+        for key in settings.settings.allKeys():
+            value = settings.get(key)
+            if isinstance(value, (str, int, float, bool)):
+                values[key] = value
+        return cls(values, settings.dummyCatNumber)
+
+    def get(self, key, altValue = ""):
+        return self.values.get(key, altValue)
+
+    def setValue(self, key, value):
+        self.values[key] = value
+
+
+def renderLabelChunk(settings, labelDataInput):
+    """ returns the pdf bytes of a chunk of labels. Runs in the export worker
+    processes, see LabelPDF.genPrintLabelPDFsParallel """
+    pdf = LabelPDF(settings)
+    pdf.initLogoCanvas()
+    return pdf.genPrintLabelPDFs(labelDataInput, returnBytes = True)
+
+
 class LabelPDF():
 
     def __init__(self, settings):
@@ -39,6 +95,14 @@ class LabelPDF():
         self.logoPath = self.settings.get('value_LogoPath', '')
         self.opacity = 0
         self.logo = False
+        # compiled ParagraphStyles, {(fontName, relFont, xPaperSize, yPaperSize): styles}
+        self.styleSets = {}
+        self.styles = {}
+        # built label tables, {settingsHash + recordHash: Table}, least recently used first
+        self.tableCache = OrderedDict()
+        self.settingsHash = ''
+        # held while building, as the previews are built on a worker thread
+        self.lock = threading.RLock()
         if self.useLogo:
             self.initLogoCanvas()
 
@@ -62,7 +126,9 @@ class LabelPDF():
                 except:  # if the path provided seems broken, clear the setting
                     self.logoPath = ''
                     self.settings.setValue('value_LogoPath','')
-                    self.settings.settingsWindow.value_LogoPath.setText('')
+                    # the export workers' labelSettings have no window
+                    if hasattr(self.settings, 'settingsWindow'):
+                        self.settings.settingsWindow.value_LogoPath.setText('')
                     return
                 logoDPIx, logoDPIy = im.info['dpi']  # get DPI of input logo image
                 label_X = int(self.settings.get('value_X'))  # get mm size of labels
@@ -140,21 +206,136 @@ class LabelPDF():
            defaultFileName = the filename to use as the default when saving the pdf file.
            returnBytes = If the result should be a bytes object (used for label previews).
            Otherwise, produces (and attempts to open) a pdf file."""
+        labelDataInput = self.stripSiteRows(labelDataInput)
+        if len(labelDataInput) < 1:  # exit early if nothing is left
+            return None
+        if not returnBytes and self.exportWorkers(len(labelDataInput)) > 1:
+            # takes the lock only long enough to snapshot the settings
+            return self.genPrintLabelPDFsParallel(labelDataInput, defaultFileName)
+        # shared with the preview worker thread, see previewrenderer.py
+        with self.lock:
+            self.readLabelSettings()
+            labelDataInput = self.prepareLabelData(labelDataInput)
+
+            elements = []      # a list to dump the flowables into for pdf generation
+            for labelFieldsDict in labelDataInput:
+                #Add the flowables to the elements list.
+                elements.append(self.labelTable(labelFieldsDict))
+                elements.append(PageBreak())
+
+            #Build the base document's parameters.
+        
+            if returnBytes:  # if we only want to make a preview save it to a stream
+                byteStream = io.BytesIO()
+                labelFileName = byteStream
+
+            elif defaultFileName:
+                labelFileName = defaultFileName
+                #labelFileName, _ = QFileDialog.getSaveFileName(None, 'Save Label PDF', defaultFileName, 'PDF(*.pdf)')
+            else:
+                labelFileName, _ = QFileDialog.getSaveFileName(None, 'Save Label PDF', os.getenv('HOME'), 'PDF(*.pdf)')
+
+            if not labelFileName:  # If the user canceled the dialog
+                return
+            # TODO fill in title and author based on select form_view or settings info                
+            doc = BaseDocTemplate(labelFileName,
+                                  pagesize=self.customPageSize,
+                                  pageTemplates=[],
+                                  showBoundary=0,
+                                  leftMargin=self.xMargin,
+                                  rightMargin=self.xMargin,
+                                  topMargin=self.yMargin,
+                                  bottomMargin=self.yMargin,
+                                  allowSplitting= self.allowSplitting,           
+                                  title=None,
+                                  author=None,
+                                  _pageBreakQuick=1,
+                                  encrypt=None)
+    
+            #Function to build the pdf
+    
+            def build_pdf(flowables):
+                """ actually loads the flowables into the document """
+
+                doc.addPageTemplates(
+                    [
+                        PageTemplate(
+                            onPage = self.labelSetup,
+                            frames=[
+                                platypusFrame(
+                                    doc.leftMargin,
+                                    doc.bottomMargin,
+                                    doc.width,
+                                    doc.height,
+                                    topPadding=0,
+                                    bottomPadding=0,
+                                    id=None
+                                ),
+                            ]
+                        ),
+                    ]
+                )
+                try:
+                    doc.build(flowables)
+                except LayoutError:
+                    raise LayoutError
+        
+            try:
+                build_pdf(elements)
+            except LayoutError:
+                # if there is a layout error, raise it
+                raise LayoutError
+        
+            if returnBytes:  # If a preview is being generated just return the bytes
+                # calling the byte stream "labelFileName" is a fast and dirty 
+                # workaround to keep existing code functional
+                pdfBytes = labelFileName.getvalue()  # save the stream to a variable
+                labelFileName.close()  # close the buffer down
+                return pdfBytes  # return the results
+        
+            #Open the file after it is built (maybe change/remove this later? Idealy, a preview or something
+            self.openFile(labelFileName)
 
-        # strip out the site number rows
+    def stripSiteRows(self, labelDataInput):
+        """ returns labelDataInput without the site number rows """
         try:
-            labelDataInput = [x for x in labelDataInput if x.get('specimenNumber') != "#"]
+            return [x for x in labelDataInput if x.get('specimenNumber') != "#"]
         except AttributeError:
-            labelDataInput = [x for x in labelDataInput if "#" not in x.get('recordNumber').split('-')[-1]]
-        if len(labelDataInput) < 1:  # exit early if nothing is left
-            return None
+            return [x for x in labelDataInput if "#" not in x.get('recordNumber').split('-')[-1]]
+
+    def fitCheck(self, labelDataInput):
+        """ returns a list of (labelFieldsDict, overflow) for each label too
+        large for the label dimensions, where overflow is the excess height in
+        mm. Only lays the labels out (as the pdf's frame would), no pdf is
+        produced, so it is cheap enough to run before every export."""
+        # copies, as prepareLabelData alters the dictionaries
+        labelDataInput = [dict(x) for x in self.stripSiteRows(labelDataInput)]
+        if len(labelDataInput) < 1:
+            return []
+        with self.lock:
+            self.readLabelSettings()
+            labelDataInput = self.prepareLabelData(labelDataInput)
+            # the frame in genPrintLabelPDFs, which has platypusFrame's default
+            # left & right padding of 6 points
+            frameWidth = self.xPaperSize - (2 * self.xMargin) - 12
+            frameHeight = self.yPaperSize - (2 * self.yMargin)
+            overflowing = []
+            for labelFieldsDict in labelDataInput:
+                width, height = self.labelTable(labelFieldsDict).wrap(frameWidth, frameHeight)
+                # the test platypusFrame applies before raising a LayoutError
+                if height > frameHeight + rl_config._FUZZ:
+                    overflowing.append((labelFieldsDict, (height - frameHeight) / mm))
+        return overflowing
 
+    def readLabelSettings(self):
+        """ reads the paper size, font and margins from the settings """
         # decent default values 140, 90
         self.xPaperSize = int(self.settings.get('value_X', 140)) * mm
         self.yPaperSize = int(self.settings.get('value_Y', 90)) * mm
         self.relFont = int(self.settings.get('value_RelFont', 12))
          # TODO explore adding font options which are already bundled with reportlab
         self.fontName = self.settings.get('value_fontName', 'Helvetica')
+        self.styles = self.compileStyles()
          
         self.allowSplitting = 0
         self.xMarginProportion = 0
@@ -162,7 +343,13 @@ class LabelPDF():
         self.xMargin = self.xMarginProportion * self.xPaperSize        #Margin set up (dynamically depending on paper sizes.
         self.yMargin = self.xMarginProportion * self.yPaperSize
         self.customPageSize = (self.xPaperSize, self.yPaperSize)
-        
+        # everything besides the record which alters a label's table
+        self.settingsHash = contentHash([self.fontName, self.relFont, self.xPaperSize,
+                                         self.yPaperSize, self.settings.dummyCatNumber])
+        self.tableCacheSize = max(0, int(self.settings.get('value_labelCacheSize', 500)))
+
+    def prepareLabelData(self, labelDataInput):
+        """ applies the optional label settings to each label dictionary """
         # check some of the optional label settings, & make adjustments.
         additionalData = {}
         if self.settings.get('value_inc_VerifiedBy'):
@@ -198,7 +385,28 @@ class LabelPDF():
                 rowData['family'] = ''
             for key, value in additionalData.items():
                 rowData[key] = value
+        return labelDataInput
+
+    def labelTable(self, labelFieldsDict):
+        """ returns a new table for a label, reusing the rows and style
+        worked out for an identical record under the same label settings.
+        Tables are altered as they are wrapped & split, so only their
+        contents are cached. Shared by the previews, fitCheck and exports. """
+        key = self.settingsHash + contentHash([str(labelFieldsDict.get(x, '')) for x in labelFields])
+        tableData = self.tableCache.get(key)
+        if tableData is not None:
+            self.tableCache.move_to_end(key)
+        else:
+            tableData = self.buildLabelTable(labelFieldsDict)
+            self.tableCache[key] = tableData
+            while len(self.tableCache) > self.tableCacheSize:
+                self.tableCache.popitem(last=False)  # evict the least recently used
+        tableList, docTableStyle = tableData
+        return Table([list(x) for x in tableList], style=list(docTableStyle))
 
+    def buildLabelTable(self, labelFieldsDict):
+        """ returns the rows of flowables making up one label, and the style
+        commands for the table holding them """
         tableSty = [                                    #Default table style
                 ('LEFTPADDING',(0,0),(-1,-1), 0),
                 ('RIGHTPADDING',(0,0),(-1,-1), 0),
@@ -294,292 +502,256 @@ class LabelPDF():
                 return barcode128  
             else:
                 return ''
-        elements = []      # a list to dump the flowables into for pdf generation
-        for labelFieldsDict in labelDataInput:
-            def dfl(key):                       # dict lookup helper function
-                value = labelFieldsDict.get(key,'') # return empty string if no result from lookup.
-                return str(value)
+        def dfl(key):                       # dict lookup helper function
+            value = labelFieldsDict.get(key,'') # return empty string if no result from lookup.
+            return str(value)
 
         #Building list of flowable elements below
-            if (len(dfl('catalogNumber')) > 0) | (self.settings.dummyCatNumber != False):
-                row0 = Table([[
-                    Para('collectionName','collectionNameSTY'),
-                    createBarCodes()
-                              ]],
-                colWidths = (self.xPaperSize * .67,self.xPaperSize * .29), rowHeights = None,
+        if (len(dfl('catalogNumber')) > 0) | (self.settings.dummyCatNumber != False):
+            row0 = Table([[
+                Para('collectionName','collectionNameSTY'),
+                createBarCodes()
+                          ]],
+            colWidths = (self.xPaperSize * .67,self.xPaperSize * .29), rowHeights = None,
     
-                style = [
-                        ('VALIGN',(0,0),(0,-1),'TOP'),
-                        ('ALIGN',(0,0),(0,0),'LEFT'),
-                        ('ALIGN',(1,0),(1,0),'RIGHT'),
-                         ])
-            else:
-                row0 = Table([
-                        [Para('collectionName','collectionNameSTY')]])
-                    
-            
-            row1 = Table([
-                [Para('family', 'familyNameSTY')],
-                [Para('Label Project','labelProjectSTY')],
-                [verifiedByPara('verifiedBy','verifiedBySTY')]],
-                         colWidths = self.xPaperSize *.98, rowHeights = None,
-                         style = [
-                        ('BOTTOMPADDING',(0,0),(-1,-1), 2)]
-                         )
-            #ScientificName Row Dynamic Formatting
-            scientificNameElement = sciName('scientificName','scientificNameAuthorship','sciNameSTY')
-            try:            #Test if Scienftific Name can Share a row with Event Date.
-                scientificNameElement.wrap(1400, 1400) #Test wrap the string in a large environment to get it's desired ideal width.
-                sciNameParaWidth = scientificNameElement.getActualLineWidths0()[0]
-                sciHeight = scientificNameElement.height
-            
-            except (AttributeError, IndexError) as e:
-                sciNameParaWidth = 0
-                sciHeight = 0
+            style = [
+                    ('VALIGN',(0,0),(0,-1),'TOP'),
+                    ('ALIGN',(0,0),(0,0),'LEFT'),
+                    ('ALIGN',(1,0),(1,0),'RIGHT'),
+                     ])
+        else:
+            row0 = Table([
+                    [Para('collectionName','collectionNameSTY')]])
+                
+        
+        row1 = Table([
+            [Para('family', 'familyNameSTY')],
+            [Para('Label Project','labelProjectSTY')],
+            [verifiedByPara('verifiedBy','verifiedBySTY')]],
+                     colWidths = self.xPaperSize *.98, rowHeights = None,
+                     style = [
+                    ('BOTTOMPADDING',(0,0),(-1,-1), 2)]
+                     )
+        #ScientificName Row Dynamic Formatting
+        scientificNameElement = sciName('scientificName','scientificNameAuthorship','sciNameSTY')
+        try:            #Test if Scienftific Name can Share a row with Event Date.
+            scientificNameElement.wrap(1400, 1400) #Test wrap the string in a large environment to get it's desired ideal width.
+            sciNameParaWidth = scientificNameElement.getActualLineWidths0()[0]
+            sciHeight = scientificNameElement.height
+        
+        except (AttributeError, IndexError) as e:
+            sciNameParaWidth = 0
+            sciHeight = 0
     
-            if sciNameParaWidth > self.xPaperSize *.96:  #If the string is so large as to not fit, even alone then shrink font and split lines into two rows.
-                row2 = Table([[
-                    Para('eventDate','dateSTY')],
-                    [Spacer(width = self.xPaperSize *.98, height = sciHeight)], #Add spacer between rows for formatting.
-                    [sciName('scientificName','scientificNameAuthorship','sciNameSTYSmall')]],
-                        colWidths = self.xPaperSize *.98 , rowHeights = None, style = tableSty)
-                    
-            elif sciNameParaWidth > self.xPaperSize * -1:   #If the string is too big to share row with event date, split lines into rows.
-                row2 = Table([[
-                    Para('eventDate','dateSTY')],
-                    [Spacer(width = self.xPaperSize *.98, height = sciHeight)],  #Add spacer between rows for formatting.
-                    [sciName('scientificName','scientificNameAuthorship','sciNameSTY')]],
-                        colWidths = self.xPaperSize *.98, rowHeights = None, style = tableSty)               
-            else:
-                row2 = Table([[
-                    sciName('scientificName','scientificNameAuthorship','sciNameSTY'),
-                    Para('eventDate','dateSTY')]],
-                        colWidths = (self.xPaperSize * .80,self.xPaperSize * .18),
-                        rowHeights = None, style = tableSty)
+        if sciNameParaWidth > self.xPaperSize *.96:  #If the string is so large as to not fit, even alone then shrink font and split lines into two rows.
+            row2 = Table([[
+                Para('eventDate','dateSTY')],
+                [Spacer(width = self.xPaperSize *.98, height = sciHeight)], #Add spacer between rows for formatting.
+                [sciName('scientificName','scientificNameAuthorship','sciNameSTYSmall')]],
+                    colWidths = self.xPaperSize *.98 , rowHeights = None, style = tableSty)
+                
+        elif sciNameParaWidth > self.xPaperSize * -1:   #If the string is too big to share row with event date, split lines into rows.
+            row2 = Table([[
+                Para('eventDate','dateSTY')],
+                [Spacer(width = self.xPaperSize *.98, height = sciHeight)],  #Add spacer between rows for formatting.
+                [sciName('scientificName','scientificNameAuthorship','sciNameSTY')]],
+                    colWidths = self.xPaperSize *.98, rowHeights = None, style = tableSty)               
+        else:
+            row2 = Table([[
+                sciName('scientificName','scientificNameAuthorship','sciNameSTY'),
+                Para('eventDate','dateSTY')]],
+                    colWidths = (self.xPaperSize * .80,self.xPaperSize * .18),
+                    rowHeights = None, style = tableSty)
     
-            row3 = Table([[
-                    Para('locality','default')]],
-                         rowHeights=None, style = tableSty)
+        row3 = Table([[
+                Para('locality','default')]],
+                     rowHeights=None, style = tableSty)
     
-            #Associated Taxa Dynamic Formatting
-            if dfl('associatedTaxa') == '':         #If associated taxa is not used, give up the y space.
-                associatedTaxaHeight = 0
-                associatedTaxaStyle = 'defaultSTYSmall'   #This entire block is not functioning the way it was planned to.
-            else:
-                associatedTaxaHeight = .15 * self.yPaperSize          #Otherwise, devote some space, then test it's useage.
-                associatedTaxaElement = Para('associatedTaxa','default','Associated taxa: ') #Test build for height
-                try:
-                    associatedTaxaParaHeight = associatedTaxaElement.wrap(self.xPaperSize *.98, 1)[1] #Test wrap the string in a large environment to get necessary height.
-                except (AttributeError, IndexError) as e:
-                    print('error ',e)
-                    associatedTaxaParaHeight = 0
+        #Associated Taxa Dynamic Formatting
+        if dfl('associatedTaxa') == '':         #If associated taxa is not used, give up the y space.
+            associatedTaxaHeight = 0
+            associatedTaxaStyle = 'defaultSTYSmall'   #This entire block is not functioning the way it was planned to.
+        else:
+            associatedTaxaHeight = .15 * self.yPaperSize          #Otherwise, devote some space, then test it's useage.
+            associatedTaxaElement = Para('associatedTaxa','default','Associated taxa: ') #Test build for height
+            try:
+                associatedTaxaParaHeight = associatedTaxaElement.wrap(self.xPaperSize *.98, 1)[1] #Test wrap the string in a large environment to get necessary height.
+            except (AttributeError, IndexError) as e:
+                print('error ',e)
+                associatedTaxaParaHeight = 0
     
-                if associatedTaxaParaHeight > associatedTaxaHeight:  #If the string is too large, reduce the font size.
-                    associatedTaxaStyle = 'defaultSTYSmall'
-                else:
-                    associatedTaxaStyle = 'default'             #otherwise, use the normal height
-            row4 = Table([[
-                Para('associatedTaxa',associatedTaxaStyle,'Associated taxa: ')]],
-                rowHeights=None,
-                style = tableSty)
-    #Note, associatedTaxa only reduces size if it is too large. At some extream point we'll need to consider trunication.
-            
-            if dfl('individualCount') != '':
-                row5 = Table([[
-                    Para('habitat','default','Habitat: '),
-                    Para('individualCount','rightSTY', 'Approx. ≥ ',' on site.')]],
-                    colWidths = (self.xPaperSize * .68,self.xPaperSize * .30), rowHeights = None,
-                    style = [
-                        ('VALIGN',(1,0),(1,0),'CENTER'),
-                        ('ALIGN',(0,0),(0,0),'LEFT'),
-                        ('ALIGN',(1,0),(1,0),'RIGHT'),
-                        ('LEFTPADDING',(0,0),(-1,-1), 0),
-                        ('RIGHTPADDING',(0,0),(-1,-1), 0),
-                        ('TOPPADDING',(0,0),(-1,-1), 0),
-                        ('BOTTOMPADDING',(0,0),(-1,-1), 0)])
+            if associatedTaxaParaHeight > associatedTaxaHeight:  #If the string is too large, reduce the font size.
+                associatedTaxaStyle = 'defaultSTYSmall'
             else:
-                row5 = Table([[
-                    Para('habitat','default','Habitat: ')]], style=tableSty)
-    
-            if dfl('establishmentMeans') == 'cultivated':  #If establishmentMeans status is not 'cultivated' (based on cultivated status in mobile app) then forfit the space in case Substrate field is long.
-                row6 = Table([[
-                Para('substrate','default','Substrate: '),
-                cultivationStatusChecker('establishmentMeans','rightSTY')]],    
+                associatedTaxaStyle = 'default'             #otherwise, use the normal height
+        row4 = Table([[
+            Para('associatedTaxa',associatedTaxaStyle,'Associated taxa: ')]],
+            rowHeights=None,
+            style = tableSty)
+    #Note, associatedTaxa only reduces size if it is too large. At some extream point we'll need to consider trunication.
+        
+        if dfl('individualCount') != '':
+            row5 = Table([[
+                Para('habitat','default','Habitat: '),
+                Para('individualCount','rightSTY', 'Approx. ≥ ',' on site.')]],
                 colWidths = (self.xPaperSize * .68,self.xPaperSize * .30), rowHeights = None,
-                style=tableSty)
-                
-            else:
-                row6 = Table([[
-                Para('substrate','default','Substrate: ')]],style=tableSty)
+                style = [
+                    ('VALIGN',(1,0),(1,0),'CENTER'),
+                    ('ALIGN',(0,0),(0,0),'LEFT'),
+                    ('ALIGN',(1,0),(1,0),'RIGHT'),
+                    ('LEFTPADDING',(0,0),(-1,-1), 0),
+                    ('RIGHTPADDING',(0,0),(-1,-1), 0),
+                    ('TOPPADDING',(0,0),(-1,-1), 0),
+                    ('BOTTOMPADDING',(0,0),(-1,-1), 0)])
+        else:
+            row5 = Table([[
+                Para('habitat','default','Habitat: ')]], style=tableSty)
+    
+        if dfl('establishmentMeans') == 'cultivated':  #If establishmentMeans status is not 'cultivated' (based on cultivated status in mobile app) then forfit the space in case Substrate field is long.
+            row6 = Table([[
+            Para('substrate','default','Substrate: '),
+            cultivationStatusChecker('establishmentMeans','rightSTY')]],    
+            colWidths = (self.xPaperSize * .68,self.xPaperSize * .30), rowHeights = None,
+            style=tableSty)
+            
+        else:
+            row6 = Table([[
+            Para('substrate','default','Substrate: ')]],style=tableSty)
     
-            row7 = [collectedByPara('recordedBy','associatedCollectors','default','Collected by: ')]
+        row7 = [collectedByPara('recordedBy','associatedCollectors','default','Collected by: ')]
     
-            row6_5 = Table([[
-                Para('locationRemarks','default','Location Remarks: ')]],style=tableSty)
+        row6_5 = Table([[
+            Para('locationRemarks','default','Location Remarks: ')]],style=tableSty)
           #Note locationRemarks is in testing, may not stay!
     
-            row6_7 = Table([[
-                        Para('occurrenceRemarks','default','Occurence Remarks: ')]],style=tableSty)
-                
-            if dfl('identifiedBy') != '':
-                row7_5 = Table([[
-                        Para('identifiedBy','default','Determined by: ')]],style=tableSty)
-            # TODO: Add all tableList (row) objects to a loop which checks for content and appends else returns None 
-            # ...  Then Clean tableList for None objects
+        row6_7 = Table([[
+                    Para('occurrenceRemarks','default','Occurence Remarks: ')]],style=tableSty)
             
-            tableList = [[row0],
-                          [row1],
-                          [row2],
-                          [row3],
-                          [row4],
-                          [row5],
-                          [row6],
-                          [row6_5],
-                          [row6_7],
-                          [row7]]
+        if dfl('identifiedBy') != '':
+            row7_5 = Table([[
+                    Para('identifiedBy','default','Determined by: ')]],style=tableSty)
+        # TODO: Add all tableList (row) objects to a loop which checks for content and appends else returns None 
+        # ...  Then Clean tableList for None objects
+        
+        tableList = [[row0],
+                      [row1],
+                      [row2],
+                      [row3],
+                      [row4],
+                      [row5],
+                      [row6],
+                      [row6_5],
+                      [row6_7],
+                      [row7]]
     
-            #Testing if GPS String can fit on one row with the Collection Number. If not, split them into two rows.
-            gpsStrElement = gpsCoordStringer('decimalLatitude', 'decimalLongitude', 'coordinateUncertaintyInMeters', 'minimumElevationInMeters','rightSTYSmall')
+        #Testing if GPS String can fit on one row with the Collection Number. If not, split them into two rows.
+        gpsStrElement = gpsCoordStringer('decimalLatitude', 'decimalLongitude', 'coordinateUncertaintyInMeters', 'minimumElevationInMeters','rightSTYSmall')
+        try:
+            gpsStrElement.wrap(self.xPaperSize * .98 , self.yPaperSize * .98)
             try:
-                gpsStrElement.wrap(self.xPaperSize * .98 , self.yPaperSize * .98)
-                try:
-                    gpsParaWidth = gpsStrElement.getActualLineWidths0()[0]
-                except IndexError:
-                    gpsParaWidth = 0
-            except AttributeError:
+                gpsParaWidth = gpsStrElement.getActualLineWidths0()[0]
+            except IndexError:
                 gpsParaWidth = 0
-                
-            if gpsParaWidth > self.xPaperSize * .65:
-                row8 = Table([[Para('recordNumber','default','Collection Number: ')]], style = tableSty)
-                row9 = Table([[gpsStrElement]],style = tableSty)
-                tableList.append([row8])
-    
-                if dfl('identifiedBy') != '':
-                    tableList.append([row7_5])
-    
-                tableList.append([row9])
-                
-            else:
-                row8 = Table([[
-                Para('recordNumber','default','Collection Number: '),        
-                gpsStrElement]],            
-                colWidths = (self.xPaperSize * .33, self.xPaperSize * .65), rowHeights = None,style=tableSty)
-                tableList.append([row8])
+        except AttributeError:
+            gpsParaWidth = 0
+            
+        if gpsParaWidth > self.xPaperSize * .65:
+            row8 = Table([[Para('recordNumber','default','Collection Number: ')]], style = tableSty)
+            row9 = Table([[gpsStrElement]],style = tableSty)
+            tableList.append([row8])
     
-                if dfl('identifiedBy') != '':
-                    tableList.append([row7_5])
+            if dfl('identifiedBy') != '':
+                tableList.append([row7_5])
     
-            # append the determined by field
+            tableList.append([row9])
             
-            
-            docTableStyle = [                             #Cell alignment and padding settings (not text align within cells)
-                    ('VALIGN',(0,3),(0,-1),'BOTTOM'),     #Rows 4-end align to bottom
-                    ('ALIGN',(0,0),(-1,-1),'CENTER'),     #All rows align to center
-                    ('LEFTPADDING',(0,0),(-1,-1), 0),     #ALL Rows padding on left to none
-                    ('RIGHTPADDING',(0,0),(-1,-1), 0),    #ALL Rows padding on right to none
-                    ('TOPPADDING',(0,0),(-1,-1), 3),      #ALL Rows padding on top to none
-                    ('BOTTOMPADDING',(0,0),(-1,-1), 0),   #ALL Rows padding on Bottom to none
-                    ('BOTTOMPADDING',(0,0),(0,0), 3),     #ALL Rows padding on Bottom to none
-                    ('TOPPADDING',(0,1),(0,1), 6),        #Row 2 top padding to 6
-                    ('TOPPADDING',(0,2),(0,2), 6),        #Row 3 top padding to 6
-                    ('BOTTOMPADDING',(0,2),(0,2), 6),     #Row 3 bottom padding to 6
-                    #('NOSPLIT', (0,0),(-1,-1)),          #Makes Error if it won't fit. We should raise this error to user!
-                                ]
-            
-            docTable = Table(tableList, style = docTableStyle ) #build the table to test it's height
+        else:
+            row8 = Table([[
+            Para('recordNumber','default','Collection Number: '),        
+            gpsStrElement]],            
+            colWidths = (self.xPaperSize * .33, self.xPaperSize * .65), rowHeights = None,style=tableSty)
+            tableList.append([row8])
     
-            wid, hei = docTable.wrap(0, 0)      #Determines how much space is used by the table
-            spaceRemaining = (self.yPaperSize - hei - 10) #Determine how much is left on the page
-            spaceFiller = [Spacer(width = 0, height = (spaceRemaining/3))] #assign half the remaining space to a filler (to distrib into two places.
-            tableList.insert(4,spaceFiller)     #build from bottom up because it is less confusing for the index values.
-            tableList.insert(3,spaceFiller)
-            tableList.insert(2,spaceFiller)
+            if dfl('identifiedBy') != '':
+                tableList.append([row7_5])
     
-            docTable = Table(tableList, style = docTableStyle ) #build the final table
+        # append the determined by field
+        
+        
+        docTableStyle = [                             #Cell alignment and padding settings (not text align within cells)
+                ('VALIGN',(0,3),(0,-1),'BOTTOM'),     #Rows 4-end align to bottom
+                ('ALIGN',(0,0),(-1,-1),'CENTER'),     #All rows align to center
+                ('LEFTPADDING',(0,0),(-1,-1), 0),     #ALL Rows padding on left to none
+                ('RIGHTPADDING',(0,0),(-1,-1), 0),    #ALL Rows padding on right to none
+                ('TOPPADDING',(0,0),(-1,-1), 3),      #ALL Rows padding on top to none
+                ('BOTTOMPADDING',(0,0),(-1,-1), 0),   #ALL Rows padding on Bottom to none
+                ('BOTTOMPADDING',(0,0),(0,0), 3),     #ALL Rows padding on Bottom to none
+                ('TOPPADDING',(0,1),(0,1), 6),        #Row 2 top padding to 6
+                ('TOPPADDING',(0,2),(0,2), 6),        #Row 3 top padding to 6
+                ('BOTTOMPADDING',(0,2),(0,2), 6),     #Row 3 bottom padding to 6
+                #('NOSPLIT', (0,0),(-1,-1)),          #Makes Error if it won't fit. We should raise this error to user!
+                            ]
+        
+        docTable = Table(tableList, style = docTableStyle ) #build the table to test it's height
     
-            #Add the flowables to the elements list.
-            elements.append(docTable)
-            elements.append(PageBreak())
+        wid, hei = docTable.wrap(0, 0)      #Determines how much space is used by the table
+        spaceRemaining = (self.yPaperSize - hei - 10) #Determine how much is left on the page
+        spaceFiller = [Spacer(width = 0, height = (spaceRemaining/3))] #assign half the remaining space to a filler (to distrib into two places.
+        tableList.insert(4,spaceFiller)     #build from bottom up because it is less confusing for the index values.
+        tableList.insert(3,spaceFiller)
+        tableList.insert(2,spaceFiller)
+    
+        return tableList, docTableStyle
 
-        #Build the base document's parameters.
-        
-        if returnBytes:  # if we only want to make a preview save it to a stream
-            byteStream = io.BytesIO()
-            labelFileName = byteStream
+    def openFile(self, filename):
+        if sys.platform == "win32":
+            os.startfile(filename)
+        else:
+            opener ="open" if sys.platform == "darwin" else "xdg-open"
+            subprocess.call([opener, filename])
 
-        elif defaultFileName:
+    def exportWorkers(self, labelCount):
+        """ returns the number of processes to export labelCount labels with.
+        Small exports are built serially, where starting workers costs more
+        than it saves. """
+        workers = int(self.settings.get('value_exportWorkers', max(1, (os.cpu_count() or 1) - 1)))
+        chunkSize = max(1, int(self.settings.get('value_exportChunkSize', 250)))
+        chunks = math.ceil(labelCount / chunkSize)
+        return max(1, min(workers, chunks))
+
+    def genPrintLabelPDFsParallel(self, labelDataInput, defaultFileName = None):
+        """ as genPrintLabelPDFs, but renders chunks of labels in worker
+        processes, then merges the chunks in record order. Each label is it's
+        own page, so the result matches a serial build page for page."""
+        import fitz
+        if defaultFileName:
             labelFileName = defaultFileName
-            #labelFileName, _ = QFileDialog.getSaveFileName(None, 'Save Label PDF', defaultFileName, 'PDF(*.pdf)')
         else:
             labelFileName, _ = QFileDialog.getSaveFileName(None, 'Save Label PDF', os.getenv('HOME'), 'PDF(*.pdf)')
-
         if not labelFileName:  # If the user canceled the dialog
             return
-        # TODO fill in title and author based on select form_view or settings info                
-        doc = BaseDocTemplate(labelFileName,
-                              pagesize=self.customPageSize,
-                              pageTemplates=[],
-                              showBoundary=0,
-                              leftMargin=self.xMargin,
-                              rightMargin=self.xMargin,
-                              topMargin=self.yMargin,
-                              bottomMargin=self.yMargin,
-                              allowSplitting= self.allowSplitting,           
-                              title=None,
-                              author=None,
-                              _pageBreakQuick=1,
-                              encrypt=None)
-    
-        #Function to build the pdf
-    
-        def build_pdf(flowables):
-            """ actually loads the flowables into the document """
-
-            doc.addPageTemplates(
-                [
-                    PageTemplate(
-                        onPage = self.labelSetup,
-                        frames=[
-                            platypusFrame(
-                                doc.leftMargin,
-                                doc.bottomMargin,
-                                doc.width,
-                                doc.height,
-                                topPadding=0,
-                                bottomPadding=0,
-                                id=None
-                            ),
-                        ]
-                    ),
-                ]
-            )
-            try:
-                doc.build(flowables)
-            except LayoutError:
-                raise LayoutError
-        
-        try:
-            build_pdf(elements)
-        except LayoutError:
-            # if there is a layout error, raise it
-            raise LayoutError
-        
-        if returnBytes:  # If a preview is being generated just return the bytes
-            # calling the byte stream "labelFileName" is a fast and dirty 
-            # workaround to keep existing code functional
-            pdfBytes = labelFileName.getvalue()  # save the stream to a variable
-            labelFileName.close()  # close the buffer down
-            return pdfBytes  # return the results
-        
-        #Open the file after it is built (maybe change/remove this later? Idealy, a preview or something
-    
-        def open_file(filename):
-            if sys.platform == "win32":
-                os.startfile(filename)
-            else:
-                opener ="open" if sys.platform == "darwin" else "xdg-open"
-                subprocess.call([opener, filename])
-        open_file(labelFileName)
+
+        # the workers only need the snapshot, so previews and fit checks are
+        # not held up for the length of the export
+        with self.lock:
+            settings = labelSettings.fromSettings(self.settings)
+            chunkSize = max(1, int(self.settings.get('value_exportChunkSize', 250)))
+            workers = self.exportWorkers(len(labelDataInput))
+        chunks = [labelDataInput[i: i + chunkSize] for i in range(0, len(labelDataInput), chunkSize)]
+        # spawn, as forking a running Qt application is unsafe
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            # map returns the chunks in order. A LayoutError in any worker is
+            # raised here, as it would be from a serial build.
+            chunkBytes = pool.map(renderLabelChunk, [settings] * len(chunks), chunks)
+            merged = fitz.open()
+            for pdfBytes in chunkBytes:
+                chunkPDF = fitz.open(stream=pdfBytes, filetype='pdf')
+                merged.insertPDF(chunkPDF)
+                chunkPDF.close()
+        merged.save(labelFileName, garbage=3, deflate=True)
+        merged.close()
+        self.openFile(labelFileName)
 
 
     def genErrorLabel(self, errorMSG, relFont=None):
@@ -636,6 +808,21 @@ class LabelPDF():
         return pdfBytes
 
     def stylesheet(self, key):
+        """ returns the compiled ParagraphStyle named key """
+        return self.styles.get(key)
+
+    def compileStyles(self):
+        """ returns the label styles for the current font and paper size.
+        Each combination is built once, then reused by every label. """
+        styleKey = (self.fontName, self.relFont, self.xPaperSize, self.yPaperSize)
+        styles = self.styleSets.get(styleKey)
+        if styles is None:
+            styles = self.buildStyles()
+            self.styleSets[styleKey] = styles
+        return styles
+
+    def buildStyles(self):
+        """ returns a dict of every label ParagraphStyle """
         usrFont = self.fontName
         styles= {
             'default': ParagraphStyle(
@@ -779,4 +966,4 @@ class LabelPDF():
             alignment=TA_CENTER
 
         )
-        return styles.get(key)
+        return styles
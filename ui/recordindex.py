@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A lookup index maintained by the PandasTableModel, mapping siteNumber to row
+positions and (siteNumber, specimenNumber) to a row position. It allows
+selection scoping without boolean mask scans over the entire datatable.
+"""
+from bisect import bisect_left, insort
+
+
+class recordIndex():
+    """ maps site and specimen numbers to row positions. Cell edits to the key
+    columns are applied incrementally, while inserting or removing rows
+    (which shifts every following position) marks the index as stale so it
+    is rebuilt on the next lookup."""
+    keyCols = ('siteNumber', 'specimenNumber')
+
+    def __init__(self):
+        self.sites = {}  # {siteNumber: sorted list of row positions}
+        self.records = {}  # {(siteNumber, specimenNumber): row position}
+        self.df = None
+        self.stale = True
+
+    def invalidate(self, df):
+        """ called after structural changes to the datatable. """
+        self.df = df
+        self.stale = True
+
+    def rebuild(self):
+        """ builds the lookups from the datatable in a single pass. """
+        df = self.df
+        self.sites = {}
+        self.records = {}
+        self.stale = False
+        if df is None or len(df) == 0:
+            return
+        if not all(x in df.columns for x in self.keyCols):
+            return
+        siteNums = df['siteNumber'].tolist()
+        specNums = df['specimenNumber'].tolist()
+        sites = self.sites
+        records = self.records
+        for i, (site, spec) in enumerate(zip(siteNums, specNums)):
+            sites.setdefault(site, []).append(i)
+            # keep the first row, as the mask scans did for .iloc[0]
+            records.setdefault((site, spec), i)
+
+    def checkStale(self):
+        if self.stale:
+            self.rebuild()
+
+    def updateKeys(self, rows, oldKeys, newKeys):
+        """ incrementally moves rows from oldKeys to newKeys. Each key is a
+        (siteNumber, specimenNumber) tuple. """
+        if self.stale:
+            return  # the next lookup will rebuild anyway
+        for i, oldKey, newKey in zip(rows, oldKeys, newKeys):
+            if oldKey == newKey:
+                continue
+            oldSite, newSite = oldKey[0], newKey[0]
+            if oldSite != newSite:
+                positions = self.sites.get(oldSite, [])
+                j = bisect_left(positions, i)
+                if j < len(positions) and positions[j] == i:
+                    del positions[j]
+                if not positions:
+                    self.sites.pop(oldSite, None)
+                insort(self.sites.setdefault(newSite, []), i)
+            if self.records.get(oldKey) == i:
+                del self.records[oldKey]
+                # another row may share the old key, find it among the site
+                for j in self.sites.get(oldSite, []):
+                    if (oldSite, self.df.at[j, 'specimenNumber']) == oldKey:
+                        self.records[oldKey] = j
+                        break
+            existing = self.records.get(newKey)
+            if existing is None or i < existing:
+                self.records[newKey] = i
+
+    def sitePositions(self, siteNum):
+        """ returns the row positions of a site, including the site record """
+        self.checkStale()
+        return list(self.sites.get(siteNum, []))
+
+    def recordPosition(self, siteNum, specimenNum):
+        """ returns the row position of a record, or None """
+        self.checkStale()
+        return self.records.get((siteNum, specimenNum))
+
+    def siteNumbers(self):
+        """ returns the siteNumbers present """
+        self.checkStale()
+        return list(self.sites.keys())
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A compact binary format for the local taxonomic references, opened with mmap
+so loading a kingdom is near-instant and the pages are shared between the
+taxonomic verifier, the name completers (and any other process reading it).
+
+File layout (little-endian, as are the platforms collBook is built for):
+    magic           8 bytes, b'CBREF001'
+    headerLength    uint32
+    header          utf-8 json, describing the sections below
+    for each column, aligned to 8 bytes:
+        offsets     uint32[rowCount + 1], into the column's string blob
+        blob        utf-8 bytes of each value, concatenated
+    for each index, aligned to 8 bytes:
+        permutation uint32[rowCount], row positions sorted by the indexed column
+
+The 'name' index sorts normalized_name, the 'accepted' index sorts the
+accepted identifier (tsn for ITIS, Accepted_name for MycoBank), both by their
+utf-8 bytes. The 'display' index sorts the completer's names case insensitively.
+References are built by processes/extractITIS.py and extractMycoBank.py, if
+no built reference is found it is built from the csv in the Qt resources.
+"""
+import json
+import mmap
+import struct
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from PyQt5 import QtCore
+from PyQt5.QtCore import QFile
+from ui.persistentcache import configDirectory
+
+magic = b'CBREF001'
+
+
+def align(length):
+    """ returns the padding necessary to align length to 8 bytes """
+    return (8 - length % 8) % 8
+
+
+def buildReference(df, sourceSize=0):
+    """ given a reference DataFrame returns the bytes of a built reference.
+    sourceSize is the size of the csv it was built from, used to detect when
+    a built reference is out of date."""
+    df = df.fillna('').astype(str)
+    rowCount = len(df)
+    encoded = {col: [x.encode('utf-8') for x in df[col]] for col in df.columns}
+    sections = []  # (colName, offsets, blob)
+    for col in df.columns:
+        values = encoded[col]
+        offsets = np.zeros(rowCount + 1, dtype='<u4')
+        offsets[1:] = np.cumsum([len(x) for x in values], dtype=np.uint64)
+        sections.append((col, offsets.tobytes(), b''.join(values)))
+
+    if 'tsn' in df.columns:
+        acceptedCol = 'tsn'
+    else:
+        acceptedCol = 'Accepted_name'
+    if 'complete_name' in df.columns:
+        displayCol = 'complete_name'
+    else:
+        displayCol = 'normalized_name'
+    # sorted() is stable, so the first of any duplicates stays first
+    displayNames = [x.lower() for x in df[displayCol]] if displayCol in df.columns else []
+    indexes = {'name': ('normalized_name', lambda i: encoded['normalized_name'][i]),
+               'accepted': (acceptedCol, lambda i: encoded[acceptedCol][i]),
+               'display': (displayCol, lambda i: displayNames[i])}
+
+    body = bytearray()
+    header = {'rowCount': rowCount, 'sourceSize': sourceSize,
+              'columns': {}, 'indexes': {}}
+    for col, offsets, blob in sections:
+        header['columns'][col] = {'offsets': len(body), 'blob': len(body) + len(offsets)}
+        body += offsets + blob
+        body += b'\0' * align(len(body))
+    for indexName, (col, key) in indexes.items():
+        if col not in df.columns:
+            continue
+        permutation = np.array(sorted(range(rowCount), key=key), dtype='<u4')
+        header['indexes'][indexName] = {'column': col, 'permutation': len(body)}
+        body += permutation.tobytes()
+        body += b'\0' * align(len(body))
+
+    headerBytes = json.dumps(header).encode('utf-8')
+    headerBytes += b' ' * align(len(magic) + 4 + len(headerBytes))
+    return magic + struct.pack('<I', len(headerBytes)) + headerBytes + bytes(body)
+
+
+def writeReference(df, fileName, sourceFileName=None):
+    """ builds a reference from df and saves it as fileName. Called by the
+    reference builders in processes/ """
+    sourceSize = 0
+    if sourceFileName is not None:
+        sourceSize = Path(sourceFileName).stat().st_size
+    with open(fileName, 'wb') as f:
+        f.write(buildReference(df, sourceSize))
+
+
+class referenceStore():
+    """ read only access to a built reference, held in memory or mmap'd """
+    def __init__(self, buffer):
+        self.buffer = buffer
+        if bytes(buffer[:len(magic)]) != magic:
+            raise ValueError('not a collBook reference')
+        headerLength = struct.unpack_from('<I', buffer, len(magic))[0]
+        start = len(magic) + 4
+        header = json.loads(bytes(buffer[start: start + headerLength]).decode('utf-8'))
+        start += headerLength
+        self.rowCount = header['rowCount']
+        self.sourceSize = header['sourceSize']
+        # uint32 views of the arrays, indexing these returns python ints which
+        # is considerably faster than numpy scalars for single lookups.
+        view = memoryview(buffer)
+        self.columns = {}  # {colName: (offsets, blobStart)}
+        for col, entry in header['columns'].items():
+            offsetsStart = start + entry['offsets']
+            offsets = view[offsetsStart: offsetsStart + 4 * (self.rowCount + 1)].cast('I')
+            self.columns[col] = (offsets, start + entry['blob'])
+        self.indexes = {}  # {indexName: (colName, permutation)}
+        for indexName, entry in header['indexes'].items():
+            permutationStart = start + entry['permutation']
+            permutation = view[permutationStart: permutationStart + 4 * self.rowCount].cast('I')
+            self.indexes[indexName] = (entry['column'], permutation)
+
+    @classmethod
+    def open(cls, fileName):
+        """ returns a referenceStore of a built reference file, using mmap """
+        with open(fileName, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def __len__(self):
+        return self.rowCount
+
+    def rawValue(self, row, colName):
+        offsets, blobStart = self.columns[colName]
+        return self.buffer[blobStart + offsets[row]: blobStart + offsets[row + 1]]
+
+    def value(self, row, colName, default=''):
+        """ returns the value at row position of colName """
+        if colName not in self.columns:
+            return default
+        return str(self.rawValue(row, colName), 'utf-8')
+
+    def findFirst(self, indexName, key):
+        """ returns the first row position where the index's column equals
+        key, or None. A binary search over the index's permutation."""
+        if key in ['', None] or indexName not in self.indexes:
+            return None
+        colName, permutation = self.indexes[indexName]
+        key = key.encode('utf-8')
+        lo, hi = 0, self.rowCount
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.rawValue(permutation[mid], colName) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.rowCount and self.rawValue(permutation[lo], colName) == key:
+            return permutation[lo]
+        return None
+
+
+class referenceNameModel(QtCore.QAbstractListModel):
+    """ presents a reference's names to a QCompleter, in the case insensitive
+    order of it's 'display' index, without copying them into a list. """
+    def __init__(self, store, parent=None):
+        super(referenceNameModel, self).__init__(parent)
+        self.store = store
+        self.colName, self.permutation = store.indexes['display']
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.store.rowCount
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role in [QtCore.Qt.DisplayRole, QtCore.Qt.EditRole]:
+            row = self.permutation[index.row()]
+            return self.store.value(row, self.colName).capitalize()
+        return QtCore.QVariant()
+
+
+openReferences = {}  # {kingdom: referenceStore}, shared by all callers
+
+
+def openReference(kingdom):
+    """ returns the referenceStore for kingdom. Prefers a built reference
+    shipped with the program, then one cached in the user's config folder.
+    Otherwise builds it from the csv in the Qt resources, caching the result
+    for the next session. Returns None if there is no reference."""
+    if kingdom in openReferences:
+        return openReferences[kingdom]
+    fileName = f'{kingdom}_Reference.ref'
+    source = QFile(f':/rc_/{kingdom}_Reference.csv')
+    sourceSize = source.size() if source.exists() else 0
+    configDir = configDirectory()
+    shipped = Path(__file__).parent.joinpath('resources', fileName)
+    cached = configDir.joinpath(fileName)
+
+    store = None
+    for path in [shipped, cached]:
+        if not path.is_file():
+            continue
+        try:
+            candidate = referenceStore.open(path)
+        except (ValueError, OSError) as e:
+            print(f'could not open {path}: {e}')
+            continue
+        if sourceSize == 0 or candidate.sourceSize == sourceSize:
+            store = candidate
+            break
+
+    if store is None and sourceSize > 0:
+        from io import StringIO
+        if source.open(QFile.ReadOnly):
+            csv = StringIO(str(source.readAll(), 'utf-8'))
+            source.close()
+            df = pd.read_csv(csv, encoding='utf-8', dtype='str')
+            data = buildReference(df, sourceSize)
+            store = referenceStore(data)
+            try:  # cache it, so the next session can mmap it
+                configDir.mkdir(parents=True, exist_ok=True)
+                with open(cached, 'wb') as f:
+                    f.write(data)
+            except OSError as e:
+                print(f'could not cache {cached}: {e}')
+
+    if store is not None:
+        openReferences[kingdom] = store
+    return store
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Runs the record refinement passes (taxonomic verification, reverse
+geolocation) on a worker thread, keeping the GUI responsive. Results are
+signaled back to the GUI thread which commits them to the datatable.
+"""
+import traceback
+from PyQt5 import QtCore
+
+
+class guiDispatcher(QtCore.QObject):
+    """ runs callables on the GUI thread on behalf of worker threads, blocking
+    the worker until the call returns. Used for user dialogs and anything
+    which touches the datatable or widgets. Must be created on the GUI
+    thread."""
+    request = QtCore.pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super(guiDispatcher, self).__init__(parent)
+        self.request.connect(self.runRequest, QtCore.Qt.BlockingQueuedConnection)
+
+    def onGuiThread(self):
+        return QtCore.QThread.currentThread() == self.thread()
+
+    def call(self, func, *args, **kwargs):
+        """ calls func on the GUI thread and returns it's result. """
+        if self.onGuiThread():
+            return func(*args, **kwargs)
+        job = {'func': func, 'args': args, 'kwargs': kwargs,
+               'result': None, 'error': None}
+        self.request.emit(job)  # blocks until runRequest has returned
+        if job['error'] is not None:
+            raise job['error']
+        return job['result']
+
+    def runRequest(self, job):
+        try:
+            job['result'] = job['func'](*job['args'], **job['kwargs'])
+        except Exception as e:
+            job['error'] = e
+
+
+class bulkFunction():
+    """ marks a step's func as one which refines the step's records all at
+    once. It is called as func(records, progress, isCancelled), where
+    progress(done, total) reports it's progress, and returns a list of
+    (key, {colName: value}) changes."""
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, records, progress, isCancelled):
+        return self.func(records, progress, isCancelled)
+
+
+class refinementWorker(QtCore.QObject):
+    """ applies a series of steps, each as
+    (func, fetchRecords, beforeStep, afterStep).
+    fetchRecords and afterStep (which may be None) are called on the GUI
+    thread. fetchRecords returns a list of (key, rowData) tuples, where key is
+    (siteNumber, specimenNumber). beforeStep (which may be None) is given the
+    whole list on the worker thread, ie: to prefetch web results in bulk. func
+    (which may be None) is applied to each rowData on the worker thread, and
+    only the columns it changed are signaled back. If func is a bulkFunction
+    it is given every record at once instead.
+    If a step raises, the user is told through notice(text, title,
+    detailText, inclHalt=False) and the run stops, as if it were cancelled."""
+    progress = QtCore.pyqtSignal(int, int)  # records done, records in step
+    recordProcessed = QtCore.pyqtSignal(object, object)  # key, {colName: value}
+    finished = QtCore.pyqtSignal(bool)  # True if the run was cancelled or failed
+
+    def __init__(self, steps, dispatcher, isCancelled, notice):
+        super(refinementWorker, self).__init__()
+        self.steps = steps
+        self.dispatcher = dispatcher
+        self.isCancelled = isCancelled  # callable, checked before each record
+        self.notice = notice  # callable, shows the user an error
+        self.failed = False
+
+    def fail(self, text):
+        """ tells the user a step failed, which stops the run. Called from
+        within an except block. """
+        self.failed = True
+        text = f'{text} The remaining records were not refined, the changes made so far can be undone.'
+        self.dispatcher.call(self.notice, text, 'Refinement process',
+                             traceback.format_exc(), inclHalt=False)
+
+    def run(self):
+        for func, fetchRecords, beforeStep, afterStep in self.steps:
+            if self.isCancelled() or self.failed:
+                break
+            records = self.dispatcher.call(fetchRecords)
+            if beforeStep is not None:
+                try:
+                    beforeStep(records)
+                except Exception:
+                    self.fail('Preparing the records for refinement failed.')
+                    break
+            if func is None:
+                records = []
+            elif isinstance(func, bulkFunction):
+                try:
+                    results = func(records, self.progress.emit, self.isCancelled)
+                except Exception:
+                    self.fail('Refining the records failed.')
+                    break
+                for key, changes in results:
+                    if len(changes) > 0:
+                        self.recordProcessed.emit(key, changes)
+                records = []
+            total = len(records)
+            for c, (key, rowData) in enumerate(records):
+                if self.isCancelled():
+                    break
+                original = rowData.copy()
+                try:
+                    result = func(rowData)
+                except Exception:
+                    self.fail(f'Refining record {key[0]}-{key[1]} failed.')
+                    break
+                changes = {colName: value for colName, value in result.items()
+                           if colName not in original or original[colName] != value}
+                if len(changes) > 0:
+                    self.recordProcessed.emit(key, changes)
+                self.progress.emit(c + 1, total)
+            if afterStep is not None and not self.isCancelled() and not self.failed:
+                self.dispatcher.call(afterStep)
+        self.finished.emit(self.isCancelled() or self.failed)
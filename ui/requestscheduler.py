@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Schedules the web service requests made by the taxonomy and locality
+modules. Each service has a token bucket rate limit, so requests are sent as
+fast as the service allows (rather than sleeping after each one). Requests
+share a single keep-alive requests.Session and a bounded pool of threads.
+
+Rates may be adjusted per service with the settings:
+    value_{service}_RequestsPerSecond   sustained rate, 0 for no limit
+    value_{service}_RequestBurst        requests allowed at once
+and the pool size with value_requestWorkers.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class tokenBucket():
+    """ a thread safe token bucket, refilled at rate tokens per second and
+    holding at most burst tokens. """
+    def __init__(self, rate, burst=1):
+        self.lock = threading.Lock()
+        self.setRate(rate, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def setRate(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+
+    def acquire(self):
+        """ blocks until a token is available, then takes it """
+        while True:
+            with self.lock:
+                if self.rate <= 0:  # unlimited
+                    return
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class requestScheduler():
+    # default (requests per second, burst) for each service
+    serviceRates = {'COL': (1, 3),
+                    'TNRS': (1, 4),
+                    'Google': (40, 10)}
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.maxWorkers = max(1, int(self.settings.get('value_requestWorkers', 8)))
+        self.pool = ThreadPoolExecutor(max_workers=self.maxWorkers)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.serviceRates),
+                              pool_maxsize=self.maxWorkers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.readSettings()
+
+    def readSettings(self):
+        """ (re)reads each service's rate limit from the settings """
+        with self.lock:
+            for service in set(self.serviceRates) | set(self.buckets):
+                rate, burst = self.serviceRates.get(service, (1, 1))
+                rate = float(self.settings.get(f'value_{service}_RequestsPerSecond', rate))
+                burst = float(self.settings.get(f'value_{service}_RequestBurst', burst))
+                if service in self.buckets:
+                    self.buckets[service].setRate(rate, burst)
+                else:
+                    self.buckets[service] = tokenBucket(rate, burst)
+
+    def bucket(self, service):
+        with self.lock:
+            if service not in self.buckets:
+                rate, burst = self.serviceRates.get(service, (1, 1))
+                self.buckets[service] = tokenBucket(rate, burst)
+            return self.buckets[service]
+
+    def get(self, service, url, **kwargs):
+        """ waits for service's rate limit, then sends a GET request over the
+        shared session. Runs on the calling thread, kwargs are passed to
+        requests.Session.get (ie: timeout)."""
+        self.bucket(service).acquire()
+        return self.session.get(url, **kwargs)
+
+    def submit(self, service, url, **kwargs):
+        """ as get(), but on the shared pool. Returns a Future """
+        return self.pool.submit(self.get, service, url, **kwargs)
+
+    def map(self, func, items, maxInFlight=None):
+        """ returns [func(x) for x in items], calculated on the shared pool
+        with at most maxInFlight running at once. func is expected to make
+        it's requests with get(). """
+        items = list(items)
+        limit = max(1, min(maxInFlight or self.maxWorkers, self.maxWorkers))
+        results = [None] * len(items)
+        pending = {}
+        queued = iter(enumerate(items))
+        for i, item in queued:
+            pending[self.pool.submit(func, item)] = i
+            if len(pending) >= limit:
+                break
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[pending.pop(future)] = future.result()
+                nextItem = next(queued, None)
+                if nextItem is not None:
+                    i, item = nextItem
+                    pending[self.pool.submit(func, item)] = i
+        return results
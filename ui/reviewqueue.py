@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+When the user opts to defer decisions, refinement processes queue the
+decisions they would otherwise stop to ask about (name changes, authority
+changes, missing GPS, lookup errors). Once the process is finished, the
+queue is presented as a single sortable table to accept or reject in bulk.
+"""
+import threading
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel,
+                             QTableWidget, QTableWidgetItem, QPushButton,
+                             QHeaderView, QAbstractItemView)
+
+
+class reviewQueue():
+    """ a thread safe list of pending decisions. Each is a dict of:
+        key: (siteNumber, specimenNumber), a list of them if the decision
+             applies to several records, or None if not record specific
+        kind: a short description, ie: 'Name change'
+        message: the question which would have been asked
+        changes: {colName: value} applied if accepted, may be empty
+        editable: the colName whose proposed value the user may edit, or None
+    """
+    def __init__(self):
+        self.items = []
+        self.lock = threading.Lock()
+
+    def add(self, kind, message, key=None, changes=None, editable=None):
+        item = {'key': key, 'kind': kind, 'message': message,
+                'changes': dict(changes or {}), 'editable': editable}
+        with self.lock:
+            self.items.append(item)
+
+    def takeAll(self):
+        """ returns and clears the pending decisions """
+        with self.lock:
+            items = self.items
+            self.items = []
+        return items
+
+    def __len__(self):
+        with self.lock:
+            return len(self.items)
+
+
+class reviewDialog(QDialog):
+    """ presents a list of queued decisions as a sortable table. Checked rows
+    are returned by checkedDecisions() after the dialog is accepted."""
+    cols = ['Record', 'Decision', 'Details', 'Proposed']
+
+    def __init__(self, items, parent=None):
+        super().__init__(parent)
+        self.items = items
+        self.init_ui()
+
+    def init_ui(self):
+        self.setWindowTitle('Review pending decisions')
+        self.resize(900, 500)
+        layout = QVBoxLayout(self)
+        label = QLabel(f'{len(self.items)} decisions were deferred during the process. '
+                       'Check those to accept, unchecked decisions are rejected.')
+        label.setWordWrap(True)
+        layout.addWidget(label)
+
+        table = QTableWidget(len(self.items), len(self.cols), self)
+        table.setHorizontalHeaderLabels(self.cols)
+        table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        table.horizontalHeader().setSectionResizeMode(2, QHeaderView.Stretch)
+        for row, item in enumerate(self.items):
+            record = self.recordText(item['key'])
+            recordItem = QTableWidgetItem(record)
+            recordItem.setData(Qt.UserRole, row)  # survives sorting
+            if item['changes'] or item['editable']:
+                recordItem.setFlags(recordItem.flags() | Qt.ItemIsUserCheckable)
+                recordItem.setCheckState(Qt.Unchecked)
+            else:  # informational only, nothing to accept
+                recordItem.setFlags(recordItem.flags() & ~Qt.ItemIsUserCheckable)
+            recordItem.setFlags(recordItem.flags() & ~Qt.ItemIsEditable)
+            table.setItem(row, 0, recordItem)
+            for col, text in [(1, item['kind']), (2, item['message'])]:
+                cell = QTableWidgetItem(text)
+                cell.setFlags(cell.flags() & ~Qt.ItemIsEditable)
+                table.setItem(row, col, cell)
+            proposed = item['changes'].get(item['editable'], '') if item['editable'] else \
+                ', '.join(f'{k}: {v}' for k, v in item['changes'].items())
+            proposedItem = QTableWidgetItem(proposed)
+            if not item['editable']:
+                proposedItem.setFlags(proposedItem.flags() & ~Qt.ItemIsEditable)
+            table.setItem(row, 3, proposedItem)
+        table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeToContents)
+        table.setSortingEnabled(True)
+        table.setWordWrap(True)
+        table.resizeRowsToContents()
+        self.table = table
+        layout.addWidget(table)
+
+        buttons = QHBoxLayout()
+        for text, func in [('Check all', self.checkAll),
+                           ('Check none', self.checkNone),
+                           ('Check selected', self.checkSelected)]:
+            button = QPushButton(text, self)
+            button.setAutoDefault(False)
+            button.clicked.connect(func)
+            buttons.addWidget(button)
+        buttons.addStretch()
+        reject = QPushButton('Reject all', self)
+        reject.setAutoDefault(False)
+        reject.clicked.connect(self.reject)
+        accept = QPushButton('Accept checked', self)
+        accept.clicked.connect(self.accept)
+        buttons.addWidget(reject)
+        buttons.addWidget(accept)
+        layout.addLayout(buttons)
+
+    def recordText(self, key):
+        if key is None:
+            return ''
+        if isinstance(key, list):
+            text = f'{key[0][0]}-{key[0][1]}'
+            if len(key) > 1:
+                text += f' (+{len(key) - 1} more)'
+            return text
+        return f'{key[0]}-{key[1]}'
+
+    def setCheckStates(self, state, rows=None):
+        if rows is None:
+            rows = range(self.table.rowCount())
+        for row in rows:
+            item = self.table.item(row, 0)
+            if item.flags() & Qt.ItemIsUserCheckable:
+                item.setCheckState(state)
+
+    def checkAll(self):
+        self.setCheckStates(Qt.Checked)
+
+    def checkNone(self):
+        self.setCheckStates(Qt.Unchecked)
+
+    def checkSelected(self):
+        rows = set(x.row() for x in self.table.selectedIndexes())
+        self.setCheckStates(Qt.Checked, rows)
+
+    def checkedDecisions(self, verify=None):
+        """ returns the checked decisions as a list of (key, changes), with
+        any user edits applied. If given, verify(key, changes) is called once
+        for each decision with an edited value, and returns the changes to
+        apply instead (ie: to re-verify a re-entered name)."""
+        results = []
+        for row in range(self.table.rowCount()):
+            recordItem = self.table.item(row, 0)
+            if recordItem.checkState() != Qt.Checked:
+                continue
+            item = self.items[recordItem.data(Qt.UserRole)]
+            changes = dict(item['changes'])
+            if item['editable']:
+                value = self.table.item(row, 3).text().strip()
+                if value == '':
+                    continue  # nothing was entered
+                changes[item['editable']] = value
+            keys = item['key'] if isinstance(item['key'], list) else [item['key']]
+            if item['editable'] and verify is not None and keys[0] is not None:
+                # the records of a decision share the name, verify it once
+                changes = verify(keys[0], changes)
+            for key in keys:
+                results.append((key, changes))
+        return results
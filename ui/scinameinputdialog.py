@@ -36,10 +36,13 @@ class sciNameDialog(QDialog):
             self.btn.setEnabled(True)
             self.btn.setDefault(True)
         
-    def textBox(self, wordList, message = "", title = "", ):
+    def textBox(self, wordList, message = "", title = "", suggestion = ""):
         if title != '':
             self.setWindowTitle(title)
         self.dlg.label.setText(message)
+        if suggestion != '':  # prefill with the nearest known name
+            self.dlg.lineEdit.setText(suggestion)
+            self.dlg.lineEdit.selectAll()
         dlgCompleter = QCompleter(wordList, self.dlg.lineEdit)
         self.dlg.lineEdit.setCompleter(dlgCompleter)
         try:
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A proxy model between the PandasTableModel and the table_view which only
+presents the rows within the user's current scope (all records, a site or a
+specimen). Replaces hiding rows on the table_view one at a time.
+"""
+from bisect import bisect_left, bisect_right
+from PyQt5 import QtCore
+
+
+class ScopeProxyModel(QtCore.QAbstractProxyModel):
+    def __init__(self, parent=None):
+        super(ScopeProxyModel, self).__init__(parent)
+        self.selType = 'allRec'
+        self.siteNum = None
+        self.specimenNum = None
+        # the source rows in scope, None means all rows (an identity mapping)
+        self.sourceRows = None
+        self.proxyRows = None  # {sourceRow: proxyRow}
+
+    def setSourceModel(self, sourceModel):
+        super(ScopeProxyModel, self).setSourceModel(sourceModel)
+        sourceModel.dataChanged.connect(self.sourceDataChanged)
+        # structural changes to the source reset this (much smaller) model
+        aboutToChange = [sourceModel.rowsAboutToBeInserted,
+                         sourceModel.rowsAboutToBeRemoved,
+                         sourceModel.columnsAboutToBeInserted,
+                         sourceModel.columnsAboutToBeRemoved,
+                         sourceModel.modelAboutToBeReset]
+        changed = [sourceModel.rowsInserted,
+                   sourceModel.rowsRemoved,
+                   sourceModel.columnsInserted,
+                   sourceModel.columnsRemoved,
+                   sourceModel.modelReset]
+        for signal in aboutToChange:
+            signal.connect(self.sourceAboutToChange)
+        for signal in changed:
+            signal.connect(self.sourceChanged)
+        self.refilter()
+
+    def setScope(self, selType, siteNum=None, specimenNum=None):
+        """ sets the user's scope, as returned by getTreeSelectionType """
+        self.selType = selType
+        self.siteNum = siteNum
+        self.specimenNum = specimenNum
+        self.refilter()
+
+    def refilter(self):
+        self.beginResetModel()
+        self.mapScope()
+        self.endResetModel()
+
+    def mapScope(self):
+        """ rebuilds the row mappings for the current scope. Uses the source
+        model's site / specimen index, so it is O(rows in scope)."""
+        m = self.sourceModel()
+        if self.selType not in ['site', 'specimen'] or m is None or m.datatable is None:
+            self.sourceRows = None
+            self.proxyRows = None
+        else:
+            rows = m.getRowsToKeep(self.selType, self.siteNum, self.specimenNum)
+            self.sourceRows = sorted(rows)
+            self.proxyRows = {x: i for i, x in enumerate(self.sourceRows)}
+
+    def sourceAboutToChange(self, *args):
+        self.beginResetModel()
+
+    def sourceChanged(self, *args):
+        self.mapScope()
+        self.endResetModel()
+
+    def sourceDataChanged(self, topLeft, bottomRight, roles=[]):
+        """ forwards the portion of a source dataChanged within scope """
+        if not (topLeft.isValid() and bottomRight.isValid()):
+            return
+        first, last = topLeft.row(), bottomRight.row()
+        if self.sourceRows is not None:
+            first = bisect_left(self.sourceRows, first)
+            last = bisect_right(self.sourceRows, last) - 1
+            if first > last:
+                return  # nothing changed within scope
+        self.dataChanged.emit(self.index(first, topLeft.column()),
+                              self.index(last, bottomRight.column()),
+                              roles)
+
+    def visibleRows(self):
+        """ returns a list of the source rows in scope """
+        if self.sourceRows is None:
+            return list(range(self.sourceModel().rowCount()))
+        return list(self.sourceRows)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid() or self.sourceModel() is None:
+            return 0
+        if self.sourceRows is None:
+            return self.sourceModel().rowCount()
+        return len(self.sourceRows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid() or self.sourceModel() is None:
+            return 0
+        return self.sourceModel().columnCount()
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        if parent.isValid() or not self.hasIndex(row, column, parent):
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=None):
+        return QtCore.QModelIndex()
+
+    def mapToSource(self, proxyIndex):
+        if not proxyIndex.isValid():
+            return QtCore.QModelIndex()
+        row = proxyIndex.row()
+        if self.sourceRows is not None:
+            try:
+                row = self.sourceRows[row]
+            except IndexError:
+                return QtCore.QModelIndex()
+        return self.sourceModel().index(row, proxyIndex.column())
+
+    def mapFromSource(self, sourceIndex):
+        if not sourceIndex.isValid():
+            return QtCore.QModelIndex()
+        row = sourceIndex.row()
+        if self.proxyRows is not None:
+            row = self.proxyRows.get(row)
+            if row is None:
+                return QtCore.QModelIndex()
+        return self.index(row, sourceIndex.column())
@@ -50,6 +50,8 @@ class Ui_settingsWindow(object):
         self.page_Display.addItem(item)
         item = QtWidgets.QListWidgetItem()
         self.page_Display.addItem(item)
+        item = QtWidgets.QListWidgetItem()
+        self.page_Display.addItem(item)
         self.upperHorizontalLayout.addWidget(self.page_Display)
         self.settingsPage = QtWidgets.QStackedWidget(self.centralwidget)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Maximum, QtWidgets.QSizePolicy.Maximum)
@@ -384,6 +386,60 @@ class Ui_settingsWindow(object):
         self.gridLayout_11.addWidget(self.value_inc_TripName, 5, 0, 1, 2)
         self.gridLayout.addWidget(self.labelIncludeGroup, 1, 0, 1, 2)
         self.settingsPage.addWidget(self.labelPrefPage)
+        self.refinementPrefPage = QtWidgets.QWidget()
+        self.refinementPrefPage.setObjectName("refinementPrefPage")
+        self.gridLayout_12 = QtWidgets.QGridLayout(self.refinementPrefPage)
+        self.gridLayout_12.setObjectName("gridLayout_12")
+        self.groupBox_Decisions = QtWidgets.QGroupBox(self.refinementPrefPage)
+        self.groupBox_Decisions.setObjectName("groupBox_Decisions")
+        self.verticalLayout_3 = QtWidgets.QVBoxLayout(self.groupBox_Decisions)
+        self.verticalLayout_3.setObjectName("verticalLayout_3")
+        self.value_deferDecisions = QtWidgets.QCheckBox(self.groupBox_Decisions)
+        self.value_deferDecisions.setObjectName("value_deferDecisions")
+        self.verticalLayout_3.addWidget(self.value_deferDecisions)
+        self.gridLayout_12.addWidget(self.groupBox_Decisions, 0, 0, 1, 1)
+        self.groupBox_Prefetch = QtWidgets.QGroupBox(self.refinementPrefPage)
+        self.groupBox_Prefetch.setObjectName("groupBox_Prefetch")
+        self.verticalLayout_4 = QtWidgets.QVBoxLayout(self.groupBox_Prefetch)
+        self.verticalLayout_4.setObjectName("verticalLayout_4")
+        self.value_prefetchAfterLoad = QtWidgets.QCheckBox(self.groupBox_Prefetch)
+        self.value_prefetchAfterLoad.setObjectName("value_prefetchAfterLoad")
+        self.verticalLayout_4.addWidget(self.value_prefetchAfterLoad)
+        self.gridLayout_12.addWidget(self.groupBox_Prefetch, 1, 0, 1, 1)
+        self.groupBox_Geocode = QtWidgets.QGroupBox(self.refinementPrefPage)
+        self.groupBox_Geocode.setObjectName("groupBox_Geocode")
+        self.gridLayout_13 = QtWidgets.QGridLayout(self.groupBox_Geocode)
+        self.gridLayout_13.setObjectName("gridLayout_13")
+        self.label_GeocodeBackend = QtWidgets.QLabel(self.groupBox_Geocode)
+        self.label_GeocodeBackend.setObjectName("label_GeocodeBackend")
+        self.gridLayout_13.addWidget(self.label_GeocodeBackend, 0, 0, 1, 1)
+        self.value_GeocodeBackend = QtWidgets.QComboBox(self.groupBox_Geocode)
+        self.value_GeocodeBackend.setObjectName("value_GeocodeBackend")
+        self.value_GeocodeBackend.addItem("")
+        self.value_GeocodeBackend.addItem("")
+        self.value_GeocodeBackend.addItem("")
+        self.gridLayout_13.addWidget(self.value_GeocodeBackend, 0, 1, 1, 2)
+        self.label_boundaryFolder = QtWidgets.QLabel(self.groupBox_Geocode)
+        self.label_boundaryFolder.setEnabled(False)
+        self.label_boundaryFolder.setObjectName("label_boundaryFolder")
+        self.gridLayout_13.addWidget(self.label_boundaryFolder, 1, 0, 1, 1)
+        self.toolButton_GetBoundaryFolder = QtWidgets.QToolButton(self.groupBox_Geocode)
+        self.toolButton_GetBoundaryFolder.setEnabled(False)
+        self.toolButton_GetBoundaryFolder.setIcon(icon1)
+        self.toolButton_GetBoundaryFolder.setIconSize(QtCore.QSize(18, 18))
+        self.toolButton_GetBoundaryFolder.setObjectName("toolButton_GetBoundaryFolder")
+        self.gridLayout_13.addWidget(self.toolButton_GetBoundaryFolder, 1, 1, 1, 1)
+        self.value_boundaryFolder = QtWidgets.QLineEdit(self.groupBox_Geocode)
+        self.value_boundaryFolder.setEnabled(False)
+        self.value_boundaryFolder.setObjectName("value_boundaryFolder")
+        self.gridLayout_13.addWidget(self.value_boundaryFolder, 1, 2, 1, 1)
+        self.button_ClearGeocodeCache = QtWidgets.QPushButton(self.groupBox_Geocode)
+        self.button_ClearGeocodeCache.setObjectName("button_ClearGeocodeCache")
+        self.gridLayout_13.addWidget(self.button_ClearGeocodeCache, 2, 2, 1, 1)
+        self.gridLayout_12.addWidget(self.groupBox_Geocode, 2, 0, 1, 1)
+        spacerItem6 = QtWidgets.QSpacerItem(20, 40, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
+        self.gridLayout_12.addItem(spacerItem6, 9, 0, 1, 1)
+        self.settingsPage.addWidget(self.refinementPrefPage)
         self.TaxPrefPage = QtWidgets.QWidget()
         self.TaxPrefPage.setObjectName("TaxPrefPage")
         self.gridLayout_3 = QtWidgets.QGridLayout(self.TaxPrefPage)
@@ -402,8 +458,8 @@ class Ui_settingsWindow(object):
         self.value_Kingdom.addItem("")
         self.value_Kingdom.addItem("")
         self.formLayout_6.setWidget(0, QtWidgets.QFormLayout.FieldRole, self.value_Kingdom)
-        spacerItem6 = QtWidgets.QSpacerItem(40, 20, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
-        self.formLayout_6.setItem(0, QtWidgets.QFormLayout.LabelRole, spacerItem6)
+        spacerItem7 = QtWidgets.QSpacerItem(40, 20, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
+        self.formLayout_6.setItem(0, QtWidgets.QFormLayout.LabelRole, spacerItem7)
         self.gridLayout_3.addWidget(self.groupbox_Kingdom, 0, 0, 1, 1)
         self.groupBox = QtWidgets.QGroupBox(self.TaxPrefPage)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Preferred, QtWidgets.QSizePolicy.Preferred)
@@ -463,8 +519,8 @@ class Ui_settingsWindow(object):
         self.verticalLayout.addLayout(self.upperHorizontalLayout)
         self.lowerHorizontalLayout = QtWidgets.QHBoxLayout()
         self.lowerHorizontalLayout.setObjectName("lowerHorizontalLayout")
-        spacerItem7 = QtWidgets.QSpacerItem(40, 20, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
-        self.lowerHorizontalLayout.addItem(spacerItem7)
+        spacerItem8 = QtWidgets.QSpacerItem(40, 20, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
+        self.lowerHorizontalLayout.addItem(spacerItem8)
         self.button_Cancel = QtWidgets.QPushButton(self.centralwidget)
         self.button_Cancel.setObjectName("button_Cancel")
         self.lowerHorizontalLayout.addWidget(self.button_Cancel)
@@ -508,6 +564,7 @@ class Ui_settingsWindow(object):
         self.value_use_PatternCatalogNumbers.toggled['bool'].connect(self.value_catalogNumberStartingNum.setEnabled)
         self.value_use_PatternCatalogNumbers.toggled['bool'].connect(self.value_catalogNumberDigits.setEnabled)
         self.value_assignCatalogNumbers.toggled['bool'].connect(self.value_inc_Barcode.setChecked)
+        self.value_GeocodeBackend.currentTextChanged['QString'].connect(settingsWindow.toggleGeocodeSettings)
         QtCore.QMetaObject.connectSlotsByName(settingsWindow)
 
     def retranslateUi(self, settingsWindow):
@@ -524,6 +581,8 @@ class Ui_settingsWindow(object):
         item = self.page_Display.item(3)
         item.setText(_translate("settingsWindow", "Labels"))
         item = self.page_Display.item(4)
+        item.setText(_translate("settingsWindow", "Refinement"))
+        item = self.page_Display.item(5)
         item.setText(_translate("settingsWindow", "Taxonomy"))
         self.page_Display.setSortingEnabled(__sortingEnabled)
         self.groupBox_3.setTitle(_translate("settingsWindow", "Display associated taxa dialog while refining records:"))
@@ -575,6 +634,19 @@ class Ui_settingsWindow(object):
         self.value_inc_VerifiedBy.setText(_translate("settingsWindow", "Include verified by"))
         self.value_inc_CollectionName.setText(_translate("settingsWindow", "Include collection name"))
         self.value_inc_TripName.setText(_translate("settingsWindow", "Include trip name"))
+        self.groupBox_Decisions.setTitle(_translate("settingsWindow", "Refinement decisions"))
+        self.value_deferDecisions.setText(_translate("settingsWindow", "Collect decisions while refining, and review them together afterwards"))
+        self.groupBox_Prefetch.setTitle(_translate("settingsWindow", "Background lookups"))
+        self.value_prefetchAfterLoad.setText(_translate("settingsWindow", "Look up names and site locations in the background after loading records"))
+        self.groupBox_Geocode.setTitle(_translate("settingsWindow", "Reverse geolocation"))
+        self.label_GeocodeBackend.setText(_translate("settingsWindow", "Source"))
+        self.value_GeocodeBackend.setItemText(0, _translate("settingsWindow", "Google"))
+        self.value_GeocodeBackend.setItemText(1, _translate("settingsWindow", "Offline"))
+        self.value_GeocodeBackend.setItemText(2, _translate("settingsWindow", "Offline, then Google"))
+        self.label_boundaryFolder.setText(_translate("settingsWindow", "Boundary folder"))
+        self.toolButton_GetBoundaryFolder.setText(_translate("settingsWindow", "..."))
+        self.button_ClearGeocodeCache.setToolTip(_translate("settingsWindow", "Forget the saved geolocation results, so every site is looked up again"))
+        self.button_ClearGeocodeCache.setText(_translate("settingsWindow", "Clear geocode cache"))
         self.groupbox_Kingdom.setTitle(_translate("settingsWindow", "Kingdom"))
         self.value_Kingdom.setItemText(0, _translate("settingsWindow", "Fungi"))
         self.value_Kingdom.setItemText(1, _translate("settingsWindow", "Plantae"))
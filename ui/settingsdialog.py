@@ -14,6 +14,7 @@ from PyQt5.QtWidgets import QApplication
 from PyQt5.QtCore import Qt, QCoreApplication
 
 from ui.settingsUI import Ui_settingsWindow
+from ui.persistentcache import configDirectory
 
 class settingsWindow(QMainWindow):
     def __init__(self, parent=None):
@@ -34,6 +35,8 @@ class settingsWindow(QMainWindow):
         self.settingsWindow.button_SaveExit.clicked.connect(self.saveButtonClicked)
         self.settingsWindow.button_Cancel.clicked.connect(self.cancelButtonClicked)
         self.settingsWindow.toolButton_GetLogoPath.clicked.connect(self.getLogoPath)
+        self.settingsWindow.toolButton_GetBoundaryFolder.clicked.connect(self.getBoundaryFolder)
+        self.settingsWindow.button_ClearGeocodeCache.clicked.connect(self.clearGeocodeCache)
         self.genDummyCatalogNumber()
         # be sure the settings file exists
         if not self.settings.value('version', False):
@@ -80,7 +83,7 @@ class settingsWindow(QMainWindow):
         self.parent.updatePreview()
         self.parent.updateAutoComplete()
         # reset tax session's alignments since the settings have changed
-        self.parent.tax.sessionAlignments = {}
+        self.parent.tax.clearSessionAlignments()
         self.hide()
 
     def cancelButtonClicked(self):
@@ -96,6 +99,23 @@ class settingsWindow(QMainWindow):
         if fileName:  # if an image was selected, store the path
             self.settingsWindow.value_LogoPath.setText(fileName)
 
+    def getBoundaryFolder(self):
+        """ opens a QFileDialog to select the offline geocoder's folder of
+        boundary files (see offlinegeocoder.py)"""
+        folder = QtWidgets.QFileDialog.getExistingDirectory(None, "Select Boundary Folder",
+                                                            self.settingsWindow.value_boundaryFolder.text())
+        if folder:  # if a folder was selected, store the path
+            self.settingsWindow.value_boundaryFolder.setText(folder)
+
+    def clearGeocodeCache(self):
+        """ after asking, forgets every saved reverse geolocation result
+        (ie: after boundaries changed, or to correct a wrong result)"""
+        reply = QtWidgets.QMessageBox.question(self, 'Reverse geolocation',
+                                               'Forget every saved geolocation result? Sites will be looked up again the next time they are geolocated.',
+                                               QtWidgets.QMessageBox.No | QtWidgets.QMessageBox.Yes)
+        if reply == QtWidgets.QMessageBox.Yes:
+            self.parent.locality.clearGeocodeCache()
+
     def has(self, key):
         return self.settings.contains(key)
 
@@ -186,6 +206,13 @@ class settingsWindow(QMainWindow):
             b = False    
         self.settingsWindow.groupbox_TNRS.setEnabled(b)
 
+    def toggleGeocodeSettings(self, QString):
+        """ called when value_GeocodeBackend changes text. Decides if the
+        boundary folder should be enabled or not"""
+        b = str(QString).startswith('Offline')
+        self.settingsWindow.label_boundaryFolder.setEnabled(b)
+        self.settingsWindow.toolButton_GetBoundaryFolder.setEnabled(b)
+
     def scalingChanged(self, Qint):
         parent = self.settingsWindow
         val = f'({str(Qint)}%)'.rjust(8, ' ')
@@ -232,6 +259,8 @@ class settingsWindow(QMainWindow):
         self.populateQComboBoxSettings( parent.value_LogoAlignment, value_LogoAlignment)
         value_fontName = self.get('value_value_fontName', 'Helvetica')
         self.populateQComboBoxSettings( parent.value_fontName, value_fontName)
+        value_GeocodeBackend = self.get('value_GeocodeBackend', 'Google')
+        self.populateQComboBoxSettings( parent.value_GeocodeBackend, value_GeocodeBackend)
 
         # QLineEdit
         value_VerifiedBy = self.get('value_VerifiedBy')
@@ -240,6 +269,8 @@ class settingsWindow(QMainWindow):
         parent.value_LogoPath.setText(value_LogoPath)
         value_catalogNumberPrefix = self.get('value_catalogNumberPrefix')
         parent.value_catalogNumberPrefix.setText(value_catalogNumberPrefix)
+        value_boundaryFolder = self.get('value_boundaryFolder', str(configDirectory().joinpath('boundaries')))
+        parent.value_boundaryFolder.setText(value_boundaryFolder)
 
         # QPlainTextEdit
         value_CollectionName = self.get('value_CollectionName')
@@ -260,6 +291,10 @@ class settingsWindow(QMainWindow):
         parent.value_inc_TripName.setCheckState(value_inc_TripName)
         value_italicize_Associated = self.convertCheckState(self.get('value_italicize_Associated', 'false'))
         parent.value_italicize_Associated.setCheckState(value_italicize_Associated)
+        value_deferDecisions = self.convertCheckState(self.get('value_deferDecisions', 'false'))
+        parent.value_deferDecisions.setCheckState(value_deferDecisions)
+        value_prefetchAfterLoad = self.convertCheckState(self.get('value_prefetchAfterLoad', 'false'))
+        parent.value_prefetchAfterLoad.setCheckState(value_prefetchAfterLoad)
 
         # QGroupbox (checkstate)
         value_inc_Logo = self.convertCheckState(self.get('value_inc_Logo'))
@@ -341,6 +376,8 @@ class settingsWindow(QMainWindow):
         self.setValue('value_LogoAlignment', value_LogoAlignment)
         value_fontName = parent.value_fontName.currentText()
         self.setValue('value_fontName', value_fontName)
+        value_GeocodeBackend = parent.value_GeocodeBackend.currentText()
+        self.setValue('value_GeocodeBackend', value_GeocodeBackend)
         
 
         # QLineEdit
@@ -350,6 +387,8 @@ class settingsWindow(QMainWindow):
         self.setValue('value_LogoPath', value_LogoPath)
         value_catalogNumberPrefix = parent.value_catalogNumberPrefix.text()
         self.setValue('value_catalogNumberPrefix', value_catalogNumberPrefix)
+        value_boundaryFolder = parent.value_boundaryFolder.text()
+        self.setValue('value_boundaryFolder', value_boundaryFolder)
 
         # QPlainTextEdit        
         value_CollectionName = parent.value_CollectionName.toPlainText()
@@ -370,6 +409,10 @@ class settingsWindow(QMainWindow):
         self.setValue('value_inc_TripName', value_inc_TripName)
         value_italicize_Associated = parent.value_italicize_Associated.isChecked()
         self.setValue('value_italicize_Associated', value_italicize_Associated)
+        value_deferDecisions = parent.value_deferDecisions.isChecked()
+        self.setValue('value_deferDecisions', value_deferDecisions)
+        value_prefetchAfterLoad = parent.value_prefetchAfterLoad.isChecked()
+        self.setValue('value_prefetchAfterLoad', value_prefetchAfterLoad)
 
         # QGroupbox
         value_inc_Logo = parent.value_inc_Logo.isChecked()
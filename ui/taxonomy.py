@@ -17,8 +17,14 @@ from pykew.powo_terms import Name as powoName
 import datetime
 import time
 import requests
-from requests.exceptions import ReadTimeout
+from requests.exceptions import ReadTimeout, RequestException
+from concurrent.futures import wait, FIRST_COMPLETED
+from collections import deque
 import json
+import threading
+from ui.referencestore import openReference
+from ui.fuzzymatch import fuzzyIndex
+from ui.persistentcache import persistentCache, configDirectory
 
 class taxonomicVerification():
     def __init__(self, settings, parent, editable = True, *args):
@@ -30,8 +36,17 @@ class taxonomicVerification():
         # container to store this session's alignments. Addressing feedback
         # from Alaina Krakowiak concerning redundant alignment dialogs.
         # structured as: {'input sci name':('aligned sci name', 'alignedauthority')}
+        # web service results are also remembered across sessions, in alignmentCache
+        self.alignmentCache = persistentCache(configDirectory().joinpath('alignmentCache.sqlite'))
         self.readTaxonomicSettings()
+        # shared by the GUI, refinement and cache warm up threads, only
+        # accessed while holding sessionLock
         self.sessionAlignments = {}
+        self.sessionLock = threading.Lock()
+        # {endpoint: recent response times}, see recordLatency
+        self.latencies = {}
+        # set per thread, a quiet thread's failed lookups do not raise dialogs
+        self.quiet = threading.local()
     
     def readTaxonomicSettings(self):
         """ Fetches the most up-to-date taxonomy relevant settings"""
@@ -47,6 +62,16 @@ class taxonomicVerification():
         self.AuthChangePolicy = self.settings.get('value_AuthChangePolicy')
         # tnrs score threshold
         self.value_TNRS_Threshold = self.settings.get('value_TNRS_Threshold')
+        # misspellings within this many edits are corrected without asking, 0 to always ask
+        self.value_fuzzyAutoDistance = int(self.settings.get('value_fuzzyAutoDistance', 1))
+        # service rate limits may have changed
+        self.parent.scheduler.readSettings()
+        # names per bulk tnrs request, and how many requests may be in flight
+        self.value_TNRS_BatchSize = int(self.settings.get('value_TNRS_BatchSize', 50))
+        self.value_TNRS_MaxInFlight = int(self.settings.get('value_TNRS_MaxInFlight', 4))
+        # how long, and how many web service results to remember
+        self.alignmentCache.setLimits(float(self.settings.get('value_alignmentCacheDays', 30)),
+                                      int(self.settings.get('value_alignmentCacheEntries', 50000)))
         # which kingdom we're interested in
         current_value_Kingdom = self.settings.get('value_Kingdom')
         try:  # see if it's necessary to reload the local_Reference
@@ -58,18 +83,25 @@ class taxonomicVerification():
                 self.loadLocalRef()
 
     def loadLocalRef(self):
-        from io import StringIO
-        stream = QFile(f':/rc_/{self.value_Kingdom}_Reference.csv')
-        if stream.open(QFile.ReadOnly):
-            df = StringIO(str(stream.readAll(), 'utf-8'))
-            stream.close()
-            self.local_Reference = pd.read_csv(df, encoding = 'utf-8', dtype = 'str')
+        """ opens the local reference for the kingdom (see referencestore) """
+        self.local_Reference = openReference(self.value_Kingdom)
 
     def retrieveAlignment(self, querySciName, retrieveAuth=False):
         """ parses the settings for the proper alignment policy.
         Returns tuple of aligned name and aligned authority.
         Can optionally be used to retrieve the authority of a potentially
         unaccepted taxon. """
+        # web service results are cached, local references are fast enough
+        useCache = '(web API)' in self.TaxAlignSource
+        if useCache:
+            cacheKey = self.alignmentKey(querySciName, retrieveAuth)
+            cached = self.alignmentCache.get(cacheKey)
+            if cached is not None:
+                result = tuple(cached)
+                if retrieveAuth:
+                    result = result[1]
+                return result
+
         if self.TaxAlignSource == 'Catalog of Life (web API)':
             result = self.getCOLWeb(querySciName, retrieveAuth)
         elif self.TaxAlignSource == 'ITIS (local)':
@@ -87,6 +119,13 @@ class taxonomicVerification():
         else:
             result = (None, None, None)
 
+        if not isinstance(result, tuple):
+            # the request failed, or went unanswered. Nothing is remembered.
+            return False
+        # remember the result, a (None, None, None) is the service answering
+        # that the name is not known to it.
+        if useCache and False not in result:
+            self.alignmentCache.set(cacheKey, result)
         if retrieveAuth:
             result = result[1]
         return result
@@ -95,13 +134,27 @@ class taxonomicVerification():
         """ updates the session alignments dict to remember alignments.
         these sesson alignments are reset when program opens or settings are
         saved"""
+        with self.sessionLock:
+            self.sessionAlignments[querySciName] = results
+
+    def sessionAlignment(self, querySciName):
+        """ returns the session's alignment of a query, or None """
+        with self.sessionLock:
+            return self.sessionAlignments.get(querySciName)
 
-        self.sessionAlignments[querySciName] = results
+    def clearSessionAlignments(self):
+        """ forgets the session's alignments, ie: as the settings changed """
+        with self.sessionLock:
+            self.sessionAlignments.clear()
 
-    def verifyTaxonomy(self, rowData):
+    def verifyTaxonomy(self, rowData, autoCorrected=False, recordKeys=None):
         """general method to align taxonomy and retrieve authority.
         accepts a df row argument, treats it as a dictionary and makes
-        refinements. Returning a the modified argument."""
+        refinements. Returning a the modified argument.
+        autoCorrected is True when re-verifying a name which was corrected
+        from the local reference, so a record is corrected at most once.
+        recordKeys may list the keys of every record sharing the name, so a
+        deferred decision applies to each of them."""
         for col in rowData.keys():
             rowData[col] = str(rowData[col])
 
@@ -112,11 +165,15 @@ class taxonomicVerification():
             # ensure the first word is capitalized regardless
             rowData['scientificName'] = rowData['scientificName'].capitalize()
             rowNum = f"{rowData['siteNumber']}-{rowData['specimenNumber']}"
+            rowKey = (rowData['siteNumber'], rowData['specimenNumber'])
+            if recordKeys is not None:
+                rowKey = recordKeys
+            deferred = False  # if a decision was queued for later review
             scientificName = rowData['scientificName']
             scientificNameAuthorship = rowData['scientificNameAuthorship'].strip()
             querySciName = self.normalizeStrInput(scientificName)
             #  check with the session results before moving on.
-            sessionResults =  self.sessionAlignments.get(querySciName, False)
+            sessionResults = self.sessionAlignment(querySciName)
             if sessionResults:
                 sessionName, sessionAuth, sessionFamily = sessionResults
                 rowData['scientificName'] = sessionName
@@ -125,7 +182,7 @@ class taxonomicVerification():
                 return rowData
 
             result = self.retrieveAlignment(querySciName)
-            if result == (False, False, False):
+            if result in [False, (False, False, False)]:
                 # if the alignment failed to respond
                 return rowData
             resultSciName, resultAuthor, resultFam = result
@@ -133,11 +190,33 @@ class taxonomicVerification():
             keptResult = False  # flag to det if the alignment result was kept
             changeAuth = False  # flag to determine if the authority needs altered.
             if resultSciName is None:  # if no scientificName was returned
+                # look for a likely misspelling in the local reference
+                candidates = self.suggestNames(querySciName)
+                # a distance of 0 means the reference knows the name as is,
+                # then it is no misspelling and is never corrected
+                knownName = any(x[0] == 0 for x in candidates)
+                suggestions = [x for x in candidates if x[0] > 0]
+                if len(suggestions) > 0 and not knownName:
+                    distance, suggestion = suggestions[0]
+                    nextDistance = suggestions[1][0] if len(suggestions) > 1 else None
+                    if (not autoCorrected and distance <= self.value_fuzzyAutoDistance
+                            and distance != nextDistance):
+                        # an unambiguous near-exact match, correct it
+                        rowData['scientificName'] = suggestion
+                        return self.verifyTaxonomy(rowData, autoCorrected=True,
+                                                   recordKeys=recordKeys)
+                else:
+                    suggestion = ''
                 message = f'No {self.value_Kingdom} results for "{scientificName}" (# {rowNum}) found using {self.TaxAlignSource}.\n This may be a typo, would you like to reenter the name?'
-                reply = self.parent.userSciNameInput(f'{rowNum}: Taxonomic alignment', message)
+                if suggestion != '':
+                    message += f'\n Did you mean "{suggestion}"?'
+                changes = {'scientificName': suggestion} if suggestion != '' else None
+                if self.parent.deferDecision('No results', message, rowKey, changes, editable='scientificName'):
+                    return rowData
+                reply = self.parent.userSciNameInput(f'{rowNum}: Taxonomic alignment', message, suggestion)
                 if reply:
                     rowData['scientificName'] = reply
-                    rowData = self.verifyTaxonomy(rowData)
+                    rowData = self.verifyTaxonomy(rowData, recordKeys=recordKeys)
                 return rowData
             # if the returned result is not the scientificName, check policies
             if resultSciName.lower() != scientificName.lower():
@@ -148,7 +227,13 @@ class taxonomicVerification():
                     keptResult = True
                 elif self.NameChangePolicy == 'Always ask':
                     message = f'Change {scientificName} to {resultSciName} at record {rowNum}?'
-                    answer = self.parent.userAsk(message, 'Taxonomic alignment')
+                    changes = {'scientificName': resultSciName, 'family': resultFam,
+                               'scientificNameAuthorship': resultAuthor}
+                    if self.parent.deferDecision('Name change', message, rowKey, changes):
+                        deferred = True
+                        answer = False
+                    else:
+                        answer = self.parent.userAsk(message, 'Taxonomic alignment')
                     if answer:
                         rowData['scientificName'] = resultSciName
                         rowData['family'] = resultFam
@@ -166,6 +251,8 @@ class taxonomicVerification():
                     # condition to retrieve authority for potentially non-accepted name
                     # in favor of simplicity, the family name will not be updated under this condition
                     resultAuthor = self.retrieveAlignment(querySciName, retrieveAuth=True)
+                    if resultAuthor is False:  # the request failed
+                        return rowData
 
                 if resultAuthor.lower() not in [scientificNameAuthorship.lower(), None]:
                     # if the authors don't match check user policies
@@ -177,8 +264,10 @@ class taxonomicVerification():
                             rowData['scientificNameAuthorship'] = resultAuthor
                         else:  # if not blank, ask.
                             message = f'Update author of {rowData["scientificName"]} from:\n{scientificNameAuthorship} to {resultAuthor} at record {rowNum}?'
-                            answer = self.parent.userAsk(message, 'Authority alignment')
-                            if answer:
+                            changes = {'scientificNameAuthorship': resultAuthor}
+                            if self.parent.deferDecision('Authority change', message, rowKey, changes):
+                                deferred = True
+                            elif self.parent.userAsk(message, 'Authority alignment'):
                                 rowData['scientificNameAuthorship'] = resultAuthor
 
                     elif self.AuthChangePolicy == 'Always ask':
@@ -186,18 +275,98 @@ class taxonomicVerification():
                             message = f'Fill in blank author of {rowData["scientificName"]} to {resultAuthor} at record {rowNum}?'
                         else:
                             message = f'Update author of {rowData["scientificName"]} from:\n{scientificNameAuthorship} to {resultAuthor} at record {rowNum}?'
-                        answer = self.parent.userAsk(message, 'Authority alignment')
-                        if answer:
+                        changes = {'scientificNameAuthorship': resultAuthor}
+                        if self.parent.deferDecision('Authority change', message, rowKey, changes):
+                            deferred = True
+                        elif self.parent.userAsk(message, 'Authority alignment'):
                             rowData['scientificNameAuthorship'] = resultAuthor
             # update sessionAlignments to remember these results for this session
-            results = (rowData['scientificName'],
-                       rowData['scientificNameAuthorship'],
-                       rowData['family'])
-            self.sessionAlignments[querySciName] = results
+            # unless the decision is pending, then each record will be reviewed
+            if not deferred:
+                results = (rowData['scientificName'],
+                           rowData['scientificNameAuthorship'],
+                           rowData['family'])
+                self.updateSessionAlignments(querySciName, results)
         except:
             pass
         return rowData
 
+    def suggestNames(self, querySciName, limit=5):
+        """ returns up to limit (distance, scientificName) tuples of the local
+        reference names nearest to the normalized querySciName. """
+        store = openReference(self.value_Kingdom)
+        index = fuzzyIndex(store)
+        if index is None:
+            return []
+        displayCol = store.indexes['display'][0] if 'display' in store.indexes else None
+        results = []
+        for distance, name in index.candidates(querySciName, limit):
+            if displayCol is not None:
+                name = store.value(store.findFirst('name', name), displayCol)
+            results.append((distance, name.capitalize()))
+        return results
+
+    def verifyTaxonomyBulk(self, records, progress=None, isCancelled=None):
+        """ verifyTaxonomy for a list of (key, rowData) tuples. The names are
+        normalized in one pass, each distinct name is verified once (so any
+        dialogs are raised once per name) and the results are mapped back to
+        every record sharing it. Returns a list of (key, {colName: value})
+        changes. Used as a bulkFunction by the refinementWorker."""
+        if len(records) == 0:
+            return []
+        cols = ['scientificName', 'scientificNameAuthorship', 'family']
+        df = pd.DataFrame([[rowData.get(col, '') for col in cols] for _, rowData in records],
+                          columns=cols).fillna('').astype(str)
+        original = df.copy()
+        df['scientificName'] = df['scientificName'].str.capitalize()
+        codes, queries = pd.factorize(self.normalizeSeries(df['scientificName']))
+        members = pd.Series(range(len(df))).groupby(codes).apply(list)
+
+        resolved = {col: {} for col in cols}  # {col: {code: value}}
+        for code, query in enumerate(queries):
+            if isCancelled is not None and isCancelled():
+                break
+            if progress is not None:
+                progress(code + 1, len(queries))
+            if query == '':
+                continue
+            sessionResults = self.sessionAlignment(query)
+            if sessionResults is None:
+                rows = members[code]
+                key, rowData = records[rows[0]]
+                recordKeys = [records[i][0] for i in rows] if len(rows) > 1 else None
+                result = self.verifyTaxonomy(rowData.copy(), recordKeys=recordKeys)
+                sessionResults = self.sessionAlignment(query)
+            if sessionResults is not None:
+                for col, value in zip(cols, sessionResults):
+                    resolved[col][code] = value
+            else:  # undecided or deferred, apply only what changed (ie: a reentered name)
+                for col in cols:
+                    if str(result[col]) != df.at[rows[0], col]:
+                        resolved[col][code] = result[col]
+
+        codes = pd.Series(codes, index=df.index)
+        for col in cols:
+            mapped = codes.map(resolved[col])
+            df[col] = mapped.where(mapped.notna(), df[col])
+        changed = df.ne(original)
+        changes = []
+        for i in changed.index[changed.any(axis=1)]:
+            changes.append((records[i][0], df.loc[i, changed.loc[i]].to_dict()))
+        return changes
+
+    def normalizeSeries(self, names):
+        """ normalizeStrInput over a Series of names, in one vectorized pass """
+        cleaned = names.fillna('').astype(str).str.lower()
+        cleaned = cleaned.str.replace(self.strNormRegex, '', regex=True).str.strip()
+        wordLists = cleaned.str.split()
+        long = wordLists.str.len() > 2
+        if long.any():
+            omitList = ['var', 'ssp', 'subsp', 'x', 'f']
+            cleaned[long] = wordLists[long].map(lambda words: ' '.join(
+                    [x for x in words if x not in omitList]))
+        return cleaned
+
     def normalizeStrInput(self, inputStr, retrieveAuth=False):
         """ returns a normalized a scientificName based on string input.
         is used to prepare queries """
@@ -216,35 +385,26 @@ class taxonomicVerification():
     def getITISLocal(self, inputStr, retrieveAuth=False):
         """ uses local itis reference csv to attempt alignments """
         try:
-            df = self.local_Reference
+            ref = self.local_Reference
         except AttributeError:
             self.loadLocalRef()
-            df = self.local_Reference
+            ref = self.local_Reference
 
         result = (None, None, None)
 
+        nameRow = ref.findFirst('name', inputStr)
+        if nameRow is None:
+            return result
         if retrieveAuth:
-            acceptedRow = df[df['normalized_name'] == inputStr]
+            acceptedRow = nameRow
         else:
-            try:
-                tsn_accepted = df[df['normalized_name'] == inputStr]['tsn_accepted'].values[0]
-            except IndexError:
-                return result
-            acceptedRow = df[df['tsn'] == tsn_accepted]
-            
-        if len(acceptedRow) > 0:
-            try:
-                acceptedName = acceptedRow['complete_name'].values[0]
-            except IndexError:
-                acceptedName = inputStr
-            try:
-                acceptedAuthor = acceptedRow['taxon_author_id'].values[0]
-            except IndexError:
-                acceptedAuthor = ""
-            try:
-                family = acceptedRow['family'].values[0]
-            except IndexError:
-                family = ""
+            tsn_accepted = ref.value(nameRow, 'tsn_accepted')
+            acceptedRow = ref.findFirst('accepted', tsn_accepted)
+
+        if acceptedRow is not None:
+            acceptedName = ref.value(acceptedRow, 'complete_name', inputStr)
+            acceptedAuthor = ref.value(acceptedRow, 'taxon_author_id')
+            family = ref.value(acceptedRow, 'family')
             result = (acceptedName, acceptedAuthor, family)
         return result
 
@@ -255,34 +415,25 @@ class taxonomicVerification():
     def getMycoBankLocal(self, inputStr, retrieveAuth=False):
         """ uses local reference csv to attempt alignments """
         try:
-            df = self.local_Reference
+            ref = self.local_Reference
         except AttributeError:
             self.loadLocalRef()
-            df = self.local_Reference
+            ref = self.local_Reference
 
         result = (None, None, None)
-        
+
+        nameRow = ref.findFirst('name', inputStr)
+        if nameRow is None:
+            return result
         if retrieveAuth:
-            acceptedRow = df[df['normalized_name'] == inputStr]
+            acceptedRow = nameRow
         else:
-            try:
-                acceptedName = df[df['normalized_name'] == inputStr]['Accepted_name'].values[0]
-            except IndexError:
-                return result
-            acceptedRow = df[df['Accepted_name'] == acceptedName]
-        if len(acceptedRow) > 0:
-            try:
-                acceptedName = acceptedRow['Accepted_name'].values[0]
-            except IndexError:
-                acceptedName = inputStr
-            try:
-                acceptedAuthor = acceptedRow['Authors'].values[0]
-            except IndexError:
-                acceptedAuthor = ""
-            try:
-                family = acceptedRow['family'].values[0]
-            except IndexError:
-                family = ""
+            acceptedName = ref.value(nameRow, 'Accepted_name')
+            acceptedRow = ref.findFirst('accepted', acceptedName)
+        if acceptedRow is not None:
+            acceptedName = ref.value(acceptedRow, 'Accepted_name', inputStr)
+            acceptedAuthor = ref.value(acceptedRow, 'Authors')
+            family = ref.value(acceptedRow, 'family')
             acceptedName = acceptedName.capitalize()
             result = (acceptedName, acceptedAuthor, family)
         return result
@@ -293,71 +444,219 @@ class taxonomicVerification():
 
     def getCOLWeb(self, inputStr, retrieveAuth=False, timeout = 5):
         """ uses Catalog of life reference to attempt alignments
-        retrieveAuth: boolean, forces retrieval of authorship regardless of name status"""
+        retrieveAuth: boolean, forces retrieval of authorship regardless of name status
+        The current webservice is preferred, if it has not answered within
+        value_COL_HedgeDelay seconds (or answers without a result), the
+        annual checklists are asked as well. The first usable answer wins.
+        Returns (None, None, None) only if an endpoint answered without a
+        result, and False if none gave a usable answer."""
         
-        result = (None, None)
-        #result = (None, None, None)
+        result = (None, None, None)
         
         # a list of urls for col, starting with most recent and then specifying current year, then current year -1
         urlInputStr = inputStr.replace(' ','%20')
-        urlList = [f'http://webservice.catalogueoflife.org/col/webservice?name={urlInputStr}&format=json&response=full',
-                   f'http://webservice.catalogueoflife.org/annual-checklist/{datetime.datetime.now().year}/webservice?name={urlInputStr}&format=json&response=full',
-                   f'http://webservice.catalogueoflife.org/annual-checklist/{datetime.datetime.now().year - 1 }/webservice?name={urlInputStr}&format=json&response=full']
+        year = datetime.datetime.now().year
+        endpoints = [('webservice', f'http://webservice.catalogueoflife.org/col/webservice?name={urlInputStr}&format=json&response=full'),
+                     (f'{year} checklist', f'http://webservice.catalogueoflife.org/annual-checklist/{year}/webservice?name={urlInputStr}&format=json&response=full'),
+                     (f'{year - 1} checklist', f'http://webservice.catalogueoflife.org/annual-checklist/{year - 1}/webservice?name={urlInputStr}&format=json&response=full')]
+        hedgeDelay = float(self.settings.get('value_COL_HedgeDelay', 0.5))
+        scheduler = self.parent.scheduler
 
-        for url in urlList:
+        def fetch(url):
+            # the scheduler keeps requests within the service's rate limit
+            start = time.monotonic()
             try:
-                response = requests.get(url, timeout = timeout)
-                time.sleep(1)  # use a sleep to be polite to the service
-            except ReadTimeout:
-                message = 'Catalog of Life request timed out. This may be an internet connectivity problem, or an issue with the service. No changes have been made.'
-                details = 'Check internet connection, or try a different alignment service. If you do not have internet connectivity, use the local alignment service.'
-                notice = self.parent.userNotice(message, 'Taxonomic alignment', inclHalt=True, retry=True)
-                if notice == QMessageBox.Retry:  # if clicked retry, do it.
-                    timeout += 2
-                    # add to timeout before retrying
-                    return self.getCOLWeb(inputStr, retrieveAuth, timeout = timeout)
-                else:
-                    return False
-            if response.status_code == requests.codes.ok:
-                # returns a list of "results" each result is a seperate dict
-                data = response.json().get('results')
-                # restrict results to the best answer for the appropriate kingdom regardless of accepted_name status
-                # COL returns classifications for accepted names, otherwise it is nested under the key "accepted_name"
-                data = [x for x in data if
-                               x.get('classification', [{}])[0].get('name', '') == self.value_Kingdom or
-                               x.get('accepted_name', {}).get('classification', [{}])[0].get('name', '') == self.value_Kingdom][0]
+                response = scheduler.get('COL', url, timeout = timeout)
+                error = None
+            except RequestException as e:
+                response = None
+                error = e
+            return response, error, time.monotonic() - start
 
-                if retrieveAuth:
-                    resultName = data.get('name')
-                    resultAuth = data.get('author')
-                    family = None
-                    result = (resultName, resultAuth, family)
-                    return result
+        futures = {}  # {future: endpoint label}
+        timedOut = False
+        answered = False  # if any endpoint answered that the name is unknown
+        while len(endpoints) > 0 or len(futures) > 0:
+            if len(endpoints) > 0:
+                label, url = endpoints.pop(0)
+                futures[scheduler.pool.submit(fetch, url)] = label
+            # wait for an answer, or hedgeDelay before asking the next endpoint
+            done, _ = wait(futures, timeout=hedgeDelay if len(endpoints) > 0 else None,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                label = futures.pop(future)
+                response, error, elapsed = future.result()
+                self.recordLatency(f'COL {label}', elapsed)
+                if isinstance(error, ReadTimeout):
+                    timedOut = True
+                if response is None or response.status_code != requests.codes.ok:
+                    continue
+                parsed = self.parseCOLResponse(response, retrieveAuth)
+                if parsed is None:  # not a usable response
+                    continue
+                if parsed == (None, None, None):
+                    answered = True
+                    continue
+                for other in futures:  # those which have not started
+                    other.cancel()
+                return parsed
+
+        if answered:
+            return result
+        # no endpoint gave a usable answer, the request failed
+        if getattr(self.quiet, 'active', False):
+            return False
+        if timedOut:
+            message = 'Catalog of Life request timed out. This may be an internet connectivity problem, or an issue with the service. No changes have been made.'
+        else:
+            message = 'Catalog of Life request failed. This may be an internet connectivity problem, or an issue with the service. No changes have been made.'
+        details = 'Check internet connection, or try a different alignment service. If you do not have internet connectivity, use the local alignment service.'
+        if self.parent.deferDecision('Lookup error', f'{inputStr}: {message}'):
+            return False
+        notice = self.parent.userNotice(message, 'Taxonomic alignment', inclHalt=True, retry=True)
+        if notice == QMessageBox.Retry:  # if clicked retry, do it.
+            timeout += 2
+            # add to timeout before retrying
+            return self.getCOLWeb(inputStr, retrieveAuth, timeout = timeout)
+        else:
+            return False
+
+    def parseCOLResponse(self, response, retrieveAuth=False):
+        """ returns the alignment tuple from a Catalog of Life response,
+        (None, None, None) if it answered without a result for the kingdom, or
+        None if the response was not usable (ie: malformed). """
+        try:
+            # returns a list of "results" each result is a seperate dict
+            data = response.json().get('results')
+            # restrict results to the best answer for the appropriate kingdom regardless of accepted_name status
+            # COL returns classifications for accepted names, otherwise it is nested under the key "accepted_name"
+            data = [x for x in data if
+                           x.get('classification', [{}])[0].get('name', '') == self.value_Kingdom or
+                           x.get('accepted_name', {}).get('classification', [{}])[0].get('name', '') == self.value_Kingdom]
+        except Exception:
+            return None
+        if len(data) == 0:
+            return (None, None, None)
+        data = data[0]
+
+        if retrieveAuth:
+            resultName = data.get('name')
+            resultAuth = data.get('author')
+            family = None
+            result = (resultName, resultAuth, family)
+            return result
+        else:
+            try:
+                # if there is an 'accepted_name' key, retrieve that entry
+                if data.get('accepted_name', False):
+                    data = data.get('accepted_name')
+                    print('name was not accepted')
+                # otherwise the existing 'data' should already hold the accepted name
+                if data.get('name_status','') != 'accepted name':
+                    # verify to be sure, raise exception if something managed to fail here
+                    raise Exception
+                classifications = data.get('classification', False)
+                if classifications:
+                    # if there are classifications, retrieve the family name
+                    family = [x for x in classifications if x.get('rank', '') == 'Family'][0].get('name', '')
                 else:
-                    try:
-                        # if there is an 'accepted_name' key, retrieve that entry
-                        if data.get('accepted_name', False):
-                            data = data.get('accepted_name')
-                            print('name was not accepted')
-                        # otherwise the existing 'data' should already hold the accepted name
-                        if data.get('name_status','') != 'accepted name':
-                            # verify to be sure, raise exception if something managed to fail here
-                            raise Exception
-                        classifications = data.get('classification', False)
-                        if classifications:
-                            # if there are classifications, retrieve the family name
-                            family = [x for x in classifications if x.get('rank', '') == 'Family'][0].get('name', '')
-                        else:
-                            family = None
-                        acceptedName = data.get('name')
-                        acceptedAuthor = data.get('name_html').split('</i> ')[1].strip()
-                        
-                        result = (acceptedName, acceptedAuthor, family)
-                        #result = (acceptedName, acceptedAuthor)
-                        return result
-                    except Exception as e:
-                        print(e)
-                        pass
+                    family = None
+                acceptedName = data.get('name')
+                acceptedAuthor = data.get('name_html').split('</i> ')[1].strip()
+                
+                result = (acceptedName, acceptedAuthor, family)
+                return result
+            except Exception:
+                # no accepted name was given
+                return (None, None, None)
+
+    def recordLatency(self, endpoint, elapsed):
+        """ remembers the recent response times of each web endpoint, for
+        diagnosing slow alignments. """
+        self.latencies.setdefault(endpoint, deque(maxlen=50)).append(elapsed)
+
+    def prefetchAlignments(self, records):
+        """ given a list of (key, rowData) tuples, resolves each distinct
+        scientificName not yet known in as few web requests as possible. The
+        results are stored in alignmentCache, where retrieveAlignment finds
+        them as each record is verified. Only TNRS accepts bulk requests, other
+        sources are left to resolve one record at a time. Called on the
+        refinementWorker's thread."""
+        if self.TaxAlignSource != 'Taxonomic Name Resolution Service (web API)':
+            return
+        names = pd.Series([rowData.get('scientificName', '') for _, rowData in records], dtype=object)
+        names = self.normalizeSeries(names).unique()
+        names = sorted(x for x in names if x != '' and
+                       self.sessionAlignment(x) is None and
+                       self.alignmentCache.get(self.alignmentKey(x)) is None)
+        if len(names) == 0:
+            return
+        batchSize = max(1, self.value_TNRS_BatchSize)
+        batches = [names[i: i + batchSize] for i in range(0, len(names), batchSize)]
+        scheduler = self.parent.scheduler
+        for items in scheduler.map(self.getTNRSBatch, batches, self.value_TNRS_MaxInFlight):
+            if items is None:
+                # failed batches are retried one record at a time
+                continue
+            for name, data in items.items():
+                for retrieveAuth in [False, True]:
+                    result = self.parseTNRSItem(data, retrieveAuth)
+                    self.alignmentCache.set(self.alignmentKey(name, retrieveAuth), result)
+
+    def alignmentKey(self, querySciName, retrieveAuth=False):
+        """ returns the alignmentCache key for a query. Settings which change
+        a service's answer (ie: the TNRS score threshold) are part of it. """
+        threshold = None
+        if self.TaxAlignSource == 'Taxonomic Name Resolution Service (web API)':
+            threshold = self.value_TNRS_Threshold
+        return (self.TaxAlignSource, self.value_Kingdom, threshold, querySciName, retrieveAuth)
+
+    def getTNRSBatch(self, names, timeout=20):
+        """ requests the best TNRS match for each of a list of normalized
+        names in a single request. Returns {name: item}, or None if the
+        request failed. Names without a match in the response are omitted."""
+        urlInputStr = ','.join(names).replace(' ', '%20')
+        url = f'http://tnrs.iplantc.org/tnrsm-svc/matchNames?retrieve=best&names={urlInputStr}'
+        try:
+            response = self.parent.scheduler.get('TNRS', url, timeout=timeout)
+            if response.status_code != requests.codes.ok:
+                return None
+            items = response.json().get('items', [])
+        except Exception as e:
+            print(f'bulk TNRS request failed: {e}')
+            return None
+        results = {}
+        for data in items:
+            # items are returned in submitted order, 'group' is that position
+            try:
+                name = names[int(data.get('group'))]
+            except (TypeError, ValueError, IndexError):
+                name = self.normalizeStrInput(str(data.get('nameSubmitted', '')))
+            if name in names and name not in results:
+                results[name] = data
+        return results
+
+    def parseTNRSItem(self, data, retrieveAuth=False):
+        """ returns the alignment tuple from a TNRS response item """
+        result = (None, None, None)
+        score = 0
+        try:
+            if retrieveAuth:
+                # if authority requested for potentially non-accepted name
+                acceptedName = data.get('nameScientific', None)
+                acceptedAuthor = data.get('authorAttributed', None)
+                family = None
+            else:
+                # otherwise, retrieve accepted details.
+                acceptedName = data.get('acceptedName', None)
+                acceptedAuthor = data.get('acceptedAuthor', None)
+                family = data.get('family', None)
+            score = float(data.get('scientificScore', 0)) # the confidence in the return
+        except Exception as e:
+            print(e)
+            pass
+        if score >= float(self.value_TNRS_Threshold)/100:
+            result = (acceptedName, acceptedAuthor, family)
         return result
 
     def getTNRS(self, inputStr, retrieveAuth=False, timeout = 5):
@@ -366,15 +665,18 @@ class taxonomicVerification():
 
         #result = (None, None)
         result = (None, None, None)
-        score = 0
         urlInputStr = inputStr.replace(' ','%20')
         # TODO add an optional dialog box with a list of the top returned results. Allow user to pick from list.
         url = f'http://tnrs.iplantc.org/tnrsm-svc/matchNames?retrieve=best&names={urlInputStr}'
         try:
-            response = requests.get(url, timeout = timeout)
+            response = self.parent.scheduler.get('TNRS', url, timeout = timeout)
         except ReadTimeout:
+            if getattr(self.quiet, 'active', False):
+                return False
             message = 'Taxonomic Name Resolution Service request timed out. This may be an internet connectivity problem, or an issue with the service. No changes have been made.'
             details = 'Check internet connection, or try a different alignment service. If you do not have internet connectivity, use the local alignment service.'
+            if self.parent.deferDecision('Lookup error', f'{inputStr}: {message}'):
+                return False
             notice = self.parent.userNotice(message, 'Taxonomic alignment', inclHalt=True, retry=True)
             if notice == QMessageBox.Retry:  # if clicked retry, do it.
                 timeout += 2
@@ -382,27 +684,16 @@ class taxonomicVerification():
                 return self.getTNRS(inputStr, retrieveAuth, timeout = timeout)
             else:
                 return False
-        if response.status_code == requests.codes.ok:
-            data = response.json().get('items', None)[0]
-            time.sleep(1)  # use a sleep to be polite to the service
-
-            try:
-                if retrieveAuth:
-                    # if authority requested for potentially non-accepted name
-                    acceptedName = data.get('nameScientific', None)
-                    acceptedAuthor = data.get('authorAttributed', None)
-                    family = None
-                else:
-                    # otherwise, retrieve accepted details.
-                    acceptedName = data.get('acceptedName', None)
-                    acceptedAuthor = data.get('acceptedAuthor', None)
-                    family = data.get('family', None)
-                score = float(data.get('scientificScore', 0)) # the confidence in the return
-            except Exception as e:
-                print(e)
-                pass
-            if score >= float(self.value_TNRS_Threshold)/100:
-                result = (acceptedName, acceptedAuthor, family)
+        except RequestException:
+            return False  # ie: offline, nothing is remembered
+        if response.status_code != requests.codes.ok:
+            return False
+        try:
+            items = response.json().get('items', None)
+        except ValueError:
+            return False  # not a usable response
+        if items:
+            result = self.parseTNRSItem(items[0], retrieveAuth)
 
         return result
 
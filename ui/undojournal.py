@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A delta based undo / redo journal for the PandasTableModel. Rather than
+storing a copy of the entire datatable at each checkpoint, each journal entry
+stores only the cells, rows and columns which were altered.
+"""
+import sys
+import pandas as pd
+
+
+class journalEntry():
+    """ a single undoable action, holding the deltas necessary to revert or
+    reapply it. Deltas are stored in the order they were made as tuples of:
+        ('cells', rows, colName, oldValues, newValues)
+        ('insert', positions, rowsDF)
+        ('remove', positions, rowsDF)
+        ('addCols', colNames)
+        ('replace', oldDF, newDF)
+    """
+    def __init__(self, selection, description):
+        self.selection = selection  # the tree selection, as (selType, siteNum, specimenNum)
+        self.description = description  # used for the undo / redo tooltips
+        self.deltas = []
+        self.size = 0  # approximate bytes held by this entry
+
+    def addDelta(self, delta):
+        """ appends a delta, coalescing repeated edits of the same cells
+        (ie: each keystroke in the form view) into a single delta """
+        if delta[0] == 'cells' and len(self.deltas) > 0:
+            last = self.deltas[-1]
+            if last[0] == 'cells' and last[2] == delta[2] and last[1] == delta[1]:
+                # keep the original oldValues, only the newValues changed
+                self.size -= estimateSize(last)
+                last = ('cells', last[1], last[2], last[3], delta[4])
+                self.deltas[-1] = last
+                self.size += estimateSize(last)
+                return
+        self.deltas.append(delta)
+        self.size += estimateSize(delta)
+
+
+def estimateSize(delta):
+    """ returns a rough number of bytes held by a delta. """
+    kind = delta[0]
+    if kind == 'cells':
+        _, rows, _, oldValues, newValues = delta
+        size = sum(sys.getsizeof(x) for x in oldValues)
+        size += sum(sys.getsizeof(x) for x in newValues)
+        # each list holds a pointer per item
+        size += 8 * (len(rows) + len(oldValues) + len(newValues))
+    elif kind in ['insert', 'remove']:
+        size = 8 * len(delta[1]) + int(delta[2].memory_usage(deep=True).sum())
+    elif kind == 'replace':
+        # both frames are copies, held exclusively by the journal
+        size = 0
+        for df in delta[1:]:
+            if isinstance(df, pd.DataFrame):
+                size += int(df.memory_usage(deep=True).sum())
+    else:
+        size = sum(sys.getsizeof(x) for x in delta[1])
+    return size
+
+
+class undoJournal():
+    """ holds the undo and redo stacks of journalEntry objects. Deltas are
+    always recorded into the most recent undo entry, mirroring the old
+    checkpoint behaviour where undoing restored the table to the state it was
+    in just before the last major action."""
+    def __init__(self, maxBytes=256 * 1024 * 1024, maxEntries=40):
+        self.undoList = []  # holds the entries
+        self.redoList = []  # entries which have been undone
+        self.maxBytes = maxBytes
+        self.maxEntries = maxEntries
+
+    def clear(self):
+        self.undoList = []
+        self.redoList = []
+
+    def checkpoint(self, selection, description):
+        """ opens a new entry which will collect the following deltas """
+        self.undoList.append(journalEntry(selection, description))
+        self.redoList = []  # if we're adding to undoList, clear redoList
+        self.trim()
+
+    def record(self, delta):
+        """ records a delta into the most recent entry. If no checkpoint was
+        set, there is nothing to return to and the delta is discarded. """
+        if len(self.undoList) == 0:
+            return
+        self.undoList[-1].addDelta(delta)
+        # any new edits invalidate what had been undone.
+        self.redoList = []
+        self.trim()
+
+    def trim(self):
+        """ drops the oldest entries until the journal is within budget.
+        The most recent entry is always kept. """
+        while len(self.undoList) > max(self.maxEntries, 1):
+            self.undoList.pop(0)
+        total = sum(x.size for x in self.undoList + self.redoList)
+        while total > self.maxBytes and len(self.undoList) > 1:
+            total -= self.undoList.pop(0).size
+
+    def popUndo(self):
+        """ returns the most recent entry to be undone, or None """
+        try:
+            entry = self.undoList.pop()
+        except IndexError:
+            return None
+        self.redoList.append(entry)
+        return entry
+
+    def popRedo(self):
+        """ returns the most recent entry to be redone, or None """
+        try:
+            entry = self.redoList.pop()
+        except IndexError:
+            return None
+        self.undoList.append(entry)
+        return entry
+
+    def nextUndoDescription(self):
+        if len(self.undoList) > 0:
+            return self.undoList[-1].description
+        return None
+
+    def nextRedoDescription(self):
+        if len(self.redoList) > 0:
+            return self.redoList[-1].description
+        return None